@@ -0,0 +1,300 @@
+"""benchmarks for the echo servers
+
+Each benchmark is a sub-command and starts its own server in a thread on a
+free port.  Run it from this directory:
+
+    $ python bench.py stream --bufsizes 16 4096 65536 --megabytes 256
+    $ python bench.py stress selectors threads --clients 1000 --size 65536
+    $ python bench.py pool --requests 5000 --clients 1 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import signal
+import socket
+import sys
+import threading
+import time
+
+import connection_pool
+import echo_server
+import stream_echo
+
+
+MODES = {
+    'selectors': echo_server.event_server,
+    'threads': echo_server.threaded_server,
+}
+
+
+def listen():
+    """returns a listening socket on a free port of 127.0.0.1"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    return sock
+
+
+class Zeros():
+    """an endless source of zero bytes that never allocates"""
+
+    def readinto(self, buffer):
+        # the sending buffer starts zeroed and is never written to
+        return len(buffer)
+
+
+class Discard():
+    """a sink that throws away what it is given"""
+
+    def write(self, data):
+        pass
+
+
+def bench_stream(args):
+    """MB/s echoing one large message through stream_echo per buffer size"""
+    length = args.megabytes * 1024 * 1024
+    print('{0:>10} {1:>10} {2:>12}'.format('bufsize', 'MB/s', 'max RSS KiB'))
+    devnull = open(os.devnull, 'w')
+    for bufsize in args.bufsizes:
+        sock = listen()
+        server = threading.Thread(
+            target=stream_echo.serve, args=(sock, devnull, bufsize),
+            daemon=True
+        )
+        server.start()
+        try:
+            with socket.create_connection(sock.getsockname()) as conn:
+                start = time.perf_counter()
+                stream_echo.echo_stream(conn, Zeros(), length, Discard(),
+                                        bufsize)
+                elapsed = time.perf_counter() - start
+        finally:
+            sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+            server.join(5)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print('{0:>10} {1:>10.1f} {2:>12}'.format(
+            bufsize, length / elapsed / 1e6, rss))
+    devnull.close()
+
+
+def free_address():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()
+
+
+def _run_server(mode, address):
+    with open(os.devnull, 'w') as devnull:
+        MODES[mode](log_buffer=devnull, address=address)
+
+
+def start_server(mode, address):
+    """start an echo server in a child process and wait until it accepts"""
+    proc = multiprocessing.Process(target=_run_server, args=(mode, address),
+                                   daemon=True)
+    proc.start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(address, timeout=1).close()
+        except OSError:
+            time.sleep(0.05)
+        else:
+            return proc
+    proc.kill()
+    raise RuntimeError('{0} server did not start'.format(mode))
+
+
+def stop_server(proc):
+    os.kill(proc.pid, signal.SIGINT)
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+
+
+def raise_fd_limit():
+    """raise the open file limit as far as allowed, returning it"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+async def _echo_client(address, message, pause, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(*address), timeout
+    )
+    try:
+        writer.write(message)
+        await writer.drain()
+        # a slow reader: the whole message is sent before any is read
+        await asyncio.sleep(pause)
+        reply = await asyncio.wait_for(reader.readexactly(len(message)),
+                                       timeout)
+        writer.write_eof()
+        trailing = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return reply == message and not trailing
+
+
+async def _run_clients(address, clients, size, pause, timeout):
+    messages = [os.urandom(size) for _ in range(min(clients, 64))]
+    tasks = [
+        _echo_client(address, messages[i % len(messages)], pause, timeout)
+        for i in range(clients)
+    ]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_clients(address, clients, size, pause=0.0, timeout=60.0):
+    """echo `size` random bytes over each of `clients` simultaneous
+    connections, pausing `pause` seconds between sending and reading
+
+    Returns a dict with the number of exact echoes, the failures by type
+    and the connections/sec and aggregate MB/s achieved.
+    """
+    start = time.perf_counter()
+    results = asyncio.run(_run_clients(address, clients, size, pause,
+                                       timeout))
+    elapsed = time.perf_counter() - start
+    exact = sum(1 for result in results if result is True)
+    failures = {}
+    for result in results:
+        if result is not True:
+            name = 'mismatch' if result is False else type(result).__name__
+            failures[name] = failures.get(name, 0) + 1
+    return {
+        'exact': exact,
+        'failures': failures,
+        'elapsed': elapsed,
+        'connections_per_s': clients / elapsed,
+        # every byte goes to the server and comes back
+        'mb_per_s': 2 * exact * size / elapsed / 1e6,
+    }
+
+
+def bench_stress(args):
+    """many simultaneous clients per concurrent server mode"""
+    limit = raise_fd_limit()
+    if limit < args.clients * 2 + 64:
+        sys.exit('open file limit {0} is too low'.format(limit))
+    print('{0:<10} {1:>8} {2:>10} {3:>10} {4}'.format(
+        'mode', 'exact', 'conn/s', 'MB/s', 'failures'))
+    for mode in args.modes or sorted(MODES):
+        address = free_address()
+        proc = start_server(mode, address)
+        try:
+            result = run_clients(address, args.clients, args.size,
+                                 args.pause)
+        finally:
+            stop_server(proc)
+        print('{0:<10} {1:>8} {2:>10.1f} {3:>10.1f} {4}'.format(
+            mode, result['exact'], result['connections_per_s'],
+            result['mb_per_s'], result['failures'] or ''))
+
+
+def unpooled_echo(msg, address):
+    """echo `msg` over a connection of its own, as echo_client does"""
+    data = msg.encode('utf8')
+    with socket.create_connection(address) as sock:
+        sock.sendall(data)
+        reply = bytearray()
+        while len(reply) < len(data):
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError('connection closed mid-echo')
+            reply += chunk
+    return reply.decode('utf8')
+
+
+def _echo_loop(echo, msg, requests, failures):
+    for _ in range(requests):
+        if echo(msg) != msg:
+            failures.append(msg)
+
+
+def bench_pool(args):
+    """echo requests/sec with a connection per request and with a pool"""
+    msg = 'x' * args.size
+    address = free_address()
+    proc = start_server(args.mode, address)
+    try:
+        print('{0:<10} {1:>8} {2:>12} {3:>8}'.format(
+            'client', 'threads', 'req/s', 'created'))
+        for clients in args.clients:
+            pool = connection_pool.ConnectionPool(max_size=clients)
+            runs = [
+                ('unpooled', lambda m: unpooled_echo(m, address)),
+                ('pooled', lambda m: connection_pool.echo(pool, m, address)),
+            ]
+            for name, echo in runs:
+                failures = []
+                threads = [
+                    threading.Thread(target=_echo_loop, args=(
+                        echo, msg, args.requests // clients, failures))
+                    for _ in range(clients)
+                ]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+                created = (pool.stats()['created'] if name == 'pooled'
+                           else args.requests // clients * clients)
+                print('{0:<10} {1:>8} {2:>12.1f} {3:>8}{4}'.format(
+                    name, clients,
+                    args.requests // clients * clients / elapsed, created,
+                    ' {0} bad echoes'.format(len(failures)) if failures
+                    else ''))
+            pool.close()
+    finally:
+        stop_server(proc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    stream = commands.add_parser('stream',
+                                 help='framed echo MB/s by buffer size')
+    stream.add_argument('--bufsizes', type=int, nargs='+',
+                        default=[16, 256, 4096, 65536, 262144])
+    stream.add_argument('--megabytes', type=int, default=64,
+                        help='size of the echoed message')
+    stream.set_defaults(func=bench_stream)
+
+    stress = commands.add_parser('stress',
+                                 help='simultaneous clients per server mode')
+    stress.add_argument('modes', nargs='*', metavar='mode',
+                        help='one of: ' + ', '.join(sorted(MODES)))
+    stress.add_argument('--clients', type=int, default=1000)
+    stress.add_argument('--size', type=int, default=65536,
+                        help='bytes each client echoes')
+    stress.add_argument('--pause', type=float, default=0.0,
+                        help='seconds each client waits before reading')
+    stress.set_defaults(func=bench_stress)
+
+    pool = commands.add_parser('pool',
+                               help='echo req/s with and without pooling')
+    pool.add_argument('--mode', default='threads',
+                      help='one of: ' + ', '.join(sorted(MODES)))
+    pool.add_argument('--requests', type=int, default=5000)
+    pool.add_argument('--clients', type=int, nargs='+', default=[1, 8],
+                      help='client thread counts to run')
+    pool.add_argument('--size', type=int, default=64,
+                      help='characters in each message')
+    pool.set_defaults(func=bench_pool)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
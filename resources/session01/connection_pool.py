@@ -0,0 +1,230 @@
+"""a pool of open TCP connections for clients that talk to the same
+servers over and over
+
+Connecting costs a name lookup, a round trip for the handshake and, on the
+server, an accept and whatever setup it does per connection.  A
+`ConnectionPool` keeps connections it has handed out and had back, per
+host and port, and hands them out again:
+
+    pool = ConnectionPool()
+    with pool.connection('localhost', 10000) as sock:
+        sock.sendall(...)
+
+A connection that raised is closed rather than returned, and one that has
+been idle too long, or that the server has closed or sent unexpected
+bytes on, is dropped at checkout.  A client that finds a connection
+cannot be used again, as after a response framed by closing it, calls
+`discard`.
+"""
+import collections
+import contextlib
+import socket
+import threading
+import time
+
+from resolver import RESOLVER
+
+
+class PoolTimeout(TimeoutError):
+    """raised when no connection became free in time"""
+
+
+def is_healthy(sock):
+    """True if `sock` is still open and has nothing unread on it
+
+    A connection sitting in the pool should have nothing to read: data
+    means the previous exchange was not read in full, and end of stream
+    means the server closed it.  Peeking without blocking tells which.
+    """
+    try:
+        sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except (BlockingIOError, InterruptedError):
+        return True
+    except OSError:
+        return False
+    return False
+
+
+class ConnectionPool():
+    """open TCP connections kept per (host, port), safe to share between
+    threads
+
+    At most `max_size` connections to one host and port are open at once;
+    `acquire` waits up to `timeout` seconds for one to be released beyond
+    that.  Connections idle for `idle_timeout` seconds are closed.
+    """
+
+    def __init__(self, max_size=8, idle_timeout=30.0, timeout=10.0,
+                 connect_timeout=5.0, resolver=RESOLVER,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.resolver = resolver
+        self.clock = clock
+        self.created = self.reused = self.expired = self.unhealthy = 0
+        # (host, port) -> deque of (released at, socket), newest last
+        self._idle = collections.defaultdict(collections.deque)
+        # (host, port) -> number of connections open, idle or not
+        self._open = collections.Counter()
+        # socket -> (host, port) for connections handed out
+        self._leased = {}
+        self._closed = False
+        self._lock = threading.Condition()
+
+    def stats(self):
+        """returns the pool counters as a dict"""
+        with self._lock:
+            return {
+                'open': sum(self._open.values()),
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'leased': len(self._leased),
+                'created': self.created,
+                'reused': self.reused,
+                'expired': self.expired,
+                'unhealthy': self.unhealthy,
+            }
+
+    def acquire(self, host, port):
+        """returns a connected socket to `host`:`port`, reusing an idle
+        one if there is a healthy one
+        """
+        key = (host, port)
+        deadline = self.clock() + self.timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError('connection pool is closed')
+                self._expire(key)
+                idle = self._idle[key]
+                while idle:
+                    # the most recently used connection is the likeliest
+                    # to still be open
+                    sock = idle.pop()[1]
+                    if is_healthy(sock):
+                        self.reused += 1
+                        self._leased[sock] = key
+                        return sock
+                    self.unhealthy += 1
+                    self._drop(key, sock)
+                if self._open[key] < self.max_size:
+                    self._open[key] += 1
+                    break
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        'no connection to {0}:{1} became free'.format(*key)
+                    )
+                self._lock.wait(remaining)
+        try:
+            sock = self._connect(host, port)
+        except BaseException:
+            with self._lock:
+                self._open[key] -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self.created += 1
+            self._leased[sock] = key
+        return sock
+
+    def _connect(self, host, port):
+        error = OSError('no addresses for {0}:{1}'.format(host, port))
+        for info in self.resolver.resolve(host, port):
+            sock = socket.socket(info.family, info.type, info.protocol)
+            try:
+                sock.settimeout(self.connect_timeout)
+                sock.connect(info.address)
+                sock.settimeout(None)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError as e:
+                sock.close()
+                error = e
+            else:
+                return sock
+        raise error
+
+    def release(self, sock):
+        """give back a socket from `acquire` for reuse"""
+        with self._lock:
+            key = self._leased.pop(sock, None)
+            if key is None:
+                # discarded already
+                return
+            if self._closed:
+                self._drop(key, sock)
+            else:
+                self._idle[key].append((self.clock(), sock))
+            self._lock.notify()
+
+    def discard(self, sock):
+        """close a socket from `acquire` instead of giving it back"""
+        with self._lock:
+            key = self._leased.pop(sock, None)
+            if key is not None:
+                self._drop(key, sock)
+                self._lock.notify()
+            else:
+                sock.close()
+
+    @contextlib.contextmanager
+    def connection(self, host, port):
+        """a context manager lending a connection, which is released on
+        leaving it normally and discarded if an exception escapes
+        """
+        sock = self.acquire(host, port)
+        try:
+            yield sock
+        except BaseException:
+            self.discard(sock)
+            raise
+        self.release(sock)
+
+    def evict_idle(self):
+        """close every connection idle for longer than `idle_timeout`"""
+        with self._lock:
+            for key in list(self._idle):
+                self._expire(key)
+
+    def close(self):
+        """close the idle connections and any released from now on"""
+        with self._lock:
+            self._closed = True
+            for key, idle in self._idle.items():
+                while idle:
+                    self._drop(key, idle.pop()[1])
+            self._lock.notify_all()
+
+    def _expire(self, key):
+        idle = self._idle[key]
+        cutoff = self.clock() - self.idle_timeout
+        # the oldest are on the left
+        while idle and idle[0][0] <= cutoff:
+            self.expired += 1
+            self._drop(key, idle.popleft()[1])
+
+    def _drop(self, key, sock):
+        self._open[key] -= 1
+        sock.close()
+
+
+def echo(pool, msg, address=('localhost', 10000)):
+    """echo `msg` over a pooled connection and return the reply
+
+    For the servers in echo_server.py, which echo until the client closes,
+    so the reply is known to be complete once it is as long as the
+    message.
+    """
+    data = msg.encode('utf8')
+    reply = bytearray(len(data))
+    view = memoryview(reply)
+    with pool.connection(*address) as sock:
+        sock.sendall(data)
+        received = 0
+        while received < len(data):
+            count = sock.recv_into(view[received:])
+            if not count:
+                raise ConnectionError('connection closed mid-echo')
+            received += count
+    return reply.decode('utf8')
@@ -1,5 +1,8 @@
+import selectors
 import socket
 import sys
+import threading
+import types
 
 
 def server(log_buffer=sys.stderr):
@@ -71,6 +74,166 @@ def server(log_buffer=sys.stderr):
         print('quitting echo server', file=log_buffer)
 
 
+# how much event_server and threaded_server read from a connection at once
+BUFSIZE = 65536
+# how many bytes event_server holds for a client before it stops reading
+# from it
+MAX_BUFFERED = 1024 * 1024
+
+
+def _listen(address, backlog, log_buffer, kind):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    print("making {0} server on {1}:{2}".format(kind, *address),
+          file=log_buffer)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+def echo_connection(conn, bufsize=BUFSIZE):
+    """echo everything received on the blocking `conn` until the client
+    closes its end; returns the number of bytes echoed
+    """
+    buffer = bytearray(bufsize)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        count = conn.recv_into(view)
+        if not count:
+            return total
+        conn.sendall(view[:count])
+        total += count
+
+
+def _serve_thread(conn, addr, log_buffer, bufsize):
+    try:
+        total = echo_connection(conn, bufsize)
+        print('echoed {0} bytes to {1}:{2}'.format(total, *addr),
+              file=log_buffer)
+    except OSError as e:
+        print('connection {0}:{1} failed: {2}'.format(*addr, e),
+              file=log_buffer)
+    finally:
+        conn.close()
+
+
+def threaded_server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+                    backlog=1024, bufsize=BUFSIZE):
+    """serve every connection from a thread of its own
+
+    A slow reader blocks only its own thread in `sendall`, which stops
+    that thread reading too, so at most `bufsize` bytes are held for it.
+    """
+    sock = _listen(address, backlog, log_buffer, 'a threaded')
+    try:
+        while True:
+            conn, addr = sock.accept()
+            print('connection - {0}:{1}'.format(*addr), file=log_buffer)
+            threading.Thread(target=_serve_thread,
+                             args=(conn, addr, log_buffer, bufsize),
+                             daemon=True).start()
+    except KeyboardInterrupt:
+        print('quitting echo server', file=log_buffer)
+    finally:
+        sock.close()
+
+
+def event_server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+                 backlog=1024, bufsize=BUFSIZE, max_buffered=MAX_BUFFERED):
+    """serve many connections at once from a single selectors event loop
+
+    What a connection sends is appended to its own write buffer and sent
+    back as the socket accepts it.  A client that sends faster than it
+    reads is not read from while `max_buffered` bytes are waiting for it,
+    so it cannot make the server hold more than that, and other clients
+    are unaffected.
+    """
+    sel = selectors.DefaultSelector()
+    sock = _listen(address, backlog, log_buffer, 'an event')
+    sock.setblocking(False)
+    sel.register(sock, selectors.EVENT_READ, data=None)
+
+    try:
+        while True:
+            for key, mask in sel.select():
+                if key.data is None:
+                    _accept_connection(sel, key.fileobj, log_buffer)
+                else:
+                    _service_connection(sel, key, mask, log_buffer, bufsize,
+                                        max_buffered)
+    except KeyboardInterrupt:
+        print('quitting echo server', file=log_buffer)
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+
+
+def _accept_connection(sel, sock, log_buffer):
+    """accept every pending connection and register it for reading"""
+    while True:
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return
+        print('connection - {0}:{1}'.format(*addr), file=log_buffer)
+        conn.setblocking(False)
+        state = types.SimpleNamespace(addr=addr, outb=bytearray(), eof=False,
+                                      total=0)
+        sel.register(conn, selectors.EVENT_READ, data=state)
+
+
+def _close_connection(sel, conn, state, log_buffer):
+    print('echoed {0} bytes to {1}:{2}'.format(state.total, *state.addr),
+          file=log_buffer)
+    sel.unregister(conn)
+    conn.close()
+
+
+def _service_connection(sel, key, mask, log_buffer, bufsize, max_buffered):
+    """read what is available from a connection and write what fits"""
+    conn, state = key.fileobj, key.data
+    if mask & selectors.EVENT_READ:
+        try:
+            data = conn.recv(bufsize)
+        except (BlockingIOError, InterruptedError):
+            data = None
+        except ConnectionError:
+            _close_connection(sel, conn, state, log_buffer)
+            return
+        if data:
+            state.outb += data
+            state.total += len(data)
+        elif data is not None:
+            state.eof = True
+    if mask & selectors.EVENT_WRITE or state.outb:
+        try:
+            sent = conn.send(state.outb)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except ConnectionError:
+            _close_connection(sel, conn, state, log_buffer)
+            return
+        # deleting from the front of a bytearray does not copy the rest
+        del state.outb[:sent]
+    if state.eof and not state.outb:
+        _close_connection(sel, conn, state, log_buffer)
+        return
+    events = 0
+    if not state.eof and len(state.outb) < max_buffered:
+        events |= selectors.EVENT_READ
+    if state.outb:
+        events |= selectors.EVENT_WRITE
+    if events != key.events:
+        sel.modify(conn, events, data=state)
+
+
 if __name__ == '__main__':
-    server()
+    if '--selectors' in sys.argv[1:]:
+        event_server()
+    elif '--threads' in sys.argv[1:]:
+        threaded_server()
+    else:
+        server()
     sys.exit(0)
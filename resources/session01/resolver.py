@@ -0,0 +1,190 @@
+"""a caching getaddrinfo resolver
+
+`socket.getaddrinfo` blocks for as long as the lookup takes and remembers
+nothing, so a client that connects to the same host over and over pays for
+the lookup every time.  A `Resolver` keeps successful answers for `ttl`
+seconds and failures for `negative_ttl` seconds, makes concurrent callers
+asking for the same name share one lookup, and resolves batches of names
+in parallel in a thread pool.  Answers are returned as tuples of
+`AddressInfo` records rather than the bare tuples getaddrinfo gives.
+"""
+import collections
+import concurrent.futures
+import socket
+import threading
+import time
+
+
+AddressInfo = collections.namedtuple(
+    'AddressInfo', 'family type protocol canonical_name address'
+)
+
+# the outcome of one lookup in a batch; exactly one of records and error
+# is None
+Resolution = collections.namedtuple(
+    'Resolution', 'host port records error'
+)
+
+# failures that say the name does not exist, rather than that the lookup
+# could not be made just now, and so are worth remembering
+_NEGATIVE_ERRORS = {
+    getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA',
+                                       'EAI_SERVICE', 'EAI_ADDRFAMILY')
+    if hasattr(socket, name)
+}
+
+
+class Resolver():
+    """getaddrinfo with a TTL cache, safe to share between threads
+
+    At most `max_entries` answers are kept, the least recently used being
+    dropped first.  `getaddrinfo` and `clock` can be replaced, for tests.
+    """
+
+    def __init__(self, ttl=60.0, negative_ttl=5.0, max_entries=1024,
+                 workers=8, getaddrinfo=socket.getaddrinfo,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.workers = workers
+        self.getaddrinfo = getaddrinfo
+        self.clock = clock
+        self.hits = self.negative_hits = self.misses = 0
+        # key -> (expires, records or None, gaierror or None)
+        self._entries = collections.OrderedDict()
+        # key -> Future of a lookup in progress
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def stats(self):
+        """returns the cache counters as a dict"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+            }
+
+    def clear(self):
+        """forget every cached answer"""
+        with self._lock:
+            self._entries.clear()
+
+    def resolve(self, host, port, family=0, type=socket.SOCK_STREAM,
+                proto=0, flags=0):
+        """returns the AddressInfo records for `host` and `port`
+
+        Raises socket.gaierror if the name cannot be resolved, from the
+        cache if it failed within the last `negative_ttl` seconds.
+        """
+        key = (host, port, family, type, proto, flags)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, records, error = entry
+                if expires > self.clock():
+                    self._entries.move_to_end(key)
+                    if error is None:
+                        self.hits += 1
+                        return records
+                    self.negative_hits += 1
+                    raise socket.gaierror(*error.args)
+                del self._entries[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._pending[key] = concurrent.futures.Future()
+        if not owner:
+            # someone else is already looking this name up
+            return future.result()
+
+        try:
+            records = self._lookup(key)
+        except socket.gaierror as e:
+            self._finish(key, future, None, e)
+            raise
+        except BaseException as e:
+            self._finish(key, future, None, e, store=False)
+            raise
+        self._finish(key, future, records, None)
+        return records
+
+    def _lookup(self, key):
+        return tuple(AddressInfo(*info) for info in self.getaddrinfo(*key))
+
+    def _finish(self, key, future, records, error, store=True):
+        with self._lock:
+            del self._pending[key]
+            if error is None:
+                ttl = self.ttl
+            elif store and error.args[0] in _NEGATIVE_ERRORS:
+                ttl = self.negative_ttl
+            else:
+                ttl = 0
+            if ttl > 0:
+                self._entries[key] = (self.clock() + ttl, records, error)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if error is None:
+            future.set_result(records)
+        else:
+            future.set_exception(error)
+
+    def resolve_many(self, pairs, family=0, type=socket.SOCK_STREAM):
+        """resolve many (host, port) pairs at once in the thread pool
+
+        Returns a Resolution for every pair, in order.  Cached names are
+        answered without a thread and a failed lookup does not stop the
+        others, whether it fails with a gaierror or, like a name that
+        cannot be IDNA-encoded, with some other error.
+        """
+        pairs = [tuple(pair) for pair in pairs]
+        futures = {}
+        for pair in pairs:
+            if pair not in futures:
+                futures[pair] = self._submit(pair, family, type)
+        resolutions = []
+        for host, port in pairs:
+            try:
+                records = futures[host, port].result()
+            except (OSError, UnicodeError) as e:
+                resolutions.append(Resolution(host, port, None, e))
+            else:
+                resolutions.append(Resolution(host, port, records, None))
+        return resolutions
+
+    def _submit(self, pair, family, type):
+        key = pair + (family, type, 0, 0)
+        with self._lock:
+            entry = self._entries.get(key)
+            cached = entry is not None and entry[0] > self.clock()
+        if cached:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(self.resolve(*pair, family, type))
+            except socket.gaierror as e:
+                future.set_exception(e)
+            return future
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.workers, thread_name_prefix='resolver'
+                )
+            executor = self._executor
+        return executor.submit(self.resolve, *pair, family, type)
+
+    def close(self):
+        """stop the batch thread pool; the cache stays usable"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+# the resolver shared by the clients in this package
+RESOLVER = Resolver()
@@ -1,5 +1,7 @@
 import socket
 
+from resolver import RESOLVER
+
 
 def get_constants(prefix):
     return {getattr(socket, n): n for n in dir(socket) if n.startswith(prefix)}
@@ -11,8 +13,8 @@ protocols = get_constants('IPPROTO_')
 
 
 def get_address_info(host, port):
-    for response in socket.getaddrinfo(host, port):
-        fam, typ, pro, nam, add = response
+    for info in RESOLVER.resolve(host, port, type=0):
+        fam, typ, pro, nam, add = info
         print('family: {}'.format(families[fam]))
         print('type: {}'.format(types[typ]))
         print('protocol: {}'.format(protocols[pro]))
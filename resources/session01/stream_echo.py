@@ -0,0 +1,255 @@
+"""an echo server and client for messages of any size
+
+The echo in echo_server.py has no way to tell where a message ends, so the
+client has to guess from the size of the last chunk, and it decodes every
+16-byte chunk as it arrives, which breaks multibyte characters split
+across chunks.  Here every message is framed by an 8-byte big-endian length
+and treated as bytes.  Both ends move data through one preallocated buffer
+with `recv_into` and memoryview slices, so no bytes objects are created per
+chunk and a message of several gigabytes is echoed in constant memory:
+
+    $ python stream_echo.py                 # in one terminal
+    $ python stream_echo.py big.iso         # echo a file from another
+"""
+import hashlib
+import os
+import socket
+import struct
+import sys
+import threading
+
+
+ADDRESS = ('127.0.0.1', 10001)
+BUFSIZE = 65536
+HEADER = struct.Struct('!Q')
+
+
+def recv_exactly(sock, view):
+    """fill the memoryview `view` from `sock`
+
+    Returns False if the peer closed the connection before sending
+    anything, and raises ConnectionError if it closed part way.
+    """
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            if not received:
+                return False
+            raise ConnectionError('connection closed mid-message')
+        received += count
+    return True
+
+
+def read_header(sock):
+    """returns the length of the next message, or None at end of stream"""
+    header = bytearray(HEADER.size)
+    if not recv_exactly(sock, memoryview(header)):
+        return None
+    return HEADER.unpack(header)[0]
+
+
+def echo_message(sock, length, buffer):
+    """receive `length` bytes and send each piece back as it arrives"""
+    view = memoryview(buffer)
+    remaining = length
+    while remaining:
+        count = sock.recv_into(view, min(remaining, len(view)))
+        if not count:
+            raise ConnectionError('connection closed mid-message')
+        sock.sendall(view[:count])
+        remaining -= count
+
+
+def serve_connection(conn, bufsize=BUFSIZE):
+    """echo messages on `conn` until the client closes it; returns the
+    number of messages and bytes echoed
+    """
+    buffer = bytearray(bufsize)
+    messages = total = 0
+    while True:
+        length = read_header(conn)
+        if length is None:
+            return messages, total
+        conn.sendall(HEADER.pack(length))
+        echo_message(conn, length, buffer)
+        messages += 1
+        total += length
+
+
+def serve(sock, log_buffer=sys.stderr, bufsize=BUFSIZE):
+    """accept connections on the listening `sock` one at a time until it
+    is closed
+    """
+    while True:
+        try:
+            conn, addr = sock.accept()
+        except OSError:
+            return
+        try:
+            print('connection - {0}:{1}'.format(*addr), file=log_buffer)
+            messages, total = serve_connection(conn, bufsize)
+            print('echoed {0} messages, {1} bytes'.format(messages, total),
+                  file=log_buffer)
+        except OSError as e:
+            print('connection failed: {0}'.format(e), file=log_buffer)
+        finally:
+            conn.close()
+
+
+def server(log_buffer=sys.stderr, address=ADDRESS, bufsize=BUFSIZE):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    print("making a server on {0}:{1}".format(*address), file=log_buffer)
+    sock.bind(address)
+    sock.listen(16)
+    try:
+        serve(sock, log_buffer, bufsize)
+    except KeyboardInterrupt:
+        print('quitting echo server', file=log_buffer)
+    finally:
+        sock.close()
+
+
+def send_message(sock, source, length, bufsize=BUFSIZE):
+    """send the framed `length` bytes read from the binary file `source`"""
+    sock.sendall(HEADER.pack(length))
+    buffer = bytearray(bufsize)
+    view = memoryview(buffer)
+    remaining = length
+    while remaining:
+        count = source.readinto(view[:min(remaining, bufsize)])
+        if not count:
+            raise EOFError('source ended {0} bytes early'.format(remaining))
+        sock.sendall(view[:count])
+        remaining -= count
+
+
+def receive_message(sock, sink, bufsize=BUFSIZE):
+    """write the next framed message from `sock` to `sink`, which needs
+    only a `write` method; returns its length
+    """
+    length = read_header(sock)
+    if length is None:
+        raise ConnectionError('connection closed before reply')
+    view = memoryview(bytearray(bufsize))
+    remaining = length
+    while remaining:
+        count = sock.recv_into(view, min(remaining, bufsize))
+        if not count:
+            raise ConnectionError('connection closed mid-message')
+        sink.write(view[:count])
+        remaining -= count
+    return length
+
+
+def echo_stream(sock, source, length, sink, bufsize=BUFSIZE):
+    """echo `length` bytes from `source` over `sock` into `sink`
+
+    The message is sent from a second thread while the reply is read,
+    since a client that sent everything first would stop reading once the
+    socket buffers were full, and so would the server.
+    """
+    errors = []
+
+    def send():
+        try:
+            send_message(sock, source, length, bufsize)
+        except (OSError, EOFError) as e:
+            errors.append(e)
+            sock.shutdown(socket.SHUT_RDWR)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    try:
+        received = receive_message(sock, sink, bufsize)
+    except ConnectionError:
+        if errors:
+            raise errors[0]
+        raise
+    finally:
+        sender.join()
+    if errors:
+        raise errors[0]
+    return received
+
+
+class _Into():
+    """a sink writing sequentially into a preallocated buffer"""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.offset = 0
+
+    def write(self, data):
+        end = self.offset + len(data)
+        self.view[self.offset:end] = data
+        self.offset = end
+
+
+class _Reader():
+    """a binary source reading from a bytes-like object without copies"""
+
+    def __init__(self, view):
+        self.view = view
+        self.offset = 0
+
+    def readinto(self, buffer):
+        chunk = self.view[self.offset:self.offset + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.offset += len(chunk)
+        return len(chunk)
+
+
+def client(msg, log_buffer=sys.stderr, address=ADDRESS, bufsize=BUFSIZE):
+    """echo `msg`, a str or bytes, and return the reply as the same type"""
+    data = msg.encode('utf8') if isinstance(msg, str) else bytes(msg)
+    print('connecting to {0} port {1}'.format(*address), file=log_buffer)
+    with socket.create_connection(address) as sock:
+        print('sending {0} bytes'.format(len(data)), file=log_buffer)
+        reply = bytearray(len(data))
+        received = echo_stream(sock, _Reader(memoryview(data)), len(data),
+                               _Into(reply), bufsize)
+        print('received {0} bytes'.format(received), file=log_buffer)
+    return reply.decode('utf8') if isinstance(msg, str) else bytes(reply)
+
+
+class _Hashing():
+    """wraps a binary source, or stands in for a sink, hashing the bytes
+    that pass through
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self.hash = hashlib.sha256()
+
+    def readinto(self, buffer):
+        count = self.source.readinto(buffer)
+        self.hash.update(buffer[:count])
+        return count
+
+    def write(self, data):
+        self.hash.update(data)
+
+
+def echo_file(path, log_buffer=sys.stderr, address=ADDRESS,
+              bufsize=BUFSIZE):
+    """echo the file at `path` and return the SHA-256 hex digests of what
+    was sent and what came back
+    """
+    length = os.path.getsize(path)
+    with open(path, 'rb') as f, socket.create_connection(address) as sock:
+        sent, received = _Hashing(f), _Hashing()
+        print('echoing {0} bytes from {1}'.format(length, path),
+              file=log_buffer)
+        echo_stream(sock, sent, length, received, bufsize)
+    return sent.hash.hexdigest(), received.hash.hexdigest()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        server()
+    else:
+        sent, received = echo_file(sys.argv[1])
+        print('sent     {0}\nreceived {1}'.format(sent, received))
+        sys.exit(0 if sent == received else 1)
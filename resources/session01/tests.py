@@ -42,5 +42,360 @@ class EchoTestCase(unittest.TestCase):
         )
 
 
+class StreamEchoTestCase(unittest.TestCase):
+    """tests for the length-prefixed echo in stream_echo.py"""
+
+    server_bufsize = 4096
+
+    def setUp(self):
+        import io
+        import threading
+        import stream_echo
+        self.log = io.StringIO()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.address = self.listener.getsockname()
+        self.thread = threading.Thread(
+            target=stream_echo.serve,
+            args=(self.listener, self.log, self.server_bufsize),
+            daemon=True
+        )
+        self.thread.start()
+
+    def tearDown(self):
+        # wakes the server thread blocked in accept
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+        self.thread.join(5)
+
+    def call_function_under_test(self, message, bufsize=16):
+        from stream_echo import client
+        return client(message, self.log, self.address, bufsize)
+
+    def test_short_message_echo(self):
+        self.assertEqual(self.call_function_under_test('short'), 'short')
+
+    def test_empty_message_echo(self):
+        self.assertEqual(self.call_function_under_test(b''), b'')
+
+    def test_multibyte_characters_split_across_chunks(self):
+        expected = 'caf\u00e9 \u2603 \U0001f40d ' * 20
+        self.assertEqual(self.call_function_under_test(expected), expected)
+
+    def test_message_larger_than_socket_buffers(self):
+        import os
+        expected = os.urandom(8 * 1024 * 1024)
+        actual = self.call_function_under_test(expected, bufsize=65536)
+        self.assertTrue(actual == expected)
+
+    def test_several_messages_on_one_connection(self):
+        import io
+        from stream_echo import echo_stream
+        with socket.create_connection(self.address) as sock:
+            for message in (b'one', b'', b'three' * 1000):
+                sink = io.BytesIO()
+                length = echo_stream(sock, io.BytesIO(message), len(message),
+                                     sink)
+                self.assertEqual(length, len(message))
+                self.assertEqual(sink.getvalue(), message)
+
+    def test_short_source_raises(self):
+        import io
+        from stream_echo import echo_stream
+        with socket.create_connection(self.address) as sock:
+            with self.assertRaises(EOFError):
+                echo_stream(sock, io.BytesIO(b'abc'), 10, io.BytesIO())
+
+    def test_echo_file_digests_match(self):
+        import os
+        import tempfile
+        from stream_echo import echo_file
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(os.urandom(300000))
+            f.flush()
+            sent, received = echo_file(f.name, self.log, self.address)
+        self.assertEqual(sent, received)
+
+
+class ConcurrentEchoServerTestCase(unittest.TestCase):
+    """1,000 simultaneous clients against the concurrent echo servers"""
+
+    def call_function_under_test(self, mode, clients, size, pause=0.0):
+        import bench
+        if bench.raise_fd_limit() < clients * 2 + 64:
+            self.skipTest('open file limit too low')
+        address = bench.free_address()
+        proc = bench.start_server(mode, address)
+        try:
+            return bench.run_clients(address, clients, size, pause)
+        finally:
+            bench.stop_server(proc)
+
+    def test_selectors_thousand_clients(self):
+        result = self.call_function_under_test('selectors', 1000, 4096)
+        self.assertEqual(result['failures'], {})
+        self.assertEqual(result['exact'], 1000)
+
+    def test_threads_thousand_clients(self):
+        result = self.call_function_under_test('threads', 1000, 4096)
+        self.assertEqual(result['failures'], {})
+        self.assertEqual(result['exact'], 1000)
+
+    def test_slow_readers(self):
+        """messages far larger than the socket buffers, sent in full before
+        the clients read any of the echo
+        """
+        for mode in ('selectors', 'threads'):
+            result = self.call_function_under_test(mode, 20, 4000000, 0.2)
+            self.assertEqual(result['exact'], 20, mode)
+
+
+class ResolverTestCase(unittest.TestCase):
+    """tests for the caching resolver, using names from /etc/hosts only"""
+
+    def makeOne(self, **kwargs):
+        from resolver import Resolver
+        self.lookups = []
+        self.now = 0.0
+
+        def getaddrinfo(host, *args):
+            self.lookups.append(host)
+            if host.endswith('.invalid'):
+                raise socket.gaierror(socket.EAI_NONAME, 'Name not known')
+            if host == 'flaky':
+                raise socket.gaierror(socket.EAI_AGAIN, 'Try again')
+            return socket.getaddrinfo('localhost', *args)
+
+        resolver = Resolver(getaddrinfo=getaddrinfo, clock=lambda: self.now,
+                            **kwargs)
+        self.addCleanup(resolver.close)
+        return resolver
+
+    def test_records(self):
+        resolver = self.makeOne()
+        records = resolver.resolve('localhost', 80)
+        self.assertTrue(records)
+        for record in records:
+            self.assertEqual(record.type, socket.SOCK_STREAM)
+            self.assertEqual(record.address[1], 80)
+            self.assertIn(record.family, (socket.AF_INET, socket.AF_INET6))
+
+    def test_cached_until_ttl(self):
+        resolver = self.makeOne(ttl=10)
+        first = resolver.resolve('localhost', 80)
+        self.now = 9.9
+        self.assertIs(resolver.resolve('localhost', 80), first)
+        self.assertEqual(self.lookups, ['localhost'])
+        self.now = 10.0
+        resolver.resolve('localhost', 80)
+        self.assertEqual(self.lookups, ['localhost', 'localhost'])
+        self.assertEqual(resolver.stats()['hits'], 1)
+        self.assertEqual(resolver.stats()['misses'], 2)
+
+    def test_negative_caching(self):
+        resolver = self.makeOne(negative_ttl=5)
+        for _ in range(3):
+            with self.assertRaises(socket.gaierror) as cm:
+                resolver.resolve('nowhere.invalid', 80)
+            self.assertEqual(cm.exception.args[0], socket.EAI_NONAME)
+        self.assertEqual(self.lookups, ['nowhere.invalid'])
+        self.assertEqual(resolver.stats()['negative_hits'], 2)
+        self.now = 5.0
+        with self.assertRaises(socket.gaierror):
+            resolver.resolve('nowhere.invalid', 80)
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_temporary_failure_not_cached(self):
+        resolver = self.makeOne()
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                resolver.resolve('flaky', 80)
+        self.assertEqual(self.lookups, ['flaky', 'flaky'])
+
+    def test_least_recently_used_evicted(self):
+        resolver = self.makeOne(max_entries=2)
+        resolver.resolve('localhost', 1)
+        resolver.resolve('localhost', 2)
+        resolver.resolve('localhost', 1)
+        resolver.resolve('localhost', 3)
+        self.assertEqual(resolver.stats()['entries'], 2)
+        resolver.resolve('localhost', 1)
+        self.assertEqual(len(self.lookups), 3)
+        resolver.resolve('localhost', 2)
+        self.assertEqual(len(self.lookups), 4)
+
+    def test_resolve_many(self):
+        resolver = self.makeOne()
+        pairs = [('localhost', port) for port in range(1, 51)]
+        pairs += [('nowhere.invalid', 80), ('localhost', 1)]
+        resolutions = resolver.resolve_many(pairs)
+        self.assertEqual([(r.host, r.port) for r in resolutions], pairs)
+        for resolution in resolutions[:50]:
+            self.assertIsNone(resolution.error)
+            self.assertEqual(resolution.records[0].address[1],
+                             resolution.port)
+        self.assertIsNone(resolutions[50].records)
+        self.assertEqual(resolutions[50].error.args[0], socket.EAI_NONAME)
+        # the repeated pair was looked up once
+        self.assertEqual(len(self.lookups), 51)
+
+    def test_resolve_many_unencodable_name(self):
+        from resolver import Resolver
+        resolver = Resolver()
+        self.addCleanup(resolver.close)
+        long_name = 'a' * 70 + '.example'
+        resolutions = resolver.resolve_many([('localhost', 80),
+                                             (long_name, 80)])
+        self.assertIsNone(resolutions[0].error)
+        self.assertIsNone(resolutions[1].records)
+        self.assertIsInstance(resolutions[1].error, UnicodeError)
+
+    def test_concurrent_callers_share_a_lookup(self):
+        import threading
+        from resolver import Resolver
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_getaddrinfo(*args):
+            calls.append(args)
+            started.set()
+            release.wait(5)
+            return socket.getaddrinfo('localhost', 80)
+
+        resolver = Resolver(getaddrinfo=slow_getaddrinfo)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(resolver.resolve('vm', 80)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len({id(result) for result in results}), 1)
+
+    def test_hosts_file_name(self):
+        from resolver import Resolver
+        records = Resolver().resolve('localhost', 10000)
+        self.assertIn('127.0.0.1', [r.address[0] for r in records])
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    """tests for the connection pool, against a listening socket here"""
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.address = self.listener.getsockname()
+        self.accepted = []
+        self.now = 0.0
+
+    def tearDown(self):
+        for conn in self.accepted:
+            conn.close()
+        self.listener.close()
+
+    def makeOne(self, **kwargs):
+        from connection_pool import ConnectionPool
+        pool = ConnectionPool(clock=lambda: self.now, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def accept(self):
+        conn = self.listener.accept()[0]
+        self.accepted.append(conn)
+        return conn
+
+    def test_released_connection_reused(self):
+        pool = self.makeOne()
+        first = pool.acquire(*self.address)
+        pool.release(first)
+        second = pool.acquire(*self.address)
+        self.assertIs(first, second)
+        stats = pool.stats()
+        self.assertEqual((stats['created'], stats['reused']), (1, 1))
+
+    def test_idle_connection_expires(self):
+        pool = self.makeOne(idle_timeout=30)
+        first = pool.acquire(*self.address)
+        pool.release(first)
+        self.now = 30.0
+        second = pool.acquire(*self.address)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.fileno(), -1)
+        self.assertEqual(pool.stats()['expired'], 1)
+
+    def test_evict_idle(self):
+        pool = self.makeOne(idle_timeout=30)
+        sock = pool.acquire(*self.address)
+        pool.release(sock)
+        self.now = 31.0
+        pool.evict_idle()
+        self.assertEqual(pool.stats()['open'], 0)
+
+    def test_closed_by_server_not_reused(self):
+        pool = self.makeOne()
+        first = pool.acquire(*self.address)
+        self.accept().close()
+        pool.release(first)
+        second = pool.acquire(*self.address)
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()['unhealthy'], 1)
+
+    def test_unread_data_not_reused(self):
+        import time
+        pool = self.makeOne()
+        first = pool.acquire(*self.address)
+        self.accept().sendall(b'left over')
+        time.sleep(0.05)
+        pool.release(first)
+        self.assertIsNot(pool.acquire(*self.address), first)
+
+    def test_exception_discards(self):
+        pool = self.makeOne()
+        with self.assertRaises(ZeroDivisionError):
+            with pool.connection(*self.address) as sock:
+                1 / 0
+        self.assertEqual(sock.fileno(), -1)
+        self.assertEqual(pool.stats()['open'], 0)
+
+    def test_max_size_waits_then_times_out(self):
+        import threading
+        import time
+        from connection_pool import PoolTimeout
+        pool = self.makeOne(max_size=1, timeout=0.1)
+        pool.clock = time.monotonic
+        sock = pool.acquire(*self.address)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(*self.address)
+        threading.Timer(0.05, pool.release, (sock,)).start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(*self.address), sock)
+
+    def test_discard_frees_a_slot(self):
+        pool = self.makeOne(max_size=1, timeout=0)
+        sock = pool.acquire(*self.address)
+        pool.discard(sock)
+        self.assertIsNot(pool.acquire(*self.address), sock)
+
+    def test_pooled_echo(self):
+        import bench
+        from connection_pool import echo
+        address = bench.free_address()
+        proc = bench.start_server('threads', address)
+        self.addCleanup(bench.stop_server, proc)
+        pool = self.makeOne()
+        for message in ('short', 'caf\u00e9 ' * 1000, 'last'):
+            self.assertEqual(echo(pool, message, address), message)
+        self.assertEqual(pool.stats()['created'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
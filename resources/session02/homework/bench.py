@@ -0,0 +1,439 @@
+"""benchmarks for the homework http_server
+
+Each benchmark is a sub-command; servers are started in a child process
+serving this directory's webroot.  Run it from this directory:
+
+    $ python bench.py keepalive --rounds 200
+    $ python bench.py compression --levels 1 6 9
+    $ python bench.py parse --requests 100000
+    $ python bench.py pool --clients 50 --workers 4 16 64
+    $ python bench.py resolve --requests 100000
+"""
+import argparse
+import math
+import mimetypes
+import multiprocessing
+import os
+import pathlib
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import http_parser
+import http_server
+
+
+ADDRESS = ('127.0.0.1', 10080)
+WEBROOT = pathlib.Path('webroot')
+
+
+def _run_server(address):
+    with open(os.devnull, 'w') as devnull:
+        http_server.server(log_buffer=devnull, address=address)
+
+
+def start_server(address=ADDRESS, target=_run_server, args=()):
+    """start a server in a child process and wait until it accepts"""
+    proc = multiprocessing.Process(target=target, args=(address,) + args,
+                                   daemon=True)
+    proc.start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(address, timeout=1).close()
+        except OSError:
+            time.sleep(0.05)
+        else:
+            return proc
+    proc.kill()
+    raise RuntimeError('server did not start')
+
+
+def stop_server(proc):
+    os.kill(proc.pid, signal.SIGINT)
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+
+
+def make_request(uri, connection='keep-alive'):
+    lines = ['GET {0} HTTP/1.1'.format(uri), 'Host: localhost',
+             'Connection: {0}'.format(connection), '', '']
+    return '\r\n'.join(lines).encode('utf8')
+
+
+def read_response(sock, buffer):
+    """read one response from `sock` using its Content-Length
+
+    `buffer` is a bytearray holding anything already received past the
+    previous response; returns the status line and the body.
+    """
+    while b'\r\n\r\n' not in buffer:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError('connection closed mid-response')
+        buffer += chunk
+    end = buffer.find(b'\r\n\r\n')
+    head = bytes(buffer[:end]).split(b'\r\n')
+    del buffer[:end + 4]
+    length = 0
+    for line in head[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    while len(buffer) < length:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError('connection closed mid-body')
+        buffer += chunk
+    body = bytes(buffer[:length])
+    del buffer[:length]
+    return head[0], body
+
+
+def image_uris():
+    images = WEBROOT / 'images'
+    return ['/images/{0}'.format(p.name) for p in sorted(images.iterdir())]
+
+
+def fetch_per_request(address, uris):
+    """one fresh connection for every uri"""
+    for uri in uris:
+        with socket.create_connection(address) as sock:
+            sock.sendall(make_request(uri, connection='close'))
+            read_response(sock, bytearray())
+
+
+def fetch_keep_alive(address, uris):
+    """every uri over a single connection, one request at a time"""
+    with socket.create_connection(address) as sock:
+        buffer = bytearray()
+        for uri in uris:
+            sock.sendall(make_request(uri))
+            read_response(sock, buffer)
+
+
+def fetch_pipelined(address, uris):
+    """every uri over a single connection, all requests sent up front"""
+    with socket.create_connection(address) as sock:
+        sock.sendall(b''.join(make_request(uri) for uri in uris))
+        buffer = bytearray()
+        for uri in uris:
+            read_response(sock, buffer)
+
+
+def bench_keepalive(args):
+    uris = image_uris()
+    proc = start_server()
+    try:
+        print('{0:<14} {1:>10} {2:>10}'.format('strategy', 'ms/round',
+                                                'req/s'))
+        for fetch in (fetch_per_request, fetch_keep_alive, fetch_pipelined):
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                fetch(ADDRESS, uris)
+            elapsed = time.perf_counter() - start
+            print('{0:<14} {1:>10.3f} {2:>10.1f}'.format(
+                fetch.__name__[len('fetch_'):],
+                elapsed / args.rounds * 1000,
+                args.rounds * len(uris) / elapsed,
+            ))
+    finally:
+        stop_server(proc)
+
+
+def sample_text(size, seed=0):
+    """`size` bytes of word-salad HTML, less repetitive than a copied page"""
+    words = WEBROOT.joinpath('a_web_page.html').read_text().split() + \
+        WEBROOT.joinpath('sample.txt').read_text().split() + \
+        ['<p>', '</p>', '<li>', '</li>', 'class="item"', 'the', 'and', 'of']
+    rng = random.Random(seed)
+    chunks, length = [], 0
+    while length < size:
+        word = rng.choice(words)
+        chunks.append(word)
+        length += len(word) + 1
+    return ' '.join(chunks).encode('utf8')[:size]
+
+
+def bench_compression(args):
+    """compression ratio and CPU cost per body size and coding
+
+    'miss us' is the cost of compressing the body once, 'hit us' the cost
+    of every later request served from the CompressionCache.
+    """
+    sizes = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+    print('{0:>8} {1:<8} {2:>5} {3:>7} {4:>10} {5:>8}'.format(
+        'bytes', 'coding', 'level', 'ratio', 'miss us', 'hit us'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = pathlib.Path(tmp) / 'sample-{0}.html'.format(size)
+            path.write_bytes(sample_text(size))
+            for encoding in http_server.ENCODINGS:
+                for level in args.levels:
+                    data = path.read_bytes()
+                    start = time.perf_counter()
+                    for _ in range(args.repeat):
+                        body = http_server.compress(data, encoding, level)
+                    miss = (time.perf_counter() - start) / args.repeat
+
+                    cache = http_server.CompressionCache()
+                    with path.open('rb') as f:
+                        st = os.fstat(f.fileno())
+                        cache.body(path, st, encoding, f)
+                        start = time.perf_counter()
+                        for _ in range(args.repeat):
+                            cache.body(path, st, encoding, f)
+                        hit = (time.perf_counter() - start) / args.repeat
+
+                    print('{0:>8} {1:<8} {2:>5} {3:>7.3f} {4:>10.1f} '
+                          '{5:>8.2f}'.format(size, encoding, level,
+                                             len(body) / size,
+                                             miss * 1e6, hit * 1e6))
+
+
+BROWSER_REQUEST = '\r\n'.join([
+    'GET /images/JPEG_example.jpg HTTP/1.1',
+    'Host: localhost:10000',
+    'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101',
+    'Accept: image/avif,image/webp,*/*',
+    'Accept-Language: en-US,en;q=0.5',
+    'Accept-Encoding: gzip, deflate, br',
+    'Connection: keep-alive',
+    'Referer: http://localhost:10000/a_web_page.html',
+    'If-Modified-Since: Tue, 02 Feb 2016 18:31:46 GMT',
+    '', '',
+]).encode('utf8')
+
+
+def parse_strings(data):
+    """the string-based parse the server used before RequestParser"""
+    request = data.decode('utf8')
+    http_server.parse_request(request)
+    http_server.parse_headers(request)
+
+
+def bench_parse(args):
+    """parse throughput in requests/sec for a typical browser request"""
+    def strings():
+        for _ in range(args.requests):
+            parse_strings(BROWSER_REQUEST)
+
+    def one_per_feed():
+        parser = http_parser.RequestParser()
+        for _ in range(args.requests):
+            parser.feed(BROWSER_REQUEST)
+            parser.next_request()
+
+    def pipelined():
+        parser = http_parser.RequestParser()
+        batch = BROWSER_REQUEST * 100
+        for _ in range(args.requests // 100):
+            parser.feed(batch)
+            while parser.next_request() is not None:
+                pass
+
+    def segmented():
+        parser = http_parser.RequestParser()
+        pieces = [BROWSER_REQUEST[i:i + 64]
+                  for i in range(0, len(BROWSER_REQUEST), 64)]
+        for _ in range(args.requests):
+            for piece in pieces:
+                parser.feed(piece)
+                parser.next_request()
+
+    print('{0:<14} {1:>12}'.format('parser', 'req/s'))
+    for run in (strings, one_per_feed, pipelined, segmented):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print('{0:<14} {1:>12.1f}'.format(run.__name__,
+                                          args.requests / elapsed))
+
+
+# (size in bytes, how many files of it) served by the pool benchmark
+MIXED_SIZES = [(1024, 50), (16384, 30), (262144, 15), (4194304, 5)]
+
+
+def make_mixed_webroot(base):
+    """populate `base`/webroot with files of MIXED_SIZES, returning uris"""
+    webroot = pathlib.Path(base) / 'webroot'
+    webroot.mkdir()
+    uris = []
+    for size, count in MIXED_SIZES:
+        for i in range(count):
+            name = 'file-{0}-{1}.bin'.format(size, i)
+            webroot.joinpath(name).write_bytes(os.urandom(size))
+            uris.append('/' + name)
+    return uris
+
+
+def _run_in(address, base, workers):
+    os.chdir(base)
+    with open(os.devnull, 'w') as devnull:
+        if workers:
+            http_server.pool_server(log_buffer=devnull, address=address,
+                                    workers=workers,
+                                    queue_depth=http_server.POOL_QUEUE_DEPTH)
+        else:
+            http_server.server(log_buffer=devnull, address=address)
+
+
+def percentile(ordered, fraction):
+    """nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return float('nan')
+    rank = max(int(math.ceil(fraction * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def run_clients(address, uris, clients, requests, seed=0):
+    """`clients` threads each fetch `requests` random uris
+
+    Every request uses a fresh connection.  Returns the latencies of the
+    answered requests, the 503 status lines and the connection errors.
+    """
+    latencies, refused, errors = [], [], []
+    lock = threading.Lock()
+
+    def client(rng):
+        mine = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                with socket.create_connection(address, timeout=30) as sock:
+                    sock.sendall(make_request(rng.choice(uris), 'close'))
+                    status, _ = read_response(sock, bytearray())
+            except OSError as e:
+                with lock:
+                    errors.append(e)
+                continue
+            if b' 503 ' in status:
+                with lock:
+                    refused.append(status)
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client,
+                                args=(random.Random(seed + i),))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, refused, errors
+
+
+def bench_pool(args):
+    """serial server vs pool_server on a mix of small and large files"""
+    print('{0:<10} {1:>7} {2:>6} {3:>6} {4:>10} {5:>9} {6:>9}'.format(
+        'workers', 'ok', '503', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    with tempfile.TemporaryDirectory() as base:
+        uris = make_mixed_webroot(base)
+        for workers in [0] + args.workers:
+            proc = start_server(target=_run_in, args=(base, workers))
+            try:
+                start = time.perf_counter()
+                latencies, refused, errors = run_clients(
+                    ADDRESS, uris, args.clients, args.requests)
+                elapsed = time.perf_counter() - start
+            finally:
+                stop_server(proc)
+            latencies.sort()
+            print('{0:<10} {1:>7} {2:>6} {3:>6} {4:>10.1f} {5:>9.2f} '
+                  '{6:>9.2f}'.format(
+                      workers or 'serial', len(latencies), len(refused),
+                      len(errors), len(latencies) / elapsed,
+                      percentile(latencies, 0.50) * 1000,
+                      percentile(latencies, 0.99) * 1000))
+
+
+def bench_resolve(args):
+    """per-request cost of turning a uri into a path, type and headers
+
+    'filesystem' is what handle_request did per request before the
+    WebrootIndex: stat the path twice, guess its type, stat it again for
+    the validators and build the headers.  'index' is one lookup.
+    """
+    uris = ['/sample.txt', '/a_web_page.html'] + image_uris()
+    index = http_server.WebrootIndex()
+    # load the system mime type tables outside the timed scan
+    mimetypes.init()
+    start = time.perf_counter()
+    index.scan()
+    scan = time.perf_counter() - start
+
+    def filesystem(uri):
+        path = http_server.resolve_path(uri)
+        path.is_file()
+        mimetype = http_server.guess_mimetype(uri)
+        return http_server.file_headers(mimetype, path.stat())
+
+    def indexed(uri):
+        return index.lookup(uri).headers
+
+    print('scan of {0} paths took {1:.3f} ms'.format(len(index),
+                                                      scan * 1000))
+    print('{0:<12} {1:>12}'.format('resolve', 'us/request'))
+    for name, resolve in (('filesystem', filesystem), ('index', indexed)):
+        for uri in uris:
+            assert resolve(uri) == indexed(uri)
+        start = time.perf_counter()
+        for i in range(args.requests):
+            resolve(uris[i % len(uris)])
+        elapsed = time.perf_counter() - start
+        print('{0:<12} {1:>12.3f}'.format(name,
+                                          elapsed / args.requests * 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    keepalive = commands.add_parser(
+        'keepalive', help='fetch the webroot images per-connection vs reused'
+    )
+    keepalive.add_argument('--rounds', type=int, default=200)
+    keepalive.set_defaults(func=bench_keepalive)
+
+    compression = commands.add_parser(
+        'compression', help='ratio and CPU cost of gzip/deflate by size'
+    )
+    compression.add_argument('--levels', type=int, nargs='+',
+                             default=[1, http_server.COMPRESS_LEVEL, 9])
+    compression.add_argument('--repeat', type=int, default=20)
+    compression.set_defaults(func=bench_compression)
+
+    parse = commands.add_parser('parse', help='request parsing throughput')
+    parse.add_argument('--requests', type=int, default=100000)
+    parse.set_defaults(func=bench_parse)
+
+    pool = commands.add_parser(
+        'pool', help='concurrent clients, serial server vs thread pool'
+    )
+    pool.add_argument('--workers', type=int, nargs='+',
+                      default=[4, http_server.POOL_WORKERS, 64])
+    pool.add_argument('--clients', type=int, default=50)
+    pool.add_argument('--requests', type=int, default=20)
+    pool.set_defaults(func=bench_pool)
+
+    resolve = commands.add_parser(
+        'resolve', help='uri resolution, filesystem vs WebrootIndex'
+    )
+    resolve.add_argument('--requests', type=int, default=100000)
+    resolve.set_defaults(func=bench_resolve)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
@@ -1,23 +1,90 @@
+import collections
+import gzip
+import json
 import socket
 import sys
+import os
 import pathlib
 import mimetypes
+import select
+import stat
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 
+from http_parser import ParseError, RequestParser
+from http_stats import AccessLog, RouteStats
 
-def response_ok(body, mimetype):
-    """returns a basic HTTP response"""
+
+def response_headers(mimetype, length, extra=()):
+    """returns the status line and headers of a 200 OK response
+
+    `extra` holds any further complete header lines as bytes.  The result
+    ends with the blank line, so the body can follow directly.
+    """
     resp = []
     resp.append(b"HTTP/1.1 200 OK")
     resp.append(b"Content-Type: " + mimetype)  # couldn't call format() on byte string
+    resp.append(b"Content-Length: " + str(length).encode('utf8'))
+    resp.extend(extra)
+    resp.append(b"")
     resp.append(b"")
-    resp.append(body)
     return b"\r\n".join(resp)
 
 
+def response_ok(body, mimetype):
+    """returns a basic HTTP response"""
+    return response_headers(mimetype, len(body)) + body
+
+
+def response_not_modified(extra=()):
+    """returns a 304 Not Modified response, which never has a body"""
+    resp = []
+    resp.append(b"HTTP/1.1 304 Not Modified")
+    resp.extend(extra)
+    resp.append(b"")
+    resp.append(b"")
+    return b"\r\n".join(resp)
+
+
+def response_partial_headers(mimetype, length, content_range, extra=()):
+    """returns the status line and headers of a 206 Partial Content response
+
+    `content_range` is the value of the Content-Range header for a single
+    range, or None for a multipart/byteranges body, in which case
+    `mimetype` should name the multipart type and its boundary.
+    """
+    resp = []
+    resp.append(b"HTTP/1.1 206 Partial Content")
+    resp.append(b"Content-Type: " + mimetype)
+    resp.append(b"Content-Length: " + str(length).encode('utf8'))
+    if content_range is not None:
+        resp.append(b"Content-Range: " + content_range)
+    resp.extend(extra)
+    resp.append(b"")
+    resp.append(b"")
+    return b"\r\n".join(resp)
+
+
+def response_range_not_satisfiable(size):
+    """returns a 416 Range Not Satisfiable response for a file of `size`"""
+    resp = []
+    resp.append("HTTP/1.1 416 Range Not Satisfiable")
+    resp.append("Content-Range: bytes */{0}".format(size))
+    resp.append("Content-Length: 0")
+    resp.append("")
+    resp.append("")
+    return "\r\n".join(resp).encode('utf8')
+
+
 def response_method_not_allowed():
     """returns a 405 Method Not Allowed response"""
     resp = []
     resp.append("HTTP/1.1 405 Method Not Allowed")
+    resp.append("Content-Length: 0")
+    resp.append("")
     resp.append("")
     return "\r\n".join(resp).encode('utf8')
 
@@ -26,6 +93,30 @@ def response_not_found():
     """returns a 404 Not Found response"""
     resp = []
     resp.append("HTTP/1.1 404 Not Found")
+    resp.append("Content-Length: 0")
+    resp.append("")
+    resp.append("")
+    return "\r\n".join(resp).encode('utf8')
+
+
+def response_service_unavailable(retry_after=1):
+    """returns a 503 response asking the client to retry later, as bytes"""
+    resp = []
+    resp.append("HTTP/1.1 503 Service Unavailable")
+    resp.append("Retry-After: {0}".format(retry_after))
+    resp.append("Content-Length: 0")
+    resp.append("Connection: close")
+    resp.append("")
+    resp.append("")
+    return "\r\n".join(resp).encode('utf8')
+
+
+def response_error(status):
+    """returns a bodyless response for `status`, e.g. '400 Bad Request'"""
+    resp = []
+    resp.append("HTTP/1.1 {0}".format(status))
+    resp.append("Content-Length: 0")
+    resp.append("")
     resp.append("")
     return "\r\n".join(resp).encode('utf8')
 
@@ -38,64 +129,828 @@ def parse_request(request):
     return uri
 
 
+def parse_headers(request):
+    """returns the request headers as a dict keyed by lower-cased name"""
+    headers = {}
+    for line in request.split("\r\n")[1:]:
+        if not line:
+            break
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def entity_tag(st, encoding=None):
+    """returns the ETag for a file stat
+
+    The tag changes whenever the size or modification time does, which is
+    what the server can cheaply know about a file's content.  Each content
+    coding of the file is a different representation with its own tag.
+    """
+    if encoding is None:
+        return '"{0:x}-{1:x}"'.format(st.st_size, st.st_mtime_ns)
+    return '"{0:x}-{1:x}-{2}"'.format(st.st_size, st.st_mtime_ns, encoding)
+
+
+def validators(st, encoding=None):
+    """returns the ETag and Last-Modified header lines for a file stat"""
+    etag = entity_tag(st, encoding)
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    return [
+        'ETag: {0}'.format(etag).encode('utf8'),
+        'Last-Modified: {0}'.format(last_modified).encode('utf8'),
+    ]
+
+
+def not_modified(headers, st, encoding=None):
+    """True if the conditional request `headers` allow a 304 for `st`
+
+    If-None-Match wins over If-Modified-Since when both are sent, and dates
+    that cannot be parsed are ignored, as RFC 7232 asks.
+    """
+    if 'if-none-match' in headers:
+        etag = entity_tag(st, encoding)
+        for candidate in headers['if-none-match'].split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate in ('*', etag):
+                return True
+        return False
+    if 'if-modified-since' in headers:
+        try:
+            since = parsedate_to_datetime(headers['if-modified-since'])
+        except (TypeError, ValueError, IndexError):
+            return False
+        if since is None:
+            return False
+        # Last-Modified only carries whole seconds
+        return int(st.st_mtime) <= since.timestamp()
+    return False
+
+
+# more ranges than this in one request and the Range header is ignored
+MAX_RANGES = 16
+
+
+def parse_range(value, size):
+    """returns the byte ranges a Range header asks for in a file of `size`
+
+    Ranges come back as inclusive (first, last) pairs, clipped to the file,
+    in order and with overlapping or adjacent ones merged.  A header that
+    is not a valid bytes range gives None, meaning it should be ignored; so
+    does one asking for more than MAX_RANGES ranges or for more bytes in
+    all than the file has, as the whole file is cheaper to send.  One whose
+    ranges all lie outside the file gives an empty list, meaning 416.
+    """
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if first:
+                first = int(first)
+                last = int(last) if last else max(first, size - 1)
+                if first < 0 or last < first:
+                    return None
+            else:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                if suffix == 0:
+                    continue
+                first, last = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+        if first < size:
+            ranges.append((first, min(last, size - 1)))
+    if sum(last - first + 1 for first, last in ranges) > size:
+        return None
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+# content codings we can produce, in order of preference
+ENCODINGS = ('gzip', 'deflate')
+# bodies outside these sizes go out uncompressed: tiny ones gain less than
+# the Content-Encoding header costs, huge ones would have to be read into
+# memory (a precompressed .gz sibling is served at any size)
+MIN_COMPRESS_SIZE = 1024
+MAX_COMPRESS_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+
+def compressible(mimetype):
+    """True for the textual types that are worth compressing"""
+    return mimetype.startswith(b'text/') or mimetype in (
+        b'application/javascript', b'application/json', b'application/xml',
+        b'image/svg+xml',
+    )
+
+
+def negotiate_encoding(value):
+    """returns the preferred coding in ENCODINGS that Accept-Encoding allows
+
+    Returns None when the client accepts none of them, in which case the
+    identity coding is used.
+    """
+    qualities = {}
+    for item in value.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, q = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(q)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    best, best_quality = None, 0.0
+    for coding in ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(data, encoding, level=COMPRESS_LEVEL):
+    """returns `data` in the given content coding"""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'deflate':
+        # HTTP's "deflate" is the zlib format, not a raw deflate stream
+        return zlib.compress(data, level)
+    raise ValueError('unknown content coding {0!r}'.format(encoding))
+
+
+class CompressionCache():
+    """a bounded, least-recently-used cache of compressed file bodies
+
+    Each file is compressed once per content coding; the result is kept,
+    keyed on the path and coding, with the size and mtime the file had, so
+    the next request for an unchanged file costs no compression at all.
+    The cache may be shared between threads; compression itself runs
+    outside its lock.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """returns the cache counters as a dict"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def body(self, path, st, encoding, f):
+        """returns the body of `path` compressed with `encoding`
+
+        `st` is the stat of the open file `f`, which is read only on a miss.
+        """
+        key = (str(path), encoding)
+        validator = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == validator:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        f.seek(0)
+        body = compress(f.read(), encoding)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(body) <= self.max_bytes:
+                self._entries[key] = (validator, body)
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+        return body
+
+
+COMPRESSION_CACHE = CompressionCache()
+
+
+def resolve_path(uri):
+    """returns the webroot path for `uri`, raising NameError if missing"""
+    path = pathlib.Path('webroot{}'.format(uri))
+    if not (path.is_dir() or path.is_file()):
+        raise NameError('No such file or directory. Please try again.')
+    return path
+
+
+def list_directory(path):
+    """returns a plain text listing of a directory as bytes"""
+    resources = [item.name.encode('utf8') for item in path.iterdir()]
+    return b'\r\n'.join(resources)
+
+
+# sent for files whose type cannot be guessed from their name
+DEFAULT_MIMETYPE = b'application/octet-stream'
+
+
+def guess_mimetype(name):
+    """returns the mime type for a file name as bytes
+
+    Falls back to DEFAULT_MIMETYPE, as `mimetypes.guess_type` returns None
+    for names it does not recognise.
+    """
+    mimetype = mimetypes.guess_type(name)[0]
+    if mimetype is None:
+        return DEFAULT_MIMETYPE
+    return mimetype.encode('utf8')
+
+
 def resolve_uri(uri):
     """This method should return appropriate content and a mime type"""
-    path = pathlib.Path('webroot{}'.format(uri))
+    path = resolve_path(uri)
     if path.is_dir():
-        resources = [item.name.encode('utf8') for item in path.iterdir()]
-        contents = b'\r\n'.join(resources)
+        contents = list_directory(path)
         mime_type = b'text/plain'
-    elif path.is_file():
-        contents = path.read_bytes()
-        mime_type = mimetypes.guess_type(uri)[0].encode('utf8')
     else:
-        raise NameError('No such file or directory. Please try again.')
+        contents = path.read_bytes()
+        mime_type = guess_mimetype(uri)
     return contents, mime_type
 
 
-def server(log_buffer=sys.stderr):
-    address = ('127.0.0.1', 10000)
+def file_headers(mimetype, st):
+    """returns the headers of a plain 200 OK response for a file stat"""
+    extra = validators(st)
+    if compressible(mimetype):
+        extra.append(b'Vary: Accept-Encoding')
+    extra.append(b'Accept-Ranges: bytes')
+    return response_headers(mimetype, st.st_size, extra)
+
+
+# what the server knows about a webroot path; `mimetype` and `headers` are
+# None for a directory
+IndexEntry = collections.namedtuple(
+    'IndexEntry', ['path', 'size', 'mtime_ns', 'mimetype', 'headers']
+)
+
+
+def index_entry(path, st=None):
+    """returns the IndexEntry for `path`, which must exist"""
+    if st is None:
+        st = path.stat()
+    if stat.S_ISDIR(st.st_mode):
+        return IndexEntry(path, None, None, None, None)
+    mimetype = guess_mimetype(path.name)
+    return IndexEntry(path, st.st_size, st.st_mtime_ns, mimetype,
+                      file_headers(mimetype, st))
+
+
+# seconds between the background scans of the webroot index
+RESCAN_INTERVAL = 30
+
+# request headers that make a response differ from the precomputed one
+_VARYING_HEADERS = frozenset(['if-none-match', 'if-modified-since', 'range'])
+
+
+class WebrootIndex():
+    """an in-memory index of every file and directory in the webroot
+
+    Each path is stored under the uri that requests it, together with the
+    file's size and mtime, its mime type and the headers of a plain 200
+    response, so answering a request needs one dict lookup rather than
+    stats, Path objects and a mime type guess.  `start` scans once and
+    then rescans every `interval` seconds in a daemon thread; a new scan
+    replaces the whole dict at once, so readers need no lock.  Between
+    scans the index can be stale: a lookup that misses falls back to the
+    filesystem, and `send_file` checks the entry against the open file.
+    """
+
+    def __init__(self, root='webroot', interval=RESCAN_INTERVAL):
+        self.root = pathlib.Path(root)
+        self.interval = interval
+        self.scans = 0
+        self._entries = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, uri):
+        """returns the IndexEntry for `uri`, or None if it is not indexed"""
+        return self._entries.get(uri.rstrip('/') or '/')
+
+    def scan(self):
+        """walk the webroot and replace the index with what is there now"""
+        entries = {'/': index_entry(self.root)}
+        pending = [('', self.root)]
+        while pending:
+            prefix, directory = pending.pop()
+            with os.scandir(str(directory)) as items:
+                for item in items:
+                    uri = prefix + '/' + item.name
+                    path = directory / item.name
+                    try:
+                        entries[uri] = index_entry(path, item.stat())
+                    except OSError:
+                        # removed while scanning, or a broken link
+                        continue
+                    # symbolic links to directories are left to the
+                    # filesystem fallback rather than risk a cycle
+                    if item.is_dir(follow_symlinks=False):
+                        pending.append((uri, path))
+        self._entries = entries
+        self.scans += 1
+
+    def start(self):
+        """scan now, then keep rescanning in a background thread"""
+        self.scan()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._rescan,
+                                        name='webroot-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stop the background rescans"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _rescan(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.scan()
+            except OSError:
+                # keep serving from the previous scan
+                pass
+
+
+WEBROOT_INDEX = WebrootIndex()
+
+
+# files smaller than this are sent with their headers in a single write;
+# below it the extra system calls of sendfile cost more than the copy saves
+SENDFILE_THRESHOLD = 65536
+
+
+def _send_body(conn, f, prefix, offset, count):
+    """send `prefix` followed by `count` bytes of `f` starting at `offset`"""
+    if count < SENDFILE_THRESHOLD:
+        f.seek(offset)
+        conn.sendall(prefix + f.read(count))
+        return count
+    # MSG_MORE lets the kernel put the prefix in the first body segment
+    conn.sendall(prefix, getattr(socket, 'MSG_MORE', 0))
+    return conn.sendfile(f, offset, count)
+
+
+def _if_range_matches(request_headers, extra):
+    """True unless an If-Range header names a different file version"""
+    if 'if-range' not in request_headers:
+        return True
+    value = request_headers['if-range'].encode('utf8')
+    return any(line.split(b': ', 1)[1] == value for line in extra)
+
+
+def _send_byteranges(conn, f, mimetype, size, ranges, extra):
+    """send several ranges of `f` as a multipart/byteranges 206 response"""
+    boundary = os.urandom(12).hex().encode('utf8')
+    part_headers = []
+    for first, last in ranges:
+        part_headers.append(b"\r\n".join([
+            b"",
+            b"--" + boundary,
+            b"Content-Type: " + mimetype,
+            'Content-Range: bytes {0}-{1}/{2}'.format(
+                first, last, size).encode('utf8'),
+            b"",
+            b"",
+        ]))
+    closing = b"\r\n--" + boundary + b"--\r\n"
+    length = sum(map(len, part_headers)) + len(closing) + \
+        sum(last - first + 1 for first, last in ranges)
+    prefix = response_partial_headers(
+        b"multipart/byteranges; boundary=" + boundary, length, None, extra
+    )
+    sent = 0
+    for part, (first, last) in zip(part_headers, ranges):
+        sent += _send_body(conn, f, prefix + part, first, last - first + 1)
+        prefix = b""
+    conn.sendall(closing)
+    return sent
+
+
+def _send_encoded(conn, path, f, st, mimetype, encoding, request_headers):
+    """send the file open as `f` in a compressed content coding
+
+    A `.gz` file next to the original that is at least as new is sent as
+    is; otherwise the body comes from COMPRESSION_CACHE.  Range requests
+    are answered with the whole encoded body, which HTTP allows.  Returns
+    None, sending nothing, when the file is the wrong size to compress.
+    """
+    if encoding == 'gzip':
+        sibling = path.with_name(path.name + '.gz')
+        try:
+            sibling_file = sibling.open('rb')
+        except OSError:
+            pass
+        else:
+            with sibling_file:
+                sibling_st = os.fstat(sibling_file.fileno())
+                if sibling_st.st_mtime_ns >= st.st_mtime_ns:
+                    extra = validators(sibling_st, encoding) + [
+                        b'Content-Encoding: gzip', b'Vary: Accept-Encoding',
+                    ]
+                    if not_modified(request_headers, sibling_st, encoding):
+                        conn.sendall(response_not_modified(extra))
+                        return 0
+                    headers = response_headers(
+                        mimetype, sibling_st.st_size, extra
+                    )
+                    return _send_body(conn, sibling_file, headers, 0,
+                                      sibling_st.st_size)
+
+    if not MIN_COMPRESS_SIZE <= st.st_size <= MAX_COMPRESS_SIZE:
+        return None
+    extra = validators(st, encoding) + [
+        b'Content-Encoding: ' + encoding.encode('utf8'),
+        b'Vary: Accept-Encoding',
+    ]
+    if not_modified(request_headers, st, encoding):
+        conn.sendall(response_not_modified(extra))
+        return 0
+    body = COMPRESSION_CACHE.body(path, st, encoding, f)
+    conn.sendall(response_headers(mimetype, len(body), extra) + body)
+    return len(body)
+
+
+def send_file(conn, path, mimetype, request_headers=None, entry=None):
+    """send a 200 OK response for the file at `path` over `conn`
+
+    Large bodies are handed to `socket.sendfile`, which uses os.sendfile
+    where the platform has it, so the file is copied by the kernel and
+    never read into memory however large it is.  When `request_headers`
+    make the request conditional and the file has not changed, a 304 is
+    sent instead; when they carry a satisfiable Range, a 206 with only the
+    requested bytes.  Textual types are compressed when Accept-Encoding
+    allows it.  An IndexEntry for the file supplies the headers of a plain
+    200 OK as long as the file has not changed since it was indexed.
+    Returns the number of body bytes sent.
+    """
+    request_headers = request_headers or {}
+    with path.open('rb') as f:
+        st = os.fstat(f.fileno())
+        fresh = entry is not None and entry.size == st.st_size and \
+            entry.mtime_ns == st.st_mtime_ns
+        vary = []
+        if compressible(mimetype):
+            vary.append(b'Vary: Accept-Encoding')
+            encoding = negotiate_encoding(
+                request_headers.get('accept-encoding', '')
+            )
+            if encoding is not None:
+                sent = _send_encoded(conn, path, f, st, mimetype, encoding,
+                                     request_headers)
+                if sent is not None:
+                    return sent
+        if fresh and _VARYING_HEADERS.isdisjoint(request_headers):
+            return _send_body(conn, f, entry.headers, 0, st.st_size)
+        extra = validators(st) + vary
+        if not_modified(request_headers, st):
+            conn.sendall(response_not_modified(extra))
+            return 0
+        size = st.st_size
+        ranges = None
+        if 'range' in request_headers and \
+                _if_range_matches(request_headers, extra):
+            ranges = parse_range(request_headers['range'], size)
+        if ranges is None:
+            extra.append(b'Accept-Ranges: bytes')
+            headers = response_headers(mimetype, size, extra)
+            return _send_body(conn, f, headers, 0, size)
+        if not ranges:
+            conn.sendall(response_range_not_satisfiable(size))
+            return 0
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            content_range = 'bytes {0}-{1}/{2}'.format(first, last, size)
+            headers = response_partial_headers(
+                mimetype, last - first + 1, content_range.encode('utf8'),
+                extra
+            )
+            return _send_body(conn, f, headers, first, last - first + 1)
+        return _send_byteranges(conn, f, mimetype, size, ranges, extra)
+
+
+# seconds an idle persistent connection is kept open
+IDLE_TIMEOUT = 5
+# requests whose headers have not ended after this many bytes are rejected
+MAX_HEADER_SIZE = 65536
+
+
+# every request is counted in STATS and, once the server is started with
+# an access log, written to ACCESS_LOG; STATS_PATH serves the counts
+STATS = RouteStats()
+ACCESS_LOG = AccessLog()
+STATS_PATH = '/__stats'
+
+
+class MeteredConnection():
+    """a socket wrapper noting the status and size of what is sent on it
+
+    Only the methods the response functions use are passed on.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.status = None
+        self.sent = 0
+
+    def sendall(self, data, flags=0):
+        if self.status is None:
+            # the status code follows 'HTTP/1.1 '
+            self.status = int(data[9:12])
+        self.conn.sendall(data, flags)
+        self.sent += len(data)
+
+    def sendfile(self, f, offset=0, count=None):
+        sent = self.conn.sendfile(f, offset, count)
+        self.sent += sent
+        return sent
+
+
+def response_stats():
+    """returns the request counts and latencies as a JSON response"""
+    body = json.dumps({
+        'requests': STATS.snapshot(),
+        'access_log': ACCESS_LOG.stats(),
+        'compression_cache': COMPRESSION_CACHE.stats(),
+        'webroot_index': {'paths': len(WEBROOT_INDEX),
+                          'scans': WEBROOT_INDEX.scans},
+    }, indent=2).encode('utf8')
+    return response_ok(body, b'application/json')
+
+
+def record_request(client, method, target, status, size, duration):
+    """account for one response in STATS and ACCESS_LOG"""
+    STATS.record(target, status, duration)
+    ACCESS_LOG.log(client, method, target, status, size, duration)
+
+
+def handle_request(conn, request):
+    """send the response to a parsed `request`
+
+    Returns whether to keep the connection open.  Files are streamed with
+    `send_file`; everything else is small enough to build in memory and
+    send in one go.  Paths come from WEBROOT_INDEX when it knows them.
+    """
+    if request.method != "GET":
+        # the parser has read past any body, so the connection stays usable
+        conn.sendall(response_method_not_allowed())
+        return request.keep_alive()
+    uri = request.target
+    if uri.partition('?')[0] == STATS_PATH:
+        conn.sendall(response_stats())
+        return request.keep_alive()
+    entry = WEBROOT_INDEX.lookup(uri)
+    try:
+        if entry is None:
+            entry = index_entry(resolve_path(uri))
+        if entry.mimetype is None:
+            conn.sendall(response_ok(list_directory(entry.path),
+                                     b'text/plain'))
+        else:
+            send_file(conn, entry.path, entry.mimetype, request.headers,
+                      entry)
+    except (NameError, FileNotFoundError, NotADirectoryError):
+        # missing, or removed since the index was built
+        conn.sendall(response_not_found())
+    return request.keep_alive()
+
+
+def handle_connection(conn, log_buffer=sys.stderr, timeout=IDLE_TIMEOUT,
+                      listener=None):
+    """answer requests on `conn` until the client closes or goes idle
+
+    Received bytes go to a `RequestParser` and every complete request it
+    holds is answered in order before reading again, so pipelined requests
+    that arrived in one segment are all served.
+
+    A server answering one connection at a time passes its `listener`:
+    once the requests received are answered, the connection is closed
+    rather than waited on if another client is waiting to connect.
+    """
+    conn.settimeout(timeout)
+    parser = RequestParser(max_header_size=MAX_HEADER_SIZE)
+    try:
+        client = conn.getpeername()[0]
+    except (OSError, IndexError):
+        client = '-'
+    while True:
+        try:
+            request = parser.next_request()
+        except ParseError as e:
+            print('bad request - {0}'.format(e), file=log_buffer)
+            response = response_error(e.status)
+            conn.sendall(response)
+            record_request(client, '-', '-', int(e.status[:3]),
+                           len(response), 0.0)
+            return
+        if request is None:
+            if listener is not None:
+                readable, _, _ = select.select([conn, listener], [], [],
+                                               timeout)
+                if not readable:
+                    print('connection idle, closing', file=log_buffer)
+                    return
+                if conn not in readable:
+                    print('another client waiting, closing',
+                          file=log_buffer)
+                    return
+            try:
+                data = conn.recv(4096)
+            except socket.timeout:
+                print('connection idle, closing', file=log_buffer)
+                return
+            if not data:
+                return
+            parser.feed(data)
+            continue
+
+        print('sending response', file=log_buffer)
+        start = time.perf_counter()
+        metered = MeteredConnection(conn)
+        keep_alive = handle_request(metered, request)
+        record_request(client, request.method, request.target,
+                       metered.status, metered.sent,
+                       time.perf_counter() - start)
+        if not keep_alive:
+            return
+
+
+def serve_connection(conn, addr, log_buffer=sys.stderr, listener=None):
+    """answer the requests on an accepted connection, then close it"""
+    try:
+        print('connection - {0}:{1}'.format(*addr), file=log_buffer)
+        if conn.family in (socket.AF_INET, socket.AF_INET6):
+            # the last segment of a sendfile'd body must not wait for the
+            # client's delayed ACK on a kept-alive connection
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        handle_connection(conn, log_buffer, listener=listener)
+    except OSError as e:
+        print('connection error - {0}'.format(e), file=log_buffer)
+    finally:
+        conn.close()
+
+
+def server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+           access_log=None):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     print("making a server on {0}:{1}".format(*address), file=log_buffer)
     sock.bind(address)
     sock.listen(1)
+    WEBROOT_INDEX.start()
+    if access_log is not None:
+        ACCESS_LOG.start(access_log)
 
     try:
         while True:
             print('waiting for a connection', file=log_buffer)
             conn, addr = sock.accept()  # blocking
-            try:
-                print('connection - {0}:{1}'.format(*addr), file=log_buffer)
-                request = ''
-                while True:
-                    data = conn.recv(1024)
-                    request += data.decode('utf8')
-                    if len(data) < 1024:
-                        break
+            # one connection at a time: an idle keep-alive client must not
+            # hold up the next one
+            serve_connection(conn, addr, log_buffer, listener=sock)
 
-                try:
-                    uri = parse_request(request)
-                except NotImplementedError:
-                    response = response_method_not_allowed()
-                else:
-                    try:
-                        content, mime_type = resolve_uri(uri)
-                    except NameError:
-                        response = response_not_found()
-                    else:
-                        response = response_ok(content, mime_type)
+    except KeyboardInterrupt:
+        sock.close()
+        WEBROOT_INDEX.stop()
+        ACCESS_LOG.stop()
+        return
+
+
+# worker threads, and connections allowed to wait for one, in pool_server
+POOL_WORKERS = 16
+POOL_QUEUE_DEPTH = 64
+
+
+def refuse_connection(conn):
+    """answer 503 on a connection there is no room for, and close it
+
+    The accept loop must not block on the client, so the socket is made
+    non-blocking and only what has already arrived is read.  Reading it
+    keeps the close from resetting the connection before the client has
+    seen the response.
+    """
+    try:
+        conn.setblocking(False)
+        try:
+            conn.recv(MAX_HEADER_SIZE)
+        except BlockingIOError:
+            pass
+        conn.send(response_service_unavailable())
+        conn.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    finally:
+        conn.close()
 
-                print('sending response', file=log_buffer)
-                conn.sendall(response)
-            finally:
-                conn.close()
+
+def pool_server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+                workers=POOL_WORKERS, queue_depth=POOL_QUEUE_DEPTH,
+                access_log=None):
+    """serve connections from a bounded pool of `workers` threads
+
+    The accept loop hands every connection to a `ThreadPoolExecutor`.  At
+    most `queue_depth` connections may wait for a free worker; once that
+    many are waiting further connections are answered with 503 Service
+    Unavailable straight away instead of queueing without bound.  File
+    reads and socket writes release the GIL, so a slow client or a large
+    file holds up one worker rather than the whole server.  An idle
+    keep-alive connection occupies its worker for up to IDLE_TIMEOUT.
+    """
+    # guess_type loads the system tables on first use; do that before any
+    # threads race to
+    mimetypes.init()
+    slots = threading.BoundedSemaphore(workers + queue_depth)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    print("making a pool server on {0}:{1} with {2} workers".format(
+        address[0], address[1], workers), file=log_buffer)
+    sock.bind(address)
+    sock.listen(128)
+    WEBROOT_INDEX.start()
+    if access_log is not None:
+        ACCESS_LOG.start(access_log)
+
+    def done(future, conn):
+        if future.cancelled():
+            conn.close()
+        slots.release()
+
+    pool = ThreadPoolExecutor(max_workers=workers,
+                              thread_name_prefix='http-worker')
+    try:
+        while True:
+            conn, addr = sock.accept()  # blocking
+            if not slots.acquire(blocking=False):
+                print('saturated, refusing {0}:{1}'.format(*addr),
+                      file=log_buffer)
+                refuse_connection(conn)
+                continue
+            future = pool.submit(serve_connection, conn, addr, log_buffer)
+            future.add_done_callback(lambda f, conn=conn: done(f, conn))
 
     except KeyboardInterrupt:
         sock.close()
+        # connections still waiting for a worker are closed unanswered;
+        # those being served are finished
+        pool.shutdown(wait=True, cancel_futures=True)
+        WEBROOT_INDEX.stop()
+        ACCESS_LOG.stop()
         return
 
 
 if __name__ == '__main__':
-    server()
+    # --access-log writes the access log to stdout
+    access_log = sys.stdout if '--access-log' in sys.argv[1:] else None
+    if '--pool' in sys.argv[1:]:
+        pool_server(access_log=access_log)
+    else:
+        server(access_log=access_log)
     sys.exit(0)
@@ -0,0 +1,220 @@
+"""request accounting for the http_server: latency histograms per route and
+a structured access log written off the request path
+"""
+import json
+import math
+import queue
+import threading
+import time
+
+
+class LatencyHistogram():
+    """an HDR-style histogram of latencies in microseconds
+
+    Values below 2 ** SUB_BUCKET_BITS are counted exactly.  Above that,
+    every power of two is split into the same number of equal sub-buckets,
+    so each value is kept to within 1 / 2 ** (SUB_BUCKET_BITS - 1) of what
+    was recorded, about 1.6%, however large it is, and a histogram covering
+    microseconds to hours needs under two thousand counters.  The counters
+    are allocated as larger values are seen.
+    """
+
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.counts = []
+
+    @classmethod
+    def index(cls, value):
+        """the bucket a value is counted in"""
+        sub_buckets = 1 << cls.SUB_BUCKET_BITS
+        if value < sub_buckets:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        half = sub_buckets >> 1
+        return sub_buckets + (shift - 1) * half + (value >> shift) - half
+
+    @classmethod
+    def highest_equivalent(cls, index):
+        """the largest value counted in bucket `index`"""
+        sub_buckets = 1 << cls.SUB_BUCKET_BITS
+        if index < sub_buckets:
+            return index
+        half = sub_buckets >> 1
+        shift, offset = divmod(index - sub_buckets, half)
+        shift += 1
+        return ((offset + half + 1) << shift) - 1
+
+    def record(self, value):
+        """count one latency of `value` microseconds"""
+        value = max(int(value), 0)
+        index = self.index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """the latency `fraction` of the recorded values are at or below"""
+        if not self.count:
+            return 0
+        target = max(int(math.ceil(fraction * self.count)), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.highest_equivalent(index), self.max)
+        return self.max
+
+
+# the route all requests are also counted under
+ALL_ROUTES = '*'
+# where routes beyond the limit are counted
+OTHER_ROUTES = '(other)'
+
+
+class RouteStats():
+    """latency histograms per route, safe to share between threads
+
+    A route is the path of a request that was answered successfully.
+    Error responses are counted by status instead, since anyone can make
+    up paths that do not exist.  At most `max_routes` routes are tracked;
+    requests for any further ones are counted under OTHER_ROUTES.
+    """
+
+    def __init__(self, max_routes=100):
+        self.max_routes = max_routes
+        self._histograms = {}
+        self._tracked = 0
+        self._statuses = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def route(path, status):
+        if status >= 400:
+            return '(status {0})'.format(status)
+        return path.partition('?')[0]
+
+    def record(self, path, status, duration):
+        """count a request for `path` answered with `status` in `duration`
+        seconds
+        """
+        route = self.route(path, status)
+        micros = duration * 1e6
+        with self._lock:
+            if route not in self._histograms:
+                if self._tracked >= self.max_routes:
+                    route = OTHER_ROUTES
+                else:
+                    self._tracked += 1
+            for name in (route, ALL_ROUTES):
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = LatencyHistogram()
+                histogram.record(micros)
+            self._statuses[status] = self._statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        """returns counts and latency percentiles in milliseconds per route
+        """
+        with self._lock:
+            routes = {}
+            for name, histogram in sorted(self._histograms.items()):
+                routes[name] = {
+                    'count': histogram.count,
+                    'mean_ms': histogram.total / histogram.count / 1000,
+                    'p50_ms': histogram.percentile(0.50) / 1000,
+                    'p90_ms': histogram.percentile(0.90) / 1000,
+                    'p99_ms': histogram.percentile(0.99) / 1000,
+                    'max_ms': histogram.max / 1000,
+                }
+            statuses = {str(k): v for k, v in sorted(self._statuses.items())}
+        return {'routes': routes, 'statuses': statuses}
+
+
+class AccessLog():
+    """a structured access log written by a background thread
+
+    `log` puts a record on a bounded queue and returns at once; the thread
+    started by `start` writes each record to the stream as a line of JSON.
+    A slow disk or terminal therefore never holds up a response.  When the
+    queue is full the record is dropped and counted rather than block.
+    Until `start` is called records are discarded.
+    """
+
+    _STOP = object()
+
+    def __init__(self, maxsize=10000):
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._stream = None
+        self._thread = None
+
+    def stats(self):
+        """returns the log counters as a dict"""
+        return {
+            'enabled': self._thread is not None,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+    def start(self, stream):
+        """start writing records to `stream`"""
+        self._stream = stream
+        self._thread = threading.Thread(target=self._write,
+                                        name='access-log', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """write out the queued records and stop the writer"""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def log(self, client, method, target, status, size, duration):
+        """queue one record; `duration` is in seconds"""
+        if self._thread is None:
+            return
+        record = (time.time(), client, method, target, status, size,
+                  duration)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            record = self._queue.get()
+            if record is self._STOP:
+                self._stream.flush()
+                return
+            when, client, method, target, status, size, duration = record
+            line = json.dumps({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                      time.gmtime(when)) +
+                        '.{0:03d}Z'.format(int(when % 1 * 1000)),
+                'client': client,
+                'method': method,
+                'path': target,
+                'status': status,
+                'bytes': size,
+                'duration_ms': round(duration * 1000, 3),
+            })
+            try:
+                self._stream.write(line + '\n')
+                self.written += 1
+                # flush once the burst is written rather than per line
+                if self._queue.empty():
+                    self._stream.flush()
+            except (OSError, ValueError):
+                # a closed or failing stream must not kill the writer
+                self.dropped += 1
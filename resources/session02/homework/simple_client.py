@@ -2,6 +2,16 @@ import socket
 import sys
 
 
+def expected_length(response):
+    """total response size implied by its Content-Length header, or None"""
+    head, _, _ = response.partition(b'\r\n\r\n')
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            return len(head) + 4 + int(value)
+    return None
+
+
 def bytes_client(msg):
     server_address = ('localhost', 10000)
     sock = socket.socket(
@@ -13,16 +23,20 @@ def bytes_client(msg):
     )
     sock.connect(server_address)
     response = b''
-    done = False
     bufsize = 1024
     try:
         print('sending "{0}"'.format(msg), file=sys.stderr)
         sock.sendall(msg.encode('utf8'))
-        while not done:
+        # the body is complete once Content-Length bytes follow the headers;
+        # without a length, read until the server closes the connection
+        expected = None
+        while expected is None or len(response) < expected:
             chunk = sock.recv(bufsize)
-            if len(chunk) < bufsize:
-                done = True
+            if not chunk:
+                break
             response += chunk
+            if expected is None and b'\r\n\r\n' in response:
+                expected = expected_length(response)
         print('received "{0}"'.format(response), file=sys.stderr)
     finally:
         print('closing socket', file=sys.stderr)
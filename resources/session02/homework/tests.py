@@ -1,8 +1,20 @@
+import gzip
+import io
+import json
 import mimetypes
+import multiprocessing
 import os
 import pathlib
+import random
+import signal
 import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
 import unittest
+import zlib
 
 
 CRLF = '\r\n'
@@ -95,6 +107,15 @@ class ResponseOkTestCase(unittest.TestCase):
                         "expected {0}, got {1}".format(expected, actual)
                     )
 
+    def test_response_has_content_length(self):
+        bodies = [b"", b"a body", "multibyte \u00e9".encode('utf8')]
+        for body in bodies:
+            ok = self.call_function_under_test(body=body)
+            self.assertIn(
+                'Content-Length: {0}'.format(len(body)).encode('utf8'),
+                extract_headers(ok)
+            )
+
     def test_passed_body_in_response(self):
         bodies = [
             b"a body",
@@ -194,6 +215,1016 @@ class ParseRequestTestCase(unittest.TestCase):
             )
 
 
+class ParseHeadersTestCase(unittest.TestCase):
+    """unit tests for the parse_headers function"""
+
+    def test_headers_parsed(self):
+        from http_server import parse_headers
+        request = CRLF.join([
+            'GET / HTTP/1.1', 'Host: example.com', 'Connection:  Close', '', ''
+        ])
+        expected = {'host': 'example.com', 'connection': 'Close'}
+        self.assertEqual(expected, parse_headers(request))
+
+
+class RequestParserTestCase(unittest.TestCase):
+    """unit tests for the incremental request parser
+
+    The fuzz-style tests use fixed seeds so that failures can be replayed.
+    """
+
+    REQUESTS = [
+        b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n',
+        b'GET /images/sample_1.png HTTP/1.0\r\nConnection: keep-alive\r\n'
+        b'Accept: */*\r\nX-Long: ' + b'x' * 3000 + b'\r\n\r\n',
+        b'POST /form HTTP/1.1\r\nHost: example.com\r\n'
+        b'Content-Length: 11\r\n\r\nhello world',
+        b'PUT /up HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+        b'5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n',
+        b'\r\nGET /sample.txt HTTP/1.1\r\nHost:example.com\r\n\r\n',
+    ]
+
+    def makeOne(self, **kwargs):
+        from http_parser import RequestParser
+        return RequestParser(**kwargs)
+
+    def parse(self, pieces, **kwargs):
+        """feed `pieces` one at a time, collecting every request parsed"""
+        parser = self.makeOne(**kwargs)
+        requests = []
+        for piece in pieces:
+            parser.feed(piece)
+            while True:
+                request = parser.next_request()
+                if request is None:
+                    break
+                requests.append(request)
+        return requests, parser
+
+    def summary(self, requests):
+        return [(r.method, r.target, r.version, r.headers, r.body)
+                for r in requests]
+
+    def random_split(self, data, rng):
+        cuts = sorted(rng.sample(range(1, len(data)), rng.randint(0, 20)))
+        return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+    def test_parsed_fields(self):
+        requests, parser = self.parse([b''.join(self.REQUESTS)])
+        self.assertEqual(0, len(parser))
+        expected = [
+            ('GET', '/', 'HTTP/1.1', {'host': 'example.com'}, b''),
+            ('POST', '/form', 'HTTP/1.1', {
+                'host': 'example.com', 'content-length': '11',
+            }, b'hello world'),
+            ('PUT', '/up', 'HTTP/1.1', {'transfer-encoding': 'chunked'},
+             b'hello world'),
+            ('GET', '/sample.txt', 'HTTP/1.1', {'host': 'example.com'}, b''),
+        ]
+        actual = self.summary(requests)
+        self.assertEqual(expected, actual[:1] + actual[2:])
+        self.assertEqual('x' * 3000, requests[1].headers['x-long'])
+        self.assertTrue(requests[1].keep_alive())
+
+    def test_any_segmentation_gives_same_requests(self):
+        stream = b''.join(self.REQUESTS)
+        expected = self.summary(self.parse([stream])[0])
+        rng = random.Random(1234)
+        for _ in range(300):
+            pieces = self.random_split(stream, rng)
+            actual = self.summary(self.parse(pieces)[0])
+            self.assertEqual(expected, actual)
+
+    def test_byte_at_a_time(self):
+        stream = b''.join(self.REQUESTS)
+        pieces = [stream[i:i + 1] for i in range(len(stream))]
+        self.assertEqual(5, len(self.parse(pieces)[0]))
+
+    def test_request_of_exact_buffer_multiples(self):
+        for size in (1024, 2048, 4096):
+            head = b'GET / HTTP/1.1\r\nX-Pad: '
+            pad = size - len(head) - 4
+            request = head + b'p' * pad + b'\r\n\r\n'
+            self.assertEqual(size, len(request))
+            pieces = [request[i:i + 1024] for i in range(0, size, 1024)]
+            requests, parser = self.parse(pieces)
+            self.assertEqual(1, len(requests))
+            self.assertEqual(0, len(parser))
+
+    def test_incomplete_request_waits(self):
+        for request in self.REQUESTS:
+            requests, parser = self.parse([request[:-1]])
+            self.assertEqual([], requests)
+
+    def test_mutated_input_only_raises_parse_error(self):
+        from http_parser import ParseError
+        rng = random.Random(4321)
+        stream = b''.join(self.REQUESTS)
+        for _ in range(2000):
+            data = bytearray(stream)
+            for _ in range(rng.randint(1, 8)):
+                position = rng.randrange(len(data))
+                action = rng.random()
+                if action < 0.4:
+                    data[position] = rng.randrange(256)
+                elif action < 0.7:
+                    del data[position]
+                else:
+                    data.insert(position, rng.choice(b'\r\n :;-0aZ\x00\xff'))
+            try:
+                self.parse(self.random_split(bytes(data), rng))
+            except ParseError:
+                pass
+
+    def test_malformed_requests_rejected(self):
+        from http_parser import ParseError
+        cases = [
+            (b'GET /\r\n\r\n', '400 Bad Request'),
+            (b'GET  / HTTP/1.1\r\n\r\n', '400 Bad Request'),
+            (b'G(T / HTTP/1.1\r\n\r\n', '400 Bad Request'),
+            (b'GET / HTTP/x\r\n\r\n', '400 Bad Request'),
+            (b'GET / HTTP/2.0\r\n\r\n', '505 HTTP Version Not Supported'),
+            (b'GET /\xff HTTP/1.1\r\n\r\n', '400 Bad Request'),
+            (b'GET / HTTP/1.1\r\nNo colon\r\n\r\n', '400 Bad Request'),
+            (b'GET / HTTP/1.1\r\nA: b\r\n folded\r\n\r\n',
+             '400 Bad Request'),
+            (b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+             '400 Bad Request'),
+            (b'POST / HTTP/1.1\r\nContent-Length: 1\r\n'
+             b'Content-Length: 2\r\n\r\n', '400 Bad Request'),
+            (b'POST / HTTP/1.1\r\nContent-Length: 1\r\n'
+             b'Transfer-Encoding: chunked\r\n\r\n', '400 Bad Request'),
+            (b'POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n',
+             '501 Not Implemented'),
+            (b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+             b'zz\r\n', '400 Bad Request'),
+            (b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+             b'1\r\nab\r\n', '400 Bad Request'),
+        ]
+        for request, status in cases:
+            with self.assertRaises(ParseError) as raised:
+                self.parse([request])
+            self.assertEqual(status, raised.exception.status, request)
+
+    def test_header_size_limit(self):
+        from http_parser import ParseError
+        request = b'GET / HTTP/1.1\r\nX-Big: ' + b'b' * 2000
+        with self.assertRaises(ParseError) as raised:
+            self.parse([request], max_header_size=1024)
+        self.assertEqual('431 Request Header Fields Too Large',
+                         raised.exception.status)
+        with self.assertRaises(ParseError):
+            self.parse([request + b'\r\n\r\n'], max_header_size=1024)
+
+    def test_body_size_limit(self):
+        from http_parser import ParseError
+        requests = [
+            b'POST / HTTP/1.1\r\nContent-Length: 2048\r\n\r\n',
+            b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'400\r\n' + b'a' * 1024 + b'\r\n1\r\n',
+        ]
+        for request in requests:
+            with self.assertRaises(ParseError) as raised:
+                self.parse([request], max_body_size=1024)
+            self.assertEqual('413 Payload Too Large', raised.exception.status)
+
+    def test_buffer_compacted(self):
+        request = self.REQUESTS[0]
+        parser = self.makeOne()
+        for _ in range(1000):
+            parser.feed(request)
+            self.assertIsNotNone(parser.next_request())
+        self.assertLess(len(parser.buffer), len(request) * 2)
+
+
+class HandleConnectionTestCase(unittest.TestCase):
+    """unit tests for the persistent connection loop
+
+    A socket pair stands in for the client connection, so these do not
+    require the server to be running.
+    """
+
+    def setUp(self):
+        self.client, self.conn = socket.socketpair()
+
+    def tearDown(self):
+        self.client.close()
+        self.conn.close()
+
+    def serve(self, message, timeout=1):
+        from http_server import handle_connection
+        self.client.sendall(message.encode('utf8'))
+        self.client.shutdown(socket.SHUT_WR)
+        handle_connection(self.conn, log_buffer=io.StringIO(), timeout=timeout)
+        self.conn.close()
+        response = b''
+        while True:
+            chunk = self.client.recv(4096)
+            if not chunk:
+                return response
+            response += chunk
+
+    def test_pipelined_requests(self):
+        request = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', '', ''])
+        uris = ['/sample.txt', '/missing.html', '/a_web_page.html']
+        response = self.serve(''.join(request.format(uri) for uri in uris))
+        # responses must come back complete and in request order
+        self.assertEqual(3, response.count(b'HTTP/1.1 '))
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        missing = response.find(b'HTTP/1.1 404 Not Found')
+        self.assertTrue(response.find(b'HTTP/1.1 200 OK', missing) > missing)
+        expected = pathlib.Path('webroot/sample.txt').read_bytes()
+        self.assertIn(expected, response)
+
+    def test_connection_close_ends_loop(self):
+        request = CRLF.join(['GET {0} HTTP/1.1', 'Connection: {1}', '', ''])
+        message = request.format('/sample.txt', 'close') + \
+            request.format('/a_web_page.html', 'keep-alive')
+        response = self.serve(message)
+        self.assertEqual(1, response.count(b'HTTP/1.1 200 OK'))
+
+    def test_request_body_read_past(self):
+        message = CRLF.join([
+            'POST /sample.txt HTTP/1.1', 'Content-Length: 4', '', 'body'
+        ]) + CRLF.join(['GET /sample.txt HTTP/1.1', '', ''])
+        response = self.serve(message)
+        self.assertTrue(response.startswith(b'HTTP/1.1 405'))
+        self.assertIn(b'HTTP/1.1 200 OK', response)
+
+    def test_malformed_request_answered(self):
+        response = self.serve('GET / HTTP/2.0\r\n\r\n')
+        self.assertTrue(
+            response.startswith(b'HTTP/1.1 505 HTTP Version Not Supported')
+        )
+
+    def test_requests_counted_in_stats(self):
+        import http_server
+        from http_stats import RouteStats
+        saved, http_server.STATS = http_server.STATS, RouteStats()
+        self.addCleanup(setattr, http_server, 'STATS', saved)
+        request = CRLF.join(['GET {0} HTTP/1.1', '', ''])
+        uris = ['/sample.txt', '/sample.txt', '/missing.html', '/__stats']
+        response = self.serve(''.join(request.format(uri) for uri in uris))
+        stats = json.loads(response.rsplit(CRLF_BYTES * 2, 1)[1])
+        routes = stats['requests']['routes']
+        self.assertEqual(2, routes['/sample.txt']['count'])
+        self.assertEqual(1, routes['(status 404)']['count'])
+        self.assertEqual(3, routes['*']['count'])
+
+    def test_idle_connection_times_out(self):
+        from http_server import handle_connection
+        handle_connection(self.conn, log_buffer=io.StringIO(), timeout=0.05)
+
+
+def _run_pool_server(address, workers, queue_depth):
+    from http_server import pool_server
+    with open(os.devnull, 'w') as devnull:
+        pool_server(log_buffer=devnull, address=address, workers=workers,
+                    queue_depth=queue_depth)
+
+
+def _run_server(address):
+    from http_server import server
+    with open(os.devnull, 'w') as devnull:
+        server(log_buffer=devnull, address=address)
+
+
+class ServerProcessTestCase(unittest.TestCase):
+    """shared functionality: run a server in a child process"""
+
+    def start_server(self, target, *args):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.address = probe.getsockname()
+        self.proc = multiprocessing.Process(target=target,
+                                            args=(self.address,) + args)
+        self.proc.start()
+        self.addCleanup(self.stop)
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(self.address).close()
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+            else:
+                return
+
+    def stop(self):
+        os.kill(self.proc.pid, signal.SIGINT)
+        self.proc.join(10)
+        if self.proc.is_alive():
+            self.proc.kill()
+
+    def fetch(self, uri, connection='close', sock=None):
+        from bench import make_request, read_response
+        if sock is None:
+            with socket.create_connection(self.address, timeout=5) as sock:
+                return self.fetch(uri, connection, sock)
+        sock.sendall(make_request(uri, connection))
+        return read_response(sock, bytearray())
+
+
+class SerialServerTestCase(ServerProcessTestCase):
+    """functional tests for the one-connection-at-a-time server"""
+
+    def test_idle_keep_alive_does_not_block_others(self):
+        self.start_server(_run_server)
+        with socket.create_connection(self.address, timeout=5) as held:
+            status, _ = self.fetch('/sample.txt', 'keep-alive', held)
+            self.assertEqual(b'HTTP/1.1 200 OK', status)
+            start = time.monotonic()
+            status, _ = self.fetch('/sample.txt')
+            elapsed = time.monotonic() - start
+        self.assertEqual(b'HTTP/1.1 200 OK', status)
+        # well inside IDLE_TIMEOUT
+        self.assertLess(elapsed, 1)
+
+    def test_keep_alive_large_file_latency(self):
+        from http_server import SENDFILE_THRESHOLD
+        self.start_server(_run_server)
+        uri = '/images/Sample_Scene_Balls.jpg'
+        expected = pathlib.Path('webroot' + uri).read_bytes()
+        self.assertGreaterEqual(len(expected), SENDFILE_THRESHOLD)
+        with socket.create_connection(self.address, timeout=5) as sock:
+            self.fetch(uri, 'keep-alive', sock)
+            start = time.monotonic()
+            for _ in range(10):
+                status, body = self.fetch(uri, 'keep-alive', sock)
+                self.assertEqual(expected, body)
+            elapsed = (time.monotonic() - start) / 10
+        # Nagle's algorithm waiting on a delayed ACK costs ~40ms a request
+        self.assertLess(elapsed, 0.02)
+
+
+class PoolServerTestCase(ServerProcessTestCase):
+    """functional tests for pool_server, run in a child process"""
+
+    def start(self, workers, queue_depth):
+        self.start_server(_run_pool_server, workers, queue_depth)
+
+    def test_concurrent_clients(self):
+        self.start(workers=4, queue_depth=16)
+        uri = '/images/Sample_Scene_Balls.jpg'
+        expected = pathlib.Path('webroot' + uri).read_bytes()
+        results = []
+
+        def client():
+            for _ in range(5):
+                results.append(self.fetch(uri))
+
+        threads = [threading.Thread(target=client) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(40, len(results))
+        for status, body in results:
+            self.assertEqual(b'HTTP/1.1 200 OK', status)
+            self.assertEqual(expected, body)
+
+    def fetch_until_served(self, connect):
+        """retry on fresh connections until the pool has room again"""
+        deadline = time.monotonic() + 5
+        while True:
+            sock = connect()
+            status, _ = self.fetch('/sample.txt', 'keep-alive', sock)
+            if status == b'HTTP/1.1 200 OK' or time.monotonic() > deadline:
+                return sock, status
+            sock.close()
+            time.sleep(0.05)
+
+    def test_saturated_pool_refuses(self):
+        self.start(workers=1, queue_depth=0)
+
+        def connect():
+            return socket.create_connection(self.address, timeout=5)
+
+        # the worker may still be busy with the connection start() made
+        held, status = self.fetch_until_served(connect)
+        with held:
+            # a keep-alive connection keeps the only worker busy
+            self.assertEqual(b'HTTP/1.1 200 OK', status)
+            status, _ = self.fetch('/sample.txt')
+            self.assertEqual(b'HTTP/1.1 503 Service Unavailable', status)
+
+        # the worker is released once the held connection closes
+        sock, status = self.fetch_until_served(connect)
+        sock.close()
+        self.assertEqual(b'HTTP/1.1 200 OK', status)
+
+class SendFileTestCase(unittest.TestCase):
+    """unit tests for the send_file function"""
+
+    def drain(self, sock, received):
+        """read `sock` to the end into one reused buffer, counting bytes"""
+        buf = bytearray(65536)
+        while True:
+            count = sock.recv_into(buf)
+            if not count:
+                return
+            received.append(count)
+
+    def test_large_file_memory_is_constant(self):
+        """a multi-hundred-MB file is served without entering the heap"""
+        from http_server import send_file
+        size = 256 * 1024 * 1024
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / 'large.bin'
+            with path.open('wb') as f:
+                f.truncate(size)
+            client, conn = socket.socketpair()
+            received = []
+            reader = threading.Thread(target=self.drain,
+                                      args=(client, received))
+            reader.start()
+            tracemalloc.start()
+            try:
+                sent = send_file(conn, path, b'application/octet-stream')
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                conn.close()
+                reader.join()
+                client.close()
+        self.assertEqual(size, sent)
+        self.assertGreater(sum(received), size)
+        self.assertLess(peak, 1024 * 1024)
+
+    def test_response_is_complete(self):
+        from http_server import send_file, response_headers, validators
+        path = pathlib.Path('webroot/images/Sample_Scene_Balls.jpg')
+        body = path.read_bytes()
+        extra = validators(path.stat()) + [b'Accept-Ranges: bytes']
+        expected = response_headers(b'image/jpeg', len(body), extra) + body
+        response = self.send(path, b'image/jpeg')
+        self.assertEqual(expected, response)
+
+    def send(self, path, mimetype, request_headers=None):
+        from http_server import send_file
+        client, conn = socket.socketpair()
+        with client, conn:
+            client.settimeout(5)
+            send_file(conn, path, mimetype, request_headers)
+            conn.close()
+            response = b''
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    return response
+                response += chunk
+
+    def test_not_modified_sent_for_matching_etag(self):
+        from http_server import entity_tag
+        path = pathlib.Path('webroot/sample.txt')
+        headers = {'if-none-match': entity_tag(path.stat())}
+        response = self.send(path, b'text/plain', headers)
+        self.assertEqual(b'304 Not Modified', extract_response_code(response))
+        self.assertEqual(b'', extract_body(response))
+        self.assertIn(
+            'ETag: {0}'.format(headers['if-none-match']).encode('utf8'),
+            extract_headers(response)
+        )
+
+    def test_full_response_sent_for_stale_etag(self):
+        path = pathlib.Path('webroot/sample.txt')
+        headers = {'if-none-match': '"stale"'}
+        response = self.send(path, b'text/plain', headers)
+        self.assertEqual(b'200 OK', extract_response_code(response))
+        self.assertEqual(path.read_bytes(), extract_body(response))
+
+    def test_single_range(self):
+        path = pathlib.Path('webroot/images/Sample_Scene_Balls.jpg')
+        body = path.read_bytes()
+        cases = [
+            ('bytes=0-99', 0, 99),
+            ('bytes=100000-', 100000, len(body) - 1),
+            ('bytes=-500', len(body) - 500, len(body) - 1),
+            ('bytes=10-10', 10, 10),
+        ]
+        for value, first, last in cases:
+            response = self.send(path, b'image/jpeg', {'range': value})
+            self.assertEqual(b'206 Partial Content',
+                             extract_response_code(response))
+            self.assertEqual(body[first:last + 1], extract_body(response))
+            self.assertIn(
+                'Content-Range: bytes {0}-{1}/{2}'.format(
+                    first, last, len(body)).encode('utf8'),
+                extract_headers(response)
+            )
+
+    def test_multiple_ranges(self):
+        path = pathlib.Path('webroot/sample.txt')
+        body = path.read_bytes()
+        response = self.send(path, b'text/plain', {'range': 'bytes=0-4,-5'})
+        self.assertEqual(b'206 Partial Content',
+                         extract_response_code(response))
+        content_type = [h for h in extract_headers(response)
+                        if h.startswith(b'Content-Type:')][0]
+        boundary = content_type.split(b'boundary=')[1]
+        parts = extract_body(response).split(b'--' + boundary)
+        self.assertEqual(b'--\r\n', parts[-1])
+        for part, expected in zip(parts[1:3], (body[:5], body[-5:])):
+            self.assertTrue(
+                part.endswith(CRLF_BYTES * 2 + expected + CRLF_BYTES)
+            )
+        self.assertIn(
+            'Content-Range: bytes 0-4/{0}'.format(len(body)).encode('utf8'),
+            parts[1]
+        )
+        self.assertEqual(
+            len(extract_body(response)),
+            int([h for h in extract_headers(response)
+                 if h.startswith(b'Content-Length:')][0].split(b':')[1])
+        )
+
+    def test_unsatisfiable_range(self):
+        path = pathlib.Path('webroot/sample.txt')
+        size = path.stat().st_size
+        response = self.send(path, b'text/plain',
+                             {'range': 'bytes={0}-'.format(size)})
+        self.assertEqual(b'416 Range Not Satisfiable',
+                         extract_response_code(response))
+        self.assertIn('Content-Range: bytes */{0}'.format(size).encode('utf8'),
+                      extract_headers(response))
+
+    def test_stale_if_range_sends_everything(self):
+        path = pathlib.Path('webroot/sample.txt')
+        headers = {'range': 'bytes=0-4', 'if-range': '"stale"'}
+        response = self.send(path, b'text/plain', headers)
+        self.assertEqual(b'200 OK', extract_response_code(response))
+        self.assertEqual(path.read_bytes(), extract_body(response))
+
+    def test_many_overlapping_ranges_bounded(self):
+        path = pathlib.Path('webroot/images/Sample_Scene_Balls.jpg')
+        body = path.read_bytes()
+        for count in (3, 4000):
+            value = 'bytes=' + ','.join(['0-'] * count)
+            response = self.send(path, b'image/jpeg', {'range': value})
+            self.assertEqual(b'200 OK', extract_response_code(response))
+            self.assertEqual(body, extract_body(response))
+        value = 'bytes=' + ','.join(['0-9', '5-19', '20-29'] * 5)
+        response = self.send(path, b'image/jpeg', {'range': value})
+        self.assertEqual(b'206 Partial Content',
+                         extract_response_code(response))
+        self.assertEqual(body[:30], extract_body(response))
+
+
+class ContentEncodingTestCase(unittest.TestCase):
+    """unit tests for compressed responses from send_file"""
+
+    def setUp(self):
+        import http_server
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmp.name) / 'page.html'
+        self.body = b'<p>some highly compressible text</p>\n' * 200
+        self.path.write_bytes(self.body)
+        self.saved_cache = http_server.COMPRESSION_CACHE
+        self.cache = http_server.CompressionCache()
+        http_server.COMPRESSION_CACHE = self.cache
+
+    def tearDown(self):
+        import http_server
+        http_server.COMPRESSION_CACHE = self.saved_cache
+        self.tmp.cleanup()
+
+    def send(self, headers, mimetype=b'text/html'):
+        from http_server import send_file
+        client, conn = socket.socketpair()
+        with client, conn:
+            client.settimeout(5)
+            send_file(conn, self.path, mimetype, headers)
+            conn.close()
+            response = b''
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    return response
+                response += chunk
+
+    def test_negotiate_encoding(self):
+        from http_server import negotiate_encoding
+        cases = [
+            ('', None),
+            ('gzip', 'gzip'),
+            ('deflate', 'deflate'),
+            ('deflate, gzip', 'gzip'),
+            ('gzip;q=0.5, deflate', 'deflate'),
+            ('gzip;q=0, deflate;q=0', None),
+            ('*', 'gzip'),
+            ('*;q=0.1, gzip;q=0', 'deflate'),
+            ('x-gzip', 'gzip'),
+            ('br', None),
+            ('gzip;q=bogus', None),
+        ]
+        for value, expected in cases:
+            self.assertEqual(expected, negotiate_encoding(value), value)
+
+    def test_gzip_response(self):
+        response = self.send({'accept-encoding': 'gzip, deflate'})
+        self.assertEqual(b'200 OK', extract_response_code(response))
+        self.assertIn(b'Content-Encoding: gzip', extract_headers(response))
+        self.assertIn(b'Vary: Accept-Encoding', extract_headers(response))
+        body = extract_body(response)
+        self.assertLess(len(body), len(self.body))
+        self.assertEqual(self.body, gzip.decompress(body))
+
+    def test_deflate_response(self):
+        response = self.send({'accept-encoding': 'deflate'})
+        self.assertIn(b'Content-Encoding: deflate', extract_headers(response))
+        self.assertEqual(self.body, zlib.decompress(extract_body(response)))
+
+    def test_identity_when_not_accepted(self):
+        for headers in ({}, {'accept-encoding': 'br'}):
+            response = self.send(headers)
+            self.assertEqual(self.body, extract_body(response))
+            self.assertIn(b'Vary: Accept-Encoding', extract_headers(response))
+
+    def test_binary_and_tiny_files_not_compressed(self):
+        response = self.send({'accept-encoding': 'gzip'}, b'image/png')
+        self.assertEqual(self.body, extract_body(response))
+        self.path.write_bytes(b'tiny')
+        response = self.send({'accept-encoding': 'gzip'})
+        self.assertEqual(b'tiny', extract_body(response))
+
+    def test_compressed_once_and_revalidated(self):
+        for _ in range(3):
+            self.send({'accept-encoding': 'gzip'})
+        self.assertEqual((1, 2), (self.cache.misses, self.cache.hits))
+        changed = self.body + b'<p>more</p>'
+        self.path.write_bytes(changed)
+        os.utime(str(self.path), ns=(0, 0))
+        body = extract_body(self.send({'accept-encoding': 'gzip'}))
+        self.assertEqual(changed, gzip.decompress(body))
+        self.assertEqual(2, self.cache.misses)
+
+    def test_encoded_etag_and_not_modified(self):
+        from http_server import entity_tag
+        etag = entity_tag(self.path.stat(), 'gzip')
+        response = self.send({'accept-encoding': 'gzip'})
+        self.assertIn('ETag: {0}'.format(etag).encode('utf8'),
+                      extract_headers(response))
+        response = self.send(
+            {'accept-encoding': 'gzip', 'if-none-match': etag}
+        )
+        self.assertEqual(b'304 Not Modified', extract_response_code(response))
+        # the identity representation does not match the gzip tag
+        response = self.send({'if-none-match': etag})
+        self.assertEqual(b'200 OK', extract_response_code(response))
+
+    def test_precompressed_sibling_served(self):
+        sibling = self.path.with_name('page.html.gz')
+        sibling.write_bytes(gzip.compress(b'precompressed'))
+        response = self.send({'accept-encoding': 'gzip'})
+        self.assertEqual(b'precompressed',
+                         gzip.decompress(extract_body(response)))
+        self.assertEqual(0, self.cache.misses)
+
+    def test_stale_sibling_ignored(self):
+        sibling = self.path.with_name('page.html.gz')
+        sibling.write_bytes(gzip.compress(b'stale'))
+        os.utime(str(sibling), ns=(0, 0))
+        response = self.send({'accept-encoding': 'gzip'})
+        self.assertEqual(self.body, gzip.decompress(extract_body(response)))
+
+
+class ParseRangeTestCase(unittest.TestCase):
+    """unit tests for the parse_range function"""
+
+    def call_function_under_test(self, value, size=1000):
+        from http_server import parse_range
+        return parse_range(value, size)
+
+    def test_satisfiable_ranges(self):
+        cases = [
+            ('bytes=0-499', [(0, 499)]),
+            ('bytes=500-999', [(500, 999)]),
+            ('bytes=500-', [(500, 999)]),
+            ('bytes=-200', [(800, 999)]),
+            ('bytes=-5000', [(0, 999)]),
+            ('bytes=900-5000', [(900, 999)]),
+            ('bytes=0-0, -1', [(0, 0), (999, 999)]),
+            ('bytes=0-9,2000-,20-29', [(0, 9), (20, 29)]),
+        ]
+        for value, expected in cases:
+            actual = self.call_function_under_test(value)
+            self.assertEqual(expected, actual, value)
+
+    def test_unsatisfiable_ranges(self):
+        for value in ('bytes=1000-', 'bytes=1000-2000', 'bytes=-0'):
+            self.assertEqual([], self.call_function_under_test(value), value)
+        self.assertEqual([], self.call_function_under_test('bytes=-10', 0))
+
+    def test_invalid_ranges_ignored(self):
+        values = [
+            'bytes=', 'items=0-9', 'bytes=9-0', 'bytes=a-b', 'bytes=5',
+            'bytes=0-9,x', 'bytes=--5',
+        ]
+        for value in values:
+            self.assertIsNone(self.call_function_under_test(value), value)
+
+    def test_overlapping_ranges_merged(self):
+        cases = [
+            ('bytes=20-29,0-9', [(0, 9), (20, 29)]),
+            ('bytes=0-9,5-14', [(0, 14)]),
+            ('bytes=0-9,10-19,-5', [(0, 19), (995, 999)]),
+        ]
+        for value, expected in cases:
+            actual = self.call_function_under_test(value)
+            self.assertEqual(expected, actual, value)
+
+    def test_amplifying_ranges_ignored(self):
+        from http_server import MAX_RANGES
+        values = [
+            'bytes=0-,0-',
+            'bytes=0-599,400-999',
+            'bytes=' + ','.join(['0-0'] * (MAX_RANGES + 1)),
+        ]
+        for value in values:
+            self.assertIsNone(self.call_function_under_test(value), value)
+
+
+class ConditionalRequestTestCase(unittest.TestCase):
+    """unit tests for the conditional GET helpers"""
+
+    def setUp(self):
+        # Sun, 06 Nov 1994 08:49:37 GMT
+        self.stat = types.SimpleNamespace(
+            st_size=1234, st_mtime=784111777.0, st_mtime_ns=784111777 * 10**9
+        )
+
+    def call_function_under_test(self, headers):
+        from http_server import not_modified
+        return not_modified(headers, self.stat)
+
+    def etag(self):
+        from http_server import entity_tag
+        return entity_tag(self.stat)
+
+    def test_validators(self):
+        from http_server import validators
+        expected = [
+            'ETag: {0}'.format(self.etag()).encode('utf8'),
+            b'Last-Modified: Sun, 06 Nov 1994 08:49:37 GMT',
+        ]
+        self.assertEqual(expected, validators(self.stat))
+
+    def test_unconditional(self):
+        self.assertFalse(self.call_function_under_test({}))
+
+    def test_if_none_match(self):
+        cases = [
+            (self.etag(), True),
+            ('W/' + self.etag(), True),
+            ('"other", ' + self.etag(), True),
+            ('*', True),
+            ('"other"', False),
+        ]
+        for value, expected in cases:
+            actual = self.call_function_under_test({'if-none-match': value})
+            self.assertEqual(expected, actual, value)
+
+    def test_if_modified_since(self):
+        cases = [
+            ('Sun, 06 Nov 1994 08:49:37 GMT', True),
+            ('Mon, 07 Nov 1994 08:49:37 GMT', True),
+            ('Sun, 06 Nov 1994 08:49:36 GMT', False),
+            ('not a date', False),
+        ]
+        for value, expected in cases:
+            headers = {'if-modified-since': value}
+            actual = self.call_function_under_test(headers)
+            self.assertEqual(expected, actual, value)
+
+    def test_if_none_match_takes_precedence(self):
+        headers = {
+            'if-none-match': '"other"',
+            'if-modified-since': 'Mon, 07 Nov 1994 08:49:37 GMT',
+        }
+        self.assertFalse(self.call_function_under_test(headers))
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    """unit tests for the LatencyHistogram class"""
+
+    def makeOne(self):
+        from http_stats import LatencyHistogram
+        return LatencyHistogram()
+
+    def test_small_values_exact(self):
+        histogram = self.makeOne()
+        for value in range(1, 101):
+            histogram.record(value)
+        self.assertEqual(50, histogram.percentile(0.50))
+        self.assertEqual(99, histogram.percentile(0.99))
+        self.assertEqual(100, histogram.percentile(1.0))
+
+    def test_buckets_cover_values(self):
+        from http_stats import LatencyHistogram
+        previous = -1
+        for value in list(range(1000)) + [2 ** 20, 2 ** 20 + 12345, 10 ** 9]:
+            index = LatencyHistogram.index(value)
+            highest = LatencyHistogram.highest_equivalent(index)
+            self.assertLessEqual(value, highest)
+            self.assertLessEqual(highest - value, value / 64)
+            if value < 1000:
+                self.assertIn(index, (previous, previous + 1))
+                previous = index
+
+    def test_percentiles_within_precision(self):
+        rng = random.Random(1234)
+        values = [int(rng.lognormvariate(8, 2)) for _ in range(5000)]
+        histogram = self.makeOne()
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for fraction in (0.5, 0.9, 0.99):
+            exact = values[int(fraction * len(values)) - 1]
+            self.assertAlmostEqual(exact, histogram.percentile(fraction),
+                                   delta=exact / 64 + 1)
+        self.assertEqual(values[-1], histogram.max)
+
+    def test_empty(self):
+        self.assertEqual(0, self.makeOne().percentile(0.99))
+
+
+class RouteStatsTestCase(unittest.TestCase):
+    """unit tests for the RouteStats class"""
+
+    def makeOne(self, max_routes=100):
+        from http_stats import RouteStats
+        return RouteStats(max_routes=max_routes)
+
+    def test_routes_and_statuses(self):
+        stats = self.makeOne()
+        stats.record('/sample.txt', 200, 0.002)
+        stats.record('/sample.txt?x=1', 304, 0.001)
+        stats.record('/missing', 404, 0.003)
+        snapshot = stats.snapshot()
+        self.assertEqual({'*', '/sample.txt', '(status 404)'},
+                         set(snapshot['routes']))
+        self.assertEqual(3, snapshot['routes']['*']['count'])
+        self.assertEqual(2, snapshot['routes']['/sample.txt']['count'])
+        self.assertAlmostEqual(
+            2.0, snapshot['routes']['/sample.txt']['max_ms'], delta=0.05
+        )
+        self.assertEqual({'200': 1, '304': 1, '404': 1},
+                         snapshot['statuses'])
+
+    def test_routes_limited(self):
+        stats = self.makeOne(max_routes=3)
+        for i in range(10):
+            stats.record('/file-{0}'.format(i), 200, 0.001)
+        routes = stats.snapshot()['routes']
+        self.assertEqual({'*', '/file-0', '/file-1', '/file-2', '(other)'},
+                         set(routes))
+        self.assertEqual(7, routes['(other)']['count'])
+
+
+class AccessLogTestCase(unittest.TestCase):
+    """unit tests for the AccessLog class"""
+
+    def makeOne(self, maxsize=100):
+        from http_stats import AccessLog
+        return AccessLog(maxsize=maxsize)
+
+    def test_records_written_as_json_lines(self):
+        stream = io.StringIO()
+        log = self.makeOne()
+        log.start(stream)
+        log.log('127.0.0.1', 'GET', '/sample.txt', 200, 123, 0.0015)
+        log.log('127.0.0.1', 'POST', '/', 405, 45, 0.0001)
+        log.stop()
+        records = [json.loads(line) for line in
+                   stream.getvalue().splitlines()]
+        self.assertEqual(2, len(records))
+        self.assertEqual('/sample.txt', records[0]['path'])
+        self.assertEqual(200, records[0]['status'])
+        self.assertEqual(123, records[0]['bytes'])
+        self.assertEqual(1.5, records[0]['duration_ms'])
+        self.assertEqual('POST', records[1]['method'])
+        self.assertEqual(2, log.written)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        release = threading.Event()
+
+        class SlowStream(io.StringIO):
+            def write(self, text):
+                release.wait(5)
+                return super().write(text)
+
+        log = self.makeOne(maxsize=2)
+        log.start(SlowStream())
+        for _ in range(10):
+            log.log('-', 'GET', '/', 200, 0, 0.0)
+        self.assertGreaterEqual(log.dropped, 7)
+        release.set()
+        log.stop()
+        self.assertEqual(10, log.written + log.dropped)
+
+    def test_not_started_discards(self):
+        log = self.makeOne()
+        log.log('-', 'GET', '/', 200, 0, 0.0)
+        self.assertEqual(0, log.stats()['queued'])
+
+
+class GuessMimetypeTestCase(unittest.TestCase):
+    """unit tests for the guess_mimetype function"""
+
+    def call_function_under_test(self, name):
+        from http_server import guess_mimetype
+        return guess_mimetype(name)
+
+    def test_known_type(self):
+        self.assertEqual(b'image/png', self.call_function_under_test('a.png'))
+
+    def test_unknown_type_defaulted(self):
+        from http_server import DEFAULT_MIMETYPE
+        for name in ('README', 'data.unknown-extension'):
+            self.assertEqual(DEFAULT_MIMETYPE,
+                             self.call_function_under_test(name))
+
+
+class WebrootIndexTestCase(unittest.TestCase):
+    """unit tests for the WebrootIndex class"""
+
+    def setUp(self):
+        self.base = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.base.name)
+        (self.root / 'page.html').write_bytes(b'<p>hello</p>')
+        (self.root / 'images').mkdir()
+        (self.root / 'images' / 'blob').write_bytes(b'x' * 100)
+
+    def tearDown(self):
+        self.base.cleanup()
+
+    def makeOne(self, interval=30):
+        from http_server import WebrootIndex
+        index = WebrootIndex(root=str(self.root), interval=interval)
+        self.addCleanup(index.stop)
+        return index
+
+    def test_scan_indexes_every_path(self):
+        from http_server import DEFAULT_MIMETYPE, file_headers
+        index = self.makeOne()
+        index.scan()
+        self.assertEqual(4, len(index))
+        page = index.lookup('/page.html')
+        st = (self.root / 'page.html').stat()
+        self.assertEqual(self.root / 'page.html', page.path)
+        self.assertEqual((12, st.st_mtime_ns), (page.size, page.mtime_ns))
+        self.assertEqual(b'text/html', page.mimetype)
+        self.assertEqual(file_headers(b'text/html', st), page.headers)
+        self.assertEqual(DEFAULT_MIMETYPE,
+                         index.lookup('/images/blob').mimetype)
+
+    def test_directories_and_trailing_slashes(self):
+        index = self.makeOne()
+        index.scan()
+        for uri in ('/', '/images', '/images/'):
+            entry = index.lookup(uri)
+            self.assertIsNotNone(entry, uri)
+            self.assertIsNone(entry.mimetype)
+        self.assertIsNone(index.lookup('/missing.html'))
+
+    def test_background_rescan(self):
+        index = self.makeOne(interval=0.01)
+        index.start()
+        (self.root / 'new.txt').write_bytes(b'new')
+        deadline = time.monotonic() + 5
+        while index.lookup('/new.txt') is None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertGreater(index.scans, 1)
+
+    def test_stale_entry_not_used(self):
+        from http_server import index_entry, send_file
+        path = self.root / 'page.html'
+        entry = index_entry(path)
+        path.write_bytes(b'<p>hello, changed</p>')
+        os.utime(str(path), ns=(0, 0))
+        client, conn = socket.socketpair()
+        with client, conn:
+            send_file(conn, path, entry.mimetype, {}, entry)
+            conn.close()
+            response = client.recv(65536)
+        self.assertIn(b'Content-Length: 21\r\n', response)
+        self.assertTrue(response.endswith(b'<p>hello, changed</p>'))
+
+    def test_fresh_entry_matches_uncached(self):
+        from http_server import index_entry, send_file
+        path = self.root / 'images' / 'blob'
+        responses = []
+        for entry in (None, index_entry(path)):
+            client, conn = socket.socketpair()
+            with client, conn:
+                send_file(conn, path, b'application/octet-stream', {}, entry)
+                conn.close()
+                responses.append(client.recv(65536))
+        self.assertEqual(responses[0], responses[1])
+
+
 class ResolveURITestCase(unittest.TestCase):
     """unit tests for the resolve_uri function"""
 
@@ -306,7 +1337,7 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
         return response
 
     def test_get_request(self):
-        message = CRLF.join(['GET / HTTP/1.1', 'Host: example.com', ''])
+        message = CRLF.join(['GET / HTTP/1.1', 'Host: example.com', '', ''])
         expected = '200 OK'
         actual = self.send_message(message)
         self.assertTrue(
@@ -314,7 +1345,7 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
         )
 
     def test_post_request(self):
-        message = CRLF.join(['POST / HTTP/1.1', 'Host: example.com', ''])
+        message = CRLF.join(['POST / HTTP/1.1', 'Host: example.com', '', ''])
         expected = '405 Method Not Allowed'
         actual = self.send_message(message)
         self.assertTrue(
@@ -323,7 +1354,7 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
 
     def test_webroot_directory_resources(self):
         """verify that directory uris are properly served"""
-        message_tmpl = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', ''])
+        message_tmpl = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', '', ''])
         root = "webroot"
         for directory, directories, files in os.walk(root):
             directory_uri = "/{0}".format(directory[len(root):])
@@ -341,7 +1372,7 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
 
     def test_webroot_file_uris(self):
         """verify that file uris are properly served"""
-        message_tmpl = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', ''])
+        message_tmpl = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', '', ''])
         root = pathlib.Path("webroot")
         for file_path in root.iterdir():
             # set up expectations for this file
@@ -379,7 +1410,7 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
         requires using a client that does not attempt to decode the response
         body
         """
-        message_tmpl = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', ''])
+        message_tmpl = CRLF.join(['GET {0} HTTP/1.1', 'Host: example.com', '', ''])
         root = pathlib.Path("webroot")
         images_path = root / 'images'
         for file_path in images_path.iterdir():
@@ -414,7 +1445,7 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
 
     def test_missing_resource(self):
         message = CRLF.join(
-            ['GET /missing.html HTTP/1.1', 'Host: example.com', '']
+            ['GET /missing.html HTTP/1.1', 'Host: example.com', '', '']
         )
         expected = '404 Not Found'
         actual = self.send_message(message)
@@ -0,0 +1,330 @@
+"""an asyncio load generator for the http servers and WSGI apps
+
+Like simple_client.py it talks to a server on localhost:10000, but it keeps
+many connections busy at once, reuses them across requests and reports
+throughput and latency percentiles as JSON, so two runs can be compared:
+
+    $ python load_client.py --connections 50 --duration 10 --warmup 2 \\
+          --mix /sample.txt:5 /images/JPEG_example.jpg:1 --output run.json
+
+Each of the connections sends a request, waits for the whole response and
+sends the next (a closed loop), choosing paths from the weighted mix with
+a seeded random generator.  Requests completed during the warmup are not
+counted.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+
+
+class ResponseError(Exception):
+    """raised for a response the client cannot make sense of"""
+
+
+def parse_mix(specs):
+    """turn 'PATH[:WEIGHT]' strings, with an optional 'METHOD ' prefix,
+    into a list of ((method, path), weight) pairs
+    """
+    mix = []
+    for spec in specs:
+        method, _, target = spec.strip().rpartition(' ')
+        path, _, weight = target.rpartition(':')
+        if not path or not weight.isdigit():
+            path, weight = target, '1'
+        if not path.startswith('/') or int(weight) < 1:
+            raise ValueError('bad request mix entry {0!r}'.format(spec))
+        mix.append(((method.upper() or 'GET', path), int(weight)))
+    return mix
+
+
+def build_request(method, path, host, keep_alive=True):
+    """returns the bytes of a bodyless HTTP/1.1 request"""
+    lines = [
+        '{0} {1} HTTP/1.1'.format(method, path),
+        'Host: {0}'.format(host),
+        'Connection: {0}'.format('keep-alive' if keep_alive else 'close'),
+        '',
+        '',
+    ]
+    return '\r\n'.join(lines).encode('latin-1')
+
+
+async def _read_until(reader, separator):
+    """reader.readuntil, failing with ResponseError rather than
+    LimitOverrunError when there is more before `separator` than the
+    reader will buffer
+    """
+    try:
+        return await reader.readuntil(separator)
+    except asyncio.LimitOverrunError:
+        raise ResponseError('no {0!r} within the stream limit'.format(
+            separator))
+
+
+async def read_response(reader, method='GET'):
+    """read one response, returning (status, body bytes, reusable)
+
+    The body is framed by Content-Length or chunked encoding, or else runs
+    to the end of the stream, in which case the connection cannot be used
+    again.
+    """
+    try:
+        head = await _read_until(reader, b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            raise ConnectionResetError('connection closed before response')
+        raise ResponseError('connection closed mid-headers')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        version, status = lines[0].split(' ', 2)[:2]
+        status = int(status)
+    except ValueError:
+        raise ResponseError('malformed status line {0!r}'.format(lines[0]))
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        reusable = 'close' not in connection
+    else:
+        reusable = 'keep-alive' in connection
+
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        return status, 0, reusable
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        size = 0
+        while True:
+            line = await _read_until(reader, b'\r\n')
+            length = int(line.split(b';', 1)[0], 16)
+            if not length:
+                # trailer fields, then the blank line
+                while await _read_until(reader, b'\r\n') != b'\r\n':
+                    pass
+                return status, size, reusable
+            await reader.readexactly(length + 2)
+            size += length
+    if 'content-length' in headers:
+        length = int(headers['content-length'])
+        await reader.readexactly(length)
+        return status, length, reusable
+    size = 0
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            return status, size, False
+        size += len(chunk)
+
+
+def percentile(ordered, fraction):
+    """nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(int(math.ceil(fraction * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+class Results():
+    """what the connections observed once the warmup was over"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+        self.connections_opened = 0
+
+    def add(self, latency, status, size):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes += size
+
+    def error(self, exc):
+        name = type(exc).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        ordered = sorted(self.latencies)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            'requests': len(ordered),
+            'errors': sum(self.errors.values()),
+            'error_types': self.errors,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+            'connections_opened': self.connections_opened,
+            'elapsed_s': round(elapsed, 3),
+            'requests_per_s': round(len(ordered) / elapsed, 1)
+            if elapsed else None,
+            'mb_per_s': round(self.bytes / elapsed / 1e6, 3)
+            if elapsed else None,
+            'latency_ms': {
+                'min': ms(ordered[0] if ordered else None),
+                'mean': ms(sum(ordered) / len(ordered) if ordered else None),
+                'p50': ms(percentile(ordered, 0.50)),
+                'p90': ms(percentile(ordered, 0.90)),
+                'p99': ms(percentile(ordered, 0.99)),
+                'p999': ms(percentile(ordered, 0.999)),
+                'max': ms(ordered[-1] if ordered else None),
+            },
+        }
+
+
+# seconds a connection waits after an error before trying again, so a
+# server that is down is not hammered in a tight loop
+ERROR_BACKOFF = 0.05
+
+
+def _count_down(state):
+    """account for one measured request, successful or not"""
+    if state['remaining'] > 0:
+        state['remaining'] -= 1
+        if state['remaining'] == 0:
+            state['stop'] = True
+
+
+async def _connection(address, choose, keep_alive, timeout, state, results):
+    """issue requests over one connection at a time until told to stop"""
+    reader = writer = None
+    while not state['stop']:
+        method, path = choose()
+        request = build_request(method, path, address[0], keep_alive)
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*address), timeout
+                )
+                if state['measuring']:
+                    results.connections_opened += 1
+            writer.write(request)
+            status, size, reusable = await asyncio.wait_for(
+                read_response(reader, method), timeout
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ResponseError, ValueError) as e:
+            if state['measuring'] and not state['stop']:
+                results.error(e)
+                # failures use up the budget too, or a run against a
+                # server that is down would never end
+                _count_down(state)
+            reusable = False
+            if writer is not None:
+                writer.close()
+                reader = writer = None
+            await asyncio.sleep(ERROR_BACKOFF)
+        else:
+            if state['measuring'] and not state['stop']:
+                results.add(time.perf_counter() - start, status, size)
+                _count_down(state)
+        if not (keep_alive and reusable) and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(address=('localhost', 10000), mix=((('GET', '/'), 1),),
+              connections=10, duration=10.0, warmup=1.0, requests=None,
+              keep_alive=True, timeout=30.0, seed=0):
+    """run a load test and return its summary as a dict
+
+    The test ends after `duration` seconds of measurement, or once
+    `requests` requests have been measured if that is given; requests
+    that fail count towards `requests`.
+    """
+    rng = random.Random(seed)
+    choices, weights = zip(*mix)
+
+    def choose():
+        return rng.choices(choices, weights)[0]
+
+    # 'remaining' counts down measured requests; -1 means no limit
+    state = {'stop': False, 'measuring': warmup <= 0,
+             'remaining': -1 if requests is None else requests}
+    results = Results()
+    tasks = [
+        asyncio.ensure_future(_connection(address, choose, keep_alive,
+                                          timeout, state, results))
+        for _ in range(connections)
+    ]
+    if warmup > 0:
+        await asyncio.sleep(warmup)
+        state['measuring'] = True
+    start = time.perf_counter()
+    if requests is None:
+        await asyncio.sleep(duration)
+        state['stop'] = True
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*tasks)
+    else:
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    summary = {
+        'config': {
+            'address': '{0}:{1}'.format(*address),
+            'mix': [{'method': method, 'path': path, 'weight': weight}
+                    for (method, path), weight in mix],
+            'connections': connections,
+            'duration_s': duration if requests is None else None,
+            'requests': requests,
+            'warmup_s': warmup,
+            'keep_alive': keep_alive,
+            'seed': seed,
+        },
+    }
+    summary.update(results.summary(elapsed))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=10000)
+    parser.add_argument('--mix', nargs='+', default=['/'],
+                        metavar='[METHOD ]PATH[:WEIGHT]',
+                        help='requests to send and their relative weights')
+    parser.add_argument('--connections', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to measure for')
+    parser.add_argument('--requests', type=int,
+                        help='measure this many requests instead')
+    parser.add_argument('--warmup', type=float, default=1.0,
+                        help='seconds to run before measuring')
+    parser.add_argument('--no-keepalive', dest='keep_alive',
+                        action='store_false',
+                        help='open a new connection for every request')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON here, not stdout')
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    summary = asyncio.run(run(
+        (args.host, args.port), mix, args.connections, args.duration,
+        args.warmup, args.requests, args.keep_alive, args.timeout, args.seed
+    ))
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
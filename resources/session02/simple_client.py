@@ -30,6 +30,58 @@ def client(msg):
     return response
 
 
+def _read_head(sock, buffer):
+    """read into `buffer` until it holds a whole response head, returning
+    the offset of the body
+    """
+    while True:
+        end = buffer.find(b'\r\n\r\n')
+        if end != -1:
+            return end + 4
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('connection closed before response')
+        buffer += chunk
+
+
+def pooled_client(msg, pool, server_address=('localhost', 10000)):
+    """send the request `msg` over a connection borrowed from `pool`
+
+    `pool` is a ConnectionPool from session01/connection_pool.py, or
+    anything with the same `connection` and `discard` methods.  The
+    response body is framed by its Content-Length, so the connection can
+    be given back for the next request; a response without one runs to
+    the end of the stream and its connection is discarded.
+    """
+    with pool.connection(*server_address) as sock:
+        sock.sendall(msg.encode('utf8'))
+        buffer = bytearray()
+        start = _read_head(sock, buffer)
+        head = buffer[:start].decode('latin-1').lower()
+        length = None
+        reusable = 'connection: close' not in head
+        for line in head.split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            if name == 'content-length':
+                length = int(value)
+        if length is None:
+            reusable = False
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                buffer += chunk
+        else:
+            while len(buffer) < start + length:
+                chunk = sock.recv(min(start + length - len(buffer), 65536))
+                if not chunk:
+                    raise ConnectionError('connection closed mid-body')
+                buffer += chunk
+        if not reusable:
+            pool.discard(sock)
+    return buffer.decode('utf8')
+
+
 if __name__ == '__main__':
     if len(sys.argv) != 2:
         usg = '\nusage: python echo_client.py "this is my message"\n'
@@ -1,3 +1,4 @@
+import asyncio
 import mimetypes
 import socket
 import unittest
@@ -161,5 +162,243 @@ class HTTPServerFunctionalTestCase(unittest.TestCase):
         )
 
 
+class ParseMixTestCase(unittest.TestCase):
+    """unit tests for the parse_mix function of load_client"""
+
+    def call_function_under_test(self, specs):
+        from load_client import parse_mix
+        return parse_mix(specs)
+
+    def test_weights_and_methods(self):
+        mix = self.call_function_under_test(
+            ['/', '/a.txt:3', 'post /form', '/page?x=1:2']
+        )
+        self.assertEqual([
+            (('GET', '/'), 1),
+            (('GET', '/a.txt'), 3),
+            (('POST', '/form'), 1),
+            (('GET', '/page?x=1'), 2),
+        ], mix)
+
+    def test_bad_entries(self):
+        for spec in ('a.txt', '/a.txt:0', 'GET'):
+            with self.assertRaises(ValueError):
+                self.call_function_under_test([spec])
+
+
+class ReadResponseTestCase(unittest.TestCase):
+    """unit tests for the read_response coroutine of load_client"""
+
+    def call_function_under_test(self, data, method='GET'):
+        from load_client import read_response
+
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            response = await read_response(reader, method)
+            return response + (await reader.read(),)
+
+        return asyncio.run(read())
+
+    def test_content_length(self):
+        response = self.call_function_under_test(
+            b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhelloHTTP/1.1'
+        )
+        self.assertEqual((200, 5, True, b'HTTP/1.1'), response)
+
+    def test_chunked(self):
+        response = self.call_function_under_test(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'5\r\nhello\r\n6;x=y\r\n world\r\n0\r\nX: 1\r\n\r\nnext'
+        )
+        self.assertEqual((200, 11, True, b'next'), response)
+
+    def test_close_delimited(self):
+        response = self.call_function_under_test(
+            b'HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\nhello'
+        )
+        self.assertEqual((200, 5, False, b''), response)
+
+    def test_connection_close(self):
+        response = self.call_function_under_test(
+            b'HTTP/1.1 404 Not Found\r\nConnection: close\r\n'
+            b'Content-Length: 0\r\n\r\n'
+        )
+        self.assertEqual((404, 0, False, b''), response)
+
+    def test_oversized_head_is_a_response_error(self):
+        from load_client import ResponseError
+        for data in (b'HTTP/1.1 200 OK\r\nX: ' + b'x' * 70000,
+                     b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n'
+                     b'\r\n5;' + b'x' * 70000):
+            with self.assertRaises(ResponseError):
+                self.call_function_under_test(data + b'\r\n\r\n')
+
+
+class LoadClientRunTestCase(unittest.TestCase):
+    """runs load_client against a small server in the same event loop"""
+
+    def run_against_server(self, **kwargs):
+        from load_client import run
+
+        async def serve(reader, writer):
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                path = head.split(b' ')[1]
+                status = b'200 OK' if path == b'/ok' else b'404 Not Found'
+                writer.write(b'HTTP/1.1 ' + status +
+                             b'\r\nContent-Length: 2\r\n\r\nok')
+                await writer.drain()
+                if b'Connection: close' in head:
+                    break
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            async with server:
+                address = server.sockets[0].getsockname()
+                return await run(address, **kwargs)
+
+        return asyncio.run(main())
+
+    def test_request_count_and_mix(self):
+        summary = self.run_against_server(
+            mix=[(('GET', '/ok'), 3), (('GET', '/missing'), 1)],
+            connections=4, requests=400, warmup=0
+        )
+        self.assertEqual(400, summary['requests'])
+        self.assertEqual(0, summary['errors'])
+        self.assertEqual(400, sum(summary['statuses'].values()))
+        self.assertGreater(summary['statuses']['200'],
+                           summary['statuses']['404'])
+        self.assertEqual(4, summary['connections_opened'])
+        latency = summary['latency_ms']
+        self.assertLessEqual(latency['p50'], latency['p99'])
+        self.assertLessEqual(latency['p99'], latency['max'])
+
+    def test_request_budget_ends_when_all_fail(self):
+        import time
+        from load_client import run
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            address = probe.getsockname()
+        # nothing listens on the address, so every connection is refused
+        start = time.monotonic()
+        summary = asyncio.run(run(address, mix=[(('GET', '/ok'), 1)],
+                                  connections=2, requests=5, warmup=0))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(0, summary['requests'])
+        self.assertEqual(5, summary['errors'])
+
+    def test_without_keep_alive(self):
+        summary = self.run_against_server(
+            mix=[(('GET', '/ok'), 1)], connections=2, requests=50,
+            warmup=0, keep_alive=False
+        )
+        self.assertEqual(50, summary['requests'])
+        self.assertGreaterEqual(summary['connections_opened'], 50)
+
+    def test_duration_with_warmup(self):
+        summary = self.run_against_server(
+            mix=[(('GET', '/ok'), 1)], connections=2, duration=0.2,
+            warmup=0.1
+        )
+        self.assertGreater(summary['requests'], 0)
+        self.assertAlmostEqual(0.2, summary['elapsed_s'], delta=0.1)
+
+    def test_seeded_mix_is_reproducible(self):
+        kwargs = dict(mix=[(('GET', '/ok'), 1), (('GET', '/missing'), 1)],
+                      connections=1, requests=100, warmup=0, seed=7)
+        first = self.run_against_server(**kwargs)['statuses']
+        self.assertEqual(first, self.run_against_server(**kwargs)['statuses'])
+
+
+class PooledClientTestCase(unittest.TestCase):
+    """tests for simple_client.pooled_client against a keep-alive server
+    run in a thread
+    """
+
+    class Pool():
+        """the part of session01's ConnectionPool the client uses"""
+
+        def __init__(self):
+            self.sock = None
+            self.connects = 0
+
+        def connection(self, host, port):
+            import contextlib
+
+            @contextlib.contextmanager
+            def lend():
+                if self.sock is None:
+                    self.sock = socket.create_connection((host, port))
+                    self.connects += 1
+                yield self.sock
+
+            return lend()
+
+        def discard(self, sock):
+            sock.close()
+            self.sock = None
+
+    def setUp(self):
+        import threading
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.address = self.listener.getsockname()
+        self.responses = [
+            b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nfirst',
+            b'HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\nsecond',
+            b'HTTP/1.0 200 OK\r\n\r\nthird, until closed',
+            b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n',
+        ]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        # wakes the server thread blocked in accept
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+        self.thread.join(5)
+
+    def serve(self):
+        responses = iter(self.responses)
+        while True:
+            try:
+                conn = self.listener.accept()[0]
+            except OSError:
+                return
+            with conn:
+                buffer = b''
+                for response in responses:
+                    while b'\r\n\r\n' not in buffer:
+                        chunk = conn.recv(1024)
+                        if not chunk:
+                            break
+                        buffer += chunk
+                    buffer = buffer.partition(b'\r\n\r\n')[2]
+                    conn.sendall(response)
+                    if b'Content-Length' not in response:
+                        break
+
+    def test_connection_reused_while_framed(self):
+        from simple_client import pooled_client
+        pool = self.Pool()
+        request = 'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        replies = [pooled_client(request, pool, self.address)
+                   for _ in range(4)]
+        self.assertTrue(replies[0].endswith('\r\n\r\nfirst'))
+        self.assertTrue(replies[1].endswith('\r\n\r\nsecond'))
+        self.assertTrue(replies[2].endswith('third, until closed'))
+        self.assertTrue(replies[3].startswith('HTTP/1.1 404'))
+        # the unframed third response cost the connection
+        self.assertEqual(pool.connects, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,387 @@
+"""benchmarks for http_server.py
+
+Each benchmark is a sub-command and runs against a throwaway webroot.  The
+load benchmark starts every serving mode in a child process, hits it from
+many concurrent client threads and reports requests/sec together with
+latency percentiles.  Run it from this directory:
+
+    $ python bench.py load blocking selectors --clients 100 --requests 20
+    $ python bench.py scale --workers 1 2 4 8
+    $ python bench.py idle asyncio selectors --connections 10000
+    $ python bench.py cache --requests 20000
+    $ python bench.py listing --entries 50000
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import pathlib
+import resource
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import http_parser
+import http_server
+
+
+ADDRESS = ('127.0.0.1', 10080)
+REQUEST = b'GET /sample.txt HTTP/1.1\r\nHost: localhost\r\n' \
+          b'Connection: close\r\n\r\n'
+
+MODES = {
+    'blocking': http_server.server,
+    'selectors': http_server.event_server,
+    'prefork': http_server.prefork_server,
+    'asyncio': http_server.async_server,
+}
+
+
+def make_webroot(base, size=16384):
+    """populate `base`/webroot with a file of `size` bytes to serve"""
+    webroot = pathlib.Path(base) / 'webroot'
+    webroot.mkdir()
+    (webroot / 'sample.txt').write_bytes(b'x' * size)
+    return webroot
+
+
+def _run_server(mode, base, address, options):
+    os.chdir(base)
+    with open(os.devnull, 'w') as devnull:
+        MODES[mode](log_buffer=devnull, address=address, **options)
+
+
+def start_server(mode, base, address=ADDRESS, **options):
+    """start a server in a child process and wait until it accepts"""
+    proc = multiprocessing.Process(
+        target=_run_server, args=(mode, base, address, options), daemon=True
+    )
+    proc.start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(address, timeout=1).close()
+        except OSError:
+            time.sleep(0.05)
+        else:
+            return proc
+    proc.kill()
+    raise RuntimeError('{0} server did not start'.format(mode))
+
+
+def stop_server(proc):
+    os.kill(proc.pid, signal.SIGINT)
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+
+
+def fetch(address, request=REQUEST):
+    """send one request on a fresh connection and read to end of stream"""
+    with socket.create_connection(address, timeout=30) as sock:
+        sock.sendall(request)
+        received = 0
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return received
+            received += len(chunk)
+
+
+def percentile(ordered, fraction):
+    """nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return float('nan')
+    rank = max(int(math.ceil(fraction * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def run_load(address, clients, requests):
+    """run `clients` threads issuing `requests` requests each"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        mine = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                fetch(address)
+            except OSError as e:
+                with lock:
+                    errors.append(e)
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def bench_load(args):
+    for mode in args.modes:
+        if mode not in MODES:
+            sys.exit('unknown mode {0!r}'.format(mode))
+
+    template = '{0:<10} {requests:>7} {errors:>6} {rps:>10.1f} ' \
+               '{p50_ms:>9.2f} {p99_ms:>9.2f}'
+    print('{0:<10} {1:>7} {2:>6} {3:>10} {4:>9} {5:>9}'.format(
+        'mode', 'ok', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    for mode in args.modes or sorted(MODES):
+        with tempfile.TemporaryDirectory() as base:
+            make_webroot(base)
+            proc = start_server(mode, base)
+            try:
+                result = run_load(ADDRESS, args.clients, args.requests)
+            finally:
+                stop_server(proc)
+        print(template.format(mode, **result))
+
+
+def bench_scale(args):
+    """throughput of the pre-fork server as workers are added
+
+    Workers beyond the number of cores cannot add throughput; the client
+    threads share the machine with the server, so leave cores for them.
+    """
+    template = '{0:<8} {1:<9} {requests:>7} {errors:>6} {rps:>10.1f} ' \
+               '{p50_ms:>9.2f} {p99_ms:>9.2f}'
+    print('{0} cores'.format(os.cpu_count()))
+    print('{0:<8} {1:<9} {2:>7} {3:>6} {4:>10} {5:>9} {6:>9}'.format(
+        'workers', 'socket', 'ok', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    for workers in args.workers:
+        for reuse_port in (False, True) if args.reuseport else (False,):
+            with tempfile.TemporaryDirectory() as base:
+                make_webroot(base, size=args.size)
+                proc = start_server('prefork', base, workers=workers,
+                                    reuse_port=reuse_port,
+                                    cache=http_server.ContentCache())
+                try:
+                    result = run_load(ADDRESS, args.clients, args.requests)
+                finally:
+                    stop_server(proc)
+            print(template.format(workers,
+                                  'reuseport' if reuse_port else 'shared',
+                                  **result))
+
+
+def raise_fd_limit():
+    """raise the open file limit as far as allowed, returning it"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def rss_kib(pid):
+    """resident memory of process `pid` in KiB, or None off Linux"""
+    try:
+        with open('/proc/{0}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def bench_idle(args):
+    """memory per idle connection, and whether the server still answers
+
+    Every mode is given `--connections` open but idle client connections.
+    'kib/conn' is the growth of the server's resident memory divided by
+    the connections, 'fresh ms' the time a new client then waits for a
+    response, and 'idle ok' how many of a sample of the idle connections
+    are answered when they finally send a request.
+    """
+    modes = args.modes or ['asyncio', 'selectors']
+    for mode in modes:
+        if mode not in MODES:
+            sys.exit('unknown mode {0!r}'.format(mode))
+    limit = raise_fd_limit()
+    if limit < args.connections + 64:
+        sys.exit('open file limit {0} is too low for {1} connections'.format(
+            limit, args.connections))
+
+    print('{0:<10} {1:>7} {2:>9} {3:>9} {4:>9} {5:>10} {6:>8}'.format(
+        'mode', 'open', 'rss MiB', 'idle MiB', 'kib/conn', 'fresh ms',
+        'idle ok'))
+    for mode in modes:
+        options = {}
+        if mode == 'asyncio':
+            options['keepalive_timeout'] = 600
+        with tempfile.TemporaryDirectory() as base:
+            make_webroot(base)
+            proc = start_server(mode, base, **options)
+            idle = []
+            try:
+                before = rss_kib(proc.pid)
+                for _ in range(args.connections):
+                    try:
+                        idle.append(socket.create_connection(ADDRESS,
+                                                             timeout=5))
+                    except OSError:
+                        break
+                # let the server catch up with its accept queue
+                time.sleep(1)
+                after = rss_kib(proc.pid)
+
+                start = time.perf_counter()
+                try:
+                    with socket.create_connection(ADDRESS, timeout=5) as s:
+                        s.sendall(REQUEST)
+                        s.recv(65536)
+                    fresh = '{0:.2f}'.format(
+                        (time.perf_counter() - start) * 1000)
+                except OSError:
+                    fresh = 'timeout'
+
+                answered = 0
+                sample = idle[::max(len(idle) // args.sample, 1)]
+                for sock in sample:
+                    try:
+                        sock.settimeout(5)
+                        sock.sendall(REQUEST)
+                        if sock.recv(65536).startswith(b'HTTP/1.1 200'):
+                            answered += 1
+                    except OSError:
+                        pass
+            finally:
+                for sock in idle:
+                    sock.close()
+                stop_server(proc)
+
+        if before is None or after is None:
+            print('{0:<10} {1:>7} {2:>9} {3:>9} {4:>9} {5:>10} {6:>8}'.format(
+                mode, len(idle), 'n/a', 'n/a', 'n/a', fresh,
+                '{0}/{1}'.format(answered, len(sample))))
+            continue
+        print('{0:<10} {1:>7} {2:>9.1f} {3:>9.1f} {4:>9.2f} {5:>10} '
+              '{6:>8}'.format(mode, len(idle), after / 1024,
+                              (after - before) / 1024,
+                              (after - before) / max(len(idle), 1), fresh,
+                              '{0}/{1}'.format(answered, len(sample))))
+
+
+def bench_cache(args):
+    """hot-file throughput of handle_request with and without the cache"""
+    request = http_parser.Request('GET', '/sample.txt', 'HTTP/1.1', {})
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as base:
+        make_webroot(base, size=args.size)
+        os.chdir(base)
+        try:
+            print('{0:<10} {1:>12}'.format('cache', 'req/s'))
+            for cache in (None, http_server.ContentCache()):
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    http_server.handle_request(request, cache)
+                elapsed = time.perf_counter() - start
+                print('{0:<10} {1:>12.1f}'.format(
+                    'off' if cache is None else 'on', args.requests / elapsed
+                ))
+            print(cache.stats())
+        finally:
+            os.chdir(cwd)
+
+
+def bench_listing(args):
+    """directory listing latency, rebuilt every time vs ListingCache"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as base:
+        webroot = make_webroot(base)
+        big = webroot / 'big'
+        big.mkdir()
+        for i in range(args.entries):
+            (big / 'entry-{0:06d}.txt'.format(i)).touch()
+        os.chdir(base)
+        try:
+            path = pathlib.Path('./webroot') / 'big'
+            cache = http_server.ListingCache()
+            middle = args.entries // 2
+            page = '/big?offset={0}&limit=100'.format(middle)
+            runs = [
+                ('uncached', lambda: http_server.ListingCache.render(path)[0]),
+                ('cached full', lambda: cache.listing(path)),
+                ('cached page', lambda: cache.listing(path, middle, 100)),
+                ('request page', lambda: http_server.handle_request(
+                    http_parser.Request('GET', page, 'HTTP/1.1', {}))),
+            ]
+            print('{0:<14} {1:>10} {2:>10}'.format('listing', 'ms', 'bytes'))
+            for name, run in runs:
+                size = len(run())
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    run()
+                elapsed = time.perf_counter() - start
+                print('{0:<14} {1:>10.3f} {2:>10}'.format(
+                    name, elapsed / args.requests * 1000, size))
+        finally:
+            os.chdir(cwd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    load = commands.add_parser('load', help='concurrent load per mode')
+    load.add_argument('modes', nargs='*', metavar='mode',
+                      help='one of: ' + ', '.join(sorted(MODES)))
+    load.add_argument('--clients', type=int, default=50)
+    load.add_argument('--requests', type=int, default=20)
+    load.set_defaults(func=bench_load)
+
+    scale = commands.add_parser('scale', help='pre-fork req/s by workers')
+    scale.add_argument('--workers', type=int, nargs='+',
+                       default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    scale.add_argument('--reuseport', action='store_true',
+                       help='also run every worker count with SO_REUSEPORT')
+    scale.add_argument('--clients', type=int, default=50)
+    scale.add_argument('--requests', type=int, default=20)
+    scale.add_argument('--size', type=int, default=16384)
+    scale.set_defaults(func=bench_scale)
+
+    idle = commands.add_parser('idle', help='many idle connections per mode')
+    idle.add_argument('modes', nargs='*', metavar='mode',
+                      help='one of: ' + ', '.join(sorted(MODES)))
+    idle.add_argument('--connections', type=int, default=10000)
+    idle.add_argument('--sample', type=int, default=100,
+                      help='idle connections to send a request on')
+    idle.set_defaults(func=bench_idle)
+
+    cache = commands.add_parser('cache', help='hot file, cache on vs off')
+    cache.add_argument('--requests', type=int, default=20000)
+    cache.add_argument('--size', type=int, default=16384)
+    cache.set_defaults(func=bench_cache)
+
+    listing = commands.add_parser('listing',
+                                  help='huge directory, listing cache')
+    listing.add_argument('--entries', type=int, default=50000)
+    listing.add_argument('--requests', type=int, default=50)
+    listing.set_defaults(func=bench_listing)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
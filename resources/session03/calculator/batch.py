@@ -0,0 +1,245 @@
+"""many calculations in one request
+
+POST a body of expressions to /batch, one per line as text/plain or as a
+JSON array of strings as application/json, and the results come back in
+the same order and format while the rest are still being worked out:
+
+    $ curl --data-binary $'1+2\n(3-1)^8\n1/0' localhost:8080/batch
+    3
+    256
+    error: division by zero
+
+Expressions are evaluated a block at a time.  Most of a typical batch is
+plain `a op b` arithmetic, for which tokenizing and parsing cost far more
+than the arithmetic; those are picked out with one regular expression and
+computed directly, a whole block at once with NumPy when it is installed.
+Everything else goes through the cached evaluator in expression.py, and
+any simple calculation NumPy would get wrong, such as one overflowing or
+dividing by zero, is handed to it too so the results and errors are
+always the same as calculating one at a time.
+"""
+import json
+import math
+import operator
+import re
+
+from expression import ExpressionError
+from expression import MAX_LENGTH
+from expression import calculate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+BLOCK_SIZE = 1024
+MAX_BODY_SIZE = 16 * 1024 * 1024
+# blocks shorter than this are not worth an array
+NUMPY_THRESHOLD = 64
+
+_SIMPLE = re.compile(r'\s*(\d+(?:\.\d*)?)\s*([-+*/])\s*(\d+(?:\.\d*)?)\s*\Z')
+# the same, for each line of a block; [^\S\n] is whitespace but newlines
+_SIMPLE_LINE = re.compile(
+    r'^[^\S\n]*(\d+(?:\.\d*)?)[^\S\n]*([-+*/])[^\S\n]*(\d+(?:\.\d*)?)'
+    r'[^\S\n]*$', re.MULTILINE
+)
+_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+# integers below this multiply without overflowing 64 bits
+_MAX_INT = 10 ** 9
+
+
+class BatchError(ValueError):
+    """raised for a request body that is not a batch of expressions"""
+
+
+def parse_batch(body, content_type=''):
+    """returns the expressions in a request body, and whether it was JSON
+    """
+    try:
+        text = body.decode('utf8')
+    except UnicodeDecodeError:
+        raise BatchError('the body is not UTF-8')
+    if content_type.partition(';')[0].strip() == 'application/json':
+        try:
+            expressions = json.loads(text)
+        except ValueError:
+            raise BatchError('the body is not valid JSON')
+        if not isinstance(expressions, list) or not all(
+                isinstance(item, str) for item in expressions):
+            raise BatchError('the body must be a JSON array of strings')
+        return expressions, True
+    return [line for line in text.splitlines() if line.strip()], False
+
+
+def _number(text):
+    return float(text) if '.' in text else int(text)
+
+
+def _outcome(text):
+    """(result, None) or (None, error message) for one expression"""
+    try:
+        return calculate(text), None
+    except (ExpressionError, ArithmeticError) as e:
+        return None, str(e)
+
+
+def _finite(value):
+    return not isinstance(value, float) or math.isfinite(value)
+
+
+def _simple(text, match):
+    """the outcome of a simple calculation, computed directly"""
+    a, op, b = match.groups()
+    try:
+        a, b = _number(a), _number(b)
+        result = _OPERATORS[op](a, b)
+    except (ValueError, ZeroDivisionError, OverflowError):
+        # an int too long to read is one of these too
+        # let the evaluator raise the error it would for this
+        return _outcome(text)
+    # an operand too large for a float reads as infinity
+    if isinstance(result, float) and not (
+            math.isfinite(result) and _finite(a) and _finite(b)):
+        return _outcome(text)
+    return result, None
+
+
+def _vectorized(texts):
+    """the outcomes of a block of texts that are all simple calculations,
+    or None if they are not
+    """
+    joined = '\n'.join(texts)
+    found = _SIMPLE_LINE.findall(joined)
+    # a newline inside an expression would throw the lines out of step
+    if len(found) != len(texts) or joined.count('\n') != len(texts) - 1:
+        return None
+    xs, ops, ys = zip(*found)
+    a = numpy.array(list(map(float, xs)))
+    b = numpy.array(list(map(float, ys)))
+    ops = numpy.array(ops)
+    if '.' in joined:
+        integral = numpy.array(['.' not in x and '.' not in y
+                                for x, y in zip(xs, ys)])
+    else:
+        integral = numpy.ones(len(texts), dtype=bool)
+    with numpy.errstate(all='ignore'):
+        results = numpy.select(
+            [ops == '+', ops == '-', ops == '*'], [a + b, a - b, a * b],
+            a / b
+        )
+        ai, bi = a.astype(numpy.int64), b.astype(numpy.int64)
+        exact = numpy.select(
+            [ops == '+', ops == '-'], [ai + bi, ai - bi], ai * bi
+        )
+    exact_rows = integral & (ops != '/')
+    # integers this large would overflow 64 bits, or are beyond the
+    # precision of a float, and stay exact in Python; anything not finite
+    # is an error the evaluator words for us
+    python = (integral & ((a >= _MAX_INT) | (b >= _MAX_INT))) | ~(
+        numpy.isfinite(results) & numpy.isfinite(a) & numpy.isfinite(b) |
+        exact_rows)
+    if len(joined) > MAX_LENGTH:
+        # so is anything the evaluator would refuse as too long
+        python |= numpy.array([len(text) > MAX_LENGTH for text in texts])
+    outcomes = [
+        (integer if whole else result, None)
+        for whole, result, integer in zip(exact_rows.tolist(),
+                                          results.tolist(), exact.tolist())
+    ]
+    for i in numpy.flatnonzero(python).tolist():
+        outcomes[i] = _outcome(texts[i])
+    return outcomes
+
+
+def evaluate_block(texts):
+    """returns (result, None) or (None, error message) for each expression
+    """
+    if numpy is not None and len(texts) >= NUMPY_THRESHOLD:
+        outcomes = _vectorized(texts)
+        if outcomes is not None:
+            return outcomes
+    outcomes = []
+    for text in texts:
+        match = _SIMPLE.match(text)
+        if match is None or len(text) > MAX_LENGTH:
+            outcomes.append(_outcome(text))
+        else:
+            outcomes.append(_simple(text, match))
+    return outcomes
+
+
+def evaluate_batch(texts, block_size=BLOCK_SIZE):
+    """yields the outcomes of `texts` a block at a time"""
+    for start in range(0, len(texts), block_size):
+        block = texts[start:start + block_size]
+        yield block, evaluate_block(block)
+
+
+def _text_line(result, error):
+    if error is None:
+        try:
+            return str(result)
+        except ValueError as e:
+            # an int too long to write out
+            error = str(e)
+    return 'error: ' + error
+
+
+def _json_item(text, result, error):
+    if error is None:
+        try:
+            return json.dumps({'expression': text, 'result': result})
+        except ValueError as e:
+            error = str(e)
+    return json.dumps({'expression': text, 'error': error})
+
+
+def _text_chunks(texts):
+    for _, outcomes in evaluate_batch(texts):
+        lines = [_text_line(result, error) for result, error in outcomes]
+        yield ('\n'.join(lines) + '\n').encode('utf8')
+
+
+def _json_chunks(texts):
+    yield b'['
+    separator = ''
+    for block, outcomes in evaluate_batch(texts):
+        items = [_json_item(text, result, error)
+                 for text, (result, error) in zip(block, outcomes)]
+        yield (separator + ','.join(items)).encode('utf8')
+        separator = ','
+    yield b']'
+
+
+def application(environ, start_response):
+    """the WSGI application answering POST /batch"""
+    if environ.get('REQUEST_METHOD') != 'POST':
+        start_response('405 Method Not Allowed',
+                       [('Allow', 'POST'), ('Content-type', 'text/plain')])
+        return [b'POST a batch of expressions\n']
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = -1
+    if length < 0 or length > MAX_BODY_SIZE:
+        status = ('413 Payload Too Large' if length > MAX_BODY_SIZE
+                  else '400 Bad Request')
+        start_response(status, [('Content-type', 'text/plain')])
+        return [b'a batch needs a Content-Length of at most 16MB\n']
+    body = environ['wsgi.input'].read(length) if length else b''
+    try:
+        texts, is_json = parse_batch(body, environ.get('CONTENT_TYPE', ''))
+    except BatchError as e:
+        start_response('400 Bad Request', [('Content-type', 'text/plain')])
+        return ['{0}\n'.format(e).encode('utf8')]
+    if is_json:
+        start_response('200 OK', [('Content-type', 'application/json')])
+        return _json_chunks(texts)
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return _text_chunks(texts)
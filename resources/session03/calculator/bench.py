@@ -0,0 +1,246 @@
+"""benchmarks for the calculator application
+
+Each benchmark is a sub-command.  Run it from this directory:
+
+    $ python bench.py route --routes 10 100 1000
+    $ python bench.py evaluate --evaluations 100000
+    $ python bench.py batch --calculations 10000
+    $ python bench.py render --requests 100000
+"""
+import argparse
+import http.client
+import random
+import re
+import sys
+import threading
+import time
+import wsgiref.simple_server
+
+import batch
+import calculator
+import expression
+from router import Router
+
+
+def linear_match(routes, path):
+    """dispatch as resolve_path used to, trying each route in turn"""
+    for regexp, func in routes:
+        match = re.match(regexp, path)
+        if match is not None:
+            return func, match.groups()
+    return None
+
+
+def _time(func, path, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(path)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_route(args):
+    """dispatch time per route count, for the first, last and no route"""
+    print('{0:>7} {1:<8} {2:>12} {3:>12}'.format(
+        'routes', 'path', 'linear us', 'router us'))
+    for count in args.routes:
+        routes = [(r'^route{0}/(\d+)$'.format(i), i) for i in range(count)]
+        router = Router(routes)
+        start = time.perf_counter()
+        router.compile()
+        compiled = (time.perf_counter() - start) * 1000
+        paths = [
+            ('first', 'route0/42'),
+            ('last', 'route{0}/42'.format(count - 1)),
+            ('miss', 'nowhere/42'),
+        ]
+        for name, path in paths:
+            assert linear_match(routes, path) == router.match(path)
+            print('{0:>7} {1:<8} {2:>12.2f} {3:>12.2f}'.format(
+                count, name,
+                _time(lambda p: linear_match(routes, p), path, args.repeat),
+                _time(router.match, path, args.repeat)))
+        print('{0:>7} compiled in {1:.1f} ms'.format(count, compiled))
+
+
+def make_expressions(count, seed=0):
+    """`count` different expressions of a few operators each"""
+    rng = random.Random(seed)
+    expressions = []
+    for i in range(count):
+        expressions.append('({0} + {1}.5) * {2} - {3} / 7 ^ 2'.format(
+            i, rng.randint(0, 999), rng.randint(1, 99), rng.randint(1, 999)))
+    return expressions
+
+
+def uncached(text):
+    return expression.evaluate(expression.parse(text))
+
+
+def bench_evaluate(args):
+    """evaluations/sec for one repeated and for all different expressions
+    """
+    unique = make_expressions(args.evaluations)
+    repeated = [unique[0]] * args.evaluations
+    print('{0:<10} {1:<10} {2:>12}'.format('workload', 'cache', 'evals/s'))
+    for workload, texts in (('repeated', repeated), ('unique', unique)):
+        for name, calculate in (('off', uncached),
+                                ('on', expression.calculate)):
+            expression.cache_clear()
+            start = time.perf_counter()
+            for text in texts:
+                calculate(text)
+            elapsed = time.perf_counter() - start
+            print('{0:<10} {1:<10} {2:>12.0f}'.format(
+                workload, name, len(texts) / elapsed))
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    """serve the calculator from a thread; returns the server"""
+    server = wsgiref.simple_server.make_server(
+        '127.0.0.1', 0, calculator.application, handler_class=QuietHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def post_batch(address, body):
+    conn = http.client.HTTPConnection(*address)
+    conn.request('POST', '/batch', body,
+                 {'Content-Type': 'text/plain'})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return data
+
+
+def bench_batch(args):
+    """time per calculation, one request each vs one batch request"""
+    rng = random.Random(0)
+    texts = ['{0}{1}{2}'.format(rng.randint(0, 9999), rng.choice('+-*/'),
+                                rng.randint(1, 9999))
+             for _ in range(args.calculations)]
+    body = '\n'.join(texts).encode('utf8')
+    server = start_server()
+    address = server.server_address
+    print('{0:<22} {1:>14}'.format('how', 'us/calculation'))
+    try:
+        count = min(args.calculations, args.requests)
+        start = time.perf_counter()
+        for text in texts[:count]:
+            conn = http.client.HTTPConnection(*address)
+            conn.request('GET', '/' + text.replace('/', '%2F'))
+            conn.getresponse().read()
+            conn.close()
+        elapsed = time.perf_counter() - start
+        print('{0:<22} {1:>14.2f}'.format('request each',
+                                          elapsed / count * 1e6))
+
+        numpy = batch.numpy
+        runs = [('batch, python', None)]
+        if numpy is not None:
+            runs.append(('batch, numpy', numpy))
+        for name, module in runs:
+            batch.numpy = module
+            expression.cache_clear()
+            start = time.perf_counter()
+            lines = post_batch(address, body).count(b'\n')
+            elapsed = time.perf_counter() - start
+            assert lines == len(texts)
+            print('{0:<22} {1:>14.2f}'.format(
+                name, elapsed / len(texts) * 1e6))
+        batch.numpy = numpy
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def concatenated_doc(status, body, start_response):
+    """render as application used to, building and measuring one str"""
+    html = calculator.header() + body + calculator.footer()
+    start_response(status, [('Content-type', 'text/html'),
+                            ('Content-length', str(len(html)))])
+    return [html.encode('utf8')]
+
+
+def chunked_doc(status, body, start_response):
+    """render as application does now, around the encoded page"""
+    chunks = calculator.html_doc(body)
+    length = sum(map(len, chunks))
+    start_response(status, [('Content-type', 'text/html'),
+                            ('Content-length', str(length))])
+    return chunks
+
+
+def bench_render(args):
+    """us/request to render a page, and to run the whole application"""
+    def start_response(status, headers):
+        pass
+
+    write = len  # a stand-in for a socket write that keeps nothing
+    pages = [
+        ('form', calculator.calculator()),
+        ('result', calculator.calculate('6*7')),
+        ('64KB', '<p>{0}</p>'.format('x' * 65536)),
+    ]
+    print('{0:<10} {1:>14} {2:>14}'.format('page', 'concat us', 'chunks us'))
+    for name, body in pages:
+        timings = []
+        for render in (concatenated_doc, chunked_doc):
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                # as a server would, writing each chunk
+                for chunk in render('200 OK', body, start_response):
+                    write(chunk)
+            timings.append((time.perf_counter() - start)
+                           / args.requests * 1e6)
+        print('{0:<10} {1:>14.2f} {2:>14.2f}'.format(name, *timings))
+
+    environ = {'PATH_INFO': '/6*7', 'QUERY_STRING': ''}
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        for chunk in calculator.application(environ, start_response):
+            write(chunk)
+    elapsed = time.perf_counter() - start
+    print('application {0:.2f} us/request'.format(
+        elapsed / args.requests * 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    route = commands.add_parser('route', help='dispatch time by route count')
+    route.add_argument('--routes', type=int, nargs='+',
+                       default=[10, 100, 1000])
+    route.add_argument('--repeat', type=int, default=2000)
+    route.set_defaults(func=bench_route)
+
+    evaluate = commands.add_parser('evaluate',
+                                   help='evaluations/sec, cache on vs off')
+    evaluate.add_argument('--evaluations', type=int, default=100000)
+    evaluate.set_defaults(func=bench_evaluate)
+
+    batch_ = commands.add_parser('batch',
+                                 help='one request per calculation vs batch')
+    batch_.add_argument('--calculations', type=int, default=100000)
+    batch_.add_argument('--requests', type=int, default=1000,
+                        help='calculations to time one request at a time')
+    batch_.set_defaults(func=bench_batch)
+
+    render = commands.add_parser('render', help='page rendering cost')
+    render.add_argument('--requests', type=int, default=100000)
+    render.set_defaults(func=bench_render)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
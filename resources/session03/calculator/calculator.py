@@ -1,7 +1,10 @@
-import re
-import operator
 from urllib.parse import parse_qsl
 
+import batch
+from expression import ExpressionError
+from expression import calculate as expression_value
+from router import Router
+
 
 def header():
     header = """<html>
@@ -32,38 +35,56 @@ def calculator():
     return calculator
 
 
-def calculate(num1, op_str, num2):
-    ops = {'+': operator.add,
-           '-': operator.sub,
-           '*': operator.mul,
-           '/': operator.truediv}
-    result = ops[op_str](int(num1), int(num2))
-    calculation = """<p>{} {} {} equals {}</p></br></br>
+def calculate(expression):
+    result = expression_value(expression)
+    calculation = """<p>{} equals {}</p></br></br>
     <a href='/'>Make another calculation.</a>"""
-    return calculation.format(num1, op_str, num2, result)
+    return calculation.format(expression, result)
+
+
+# the page around every body never changes, so it is encoded just once
+HEADER = header().encode('utf8')
+FOOTER = footer().encode('utf8')
+# pages longer than this are sent as they are, in chunks, not copied into
+# one
+JOIN_SIZE = 16 * 1024
 
 
 def html_doc(doc_body):
-    doc_header = header()
-    doc_footer = footer()
-    return doc_header + doc_body + doc_footer
+    """the page around `doc_body`, as a list of byte chunks"""
+    body = doc_body.encode('utf8')
+    if len(HEADER) + len(body) + len(FOOTER) <= JOIN_SIZE:
+        # servers write each chunk separately, so a small page is cheaper
+        # sent as one
+        return [HEADER + body + FOOTER]
+    return [HEADER, body, FOOTER]
+
+
+def stream_doc(doc_chunks):
+    """the page around an iterable of str chunks, yielding each chunk as
+    bytes as soon as it is made
+    """
+    yield HEADER
+    for chunk in doc_chunks:
+        yield chunk.encode('utf8')
+    yield FOOTER
+
+
+ROUTER = Router([(r'^$', calculator),
+                 (r'^([\d.eE+\-*/^()]+)$', calculate)])
 
 
 def resolve_path(path):
-    urls = [(r'^$', calculator),
-            (r'^([\d]+)(\+|\-|\*|\/)([\d]+)$', calculate)]
-    matchpath = path.lstrip('/')
-    for regexp, func in urls:
-        match = re.match(regexp, matchpath)
-        if match is None:
-            continue
-        args = match.groups([])
-        return func, args
-    # we get here if no url matches
-    raise NameError
+    route = ROUTER.match(path.lstrip('/'))
+    if route is None:
+        # no url matches
+        raise NameError
+    return route
 
 
 def application(environ, start_response):
+    if environ.get('PATH_INFO') == '/batch':
+        return batch.application(environ, start_response)
     headers = [("Content-type", "text/html")]
     try:
         request = environ.get('PATH_INFO', None)
@@ -78,8 +99,12 @@ def application(environ, start_response):
         status = "200 OK"
     except NameError:
         status = "400 Bad Request"
-        body = """<h1>Please re-enter your calculation using only digits and the following operands: +, -, *, /. Thanks!</h1>
+        body = """<h1>Please re-enter your calculation using only digits, parentheses and the following operands: +, -, *, /, ^. Thanks!</h1>
         <a href='/'>Try another calculation.</a>"""
+    except ExpressionError as e:
+        status = "400 Bad Request"
+        body = """<h1>That calculation can't be done: {}.</h1>
+        <a href='/'>Try another calculation.</a>""".format(e)
     except ZeroDivisionError:
         status = "400 Bad Request"
         body = """<h1>You can't divide by zero!</h1>
@@ -89,10 +114,16 @@ def application(environ, start_response):
         body = """<h1>Something bad has happened, but it's not your fault. Sorry.</h1>
         <a href='/'>Give us another chance.</a>"""
     finally:
-        html = html_doc(body)
-        headers.append(('Content-length', str(len(html))))
+        if isinstance(body, str):
+            chunks = html_doc(body)
+            length = sum(map(len, chunks))
+            headers.append(('Content-length', str(length)))
+        else:
+            # a page function may return an iterable of chunks for a large
+            # body, which is sent without a length as it is made
+            chunks = stream_doc(body)
         start_response(status, headers)
-        return [html.encode('utf8')]
+        return chunks
 
 
 if __name__ == '__main__':
@@ -0,0 +1,239 @@
+"""a safe arithmetic expression evaluator for the calculator
+
+Expressions are made of integers and decimal numbers, the binary operators
++ - * / and ^ (or **) for exponentiation, unary minus and plus, and
+parentheses.  They are tokenized, parsed by precedence climbing into a
+small tree of tuples, and the tree is evaluated; nothing is ever handed to
+`eval`.  Exponentiation binds tightest and to the right, so -2^2 is -4 and
+2^3^2 is 512, as in ordinary notation.
+
+Since a few characters can describe an enormous number, the length and
+nesting of expressions and the size of powers and of integer results are
+limited, and anything beyond the limits raises `ExpressionError`.
+
+Results are kept in LRU caches keyed on the normalized text of the
+expression, so '1 + 2' and '1+2' share an entry, and on the text as given,
+so a repeated calculation costs one dictionary lookup.
+"""
+import functools
+import math
+import operator
+import re
+
+
+MAX_LENGTH = 1000
+MAX_DEPTH = 100
+# the largest integer result of any operation, in bits, and the largest
+# absolute exponent of a float power; well inside the 4300 digits Python
+# will turn an int into text
+MAX_POWER_BITS = 10000
+CACHE_SIZE = 4096
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<op>\*\*|[-+*/^()])
+    )""", re.VERBOSE)
+
+# binary operator -> (precedence, right associative)
+_BINARY = {
+    '+': (1, False),
+    '-': (1, False),
+    '*': (2, False),
+    '/': (2, False),
+    '^': (4, True),
+}
+# unary minus and plus bind less tightly than ^
+_UNARY_PRECEDENCE = 3
+
+
+class ExpressionError(ValueError):
+    """raised for an expression that is malformed or too costly"""
+
+
+def tokenize(text):
+    """returns the tokens of `text`: numbers as int or float, operators
+    and parentheses as strings, with ** spelled ^
+    """
+    return _scan(text)[0]
+
+
+def normalize(text):
+    """the canonical text of an expression, which cache entries use:
+    its tokens as written, one space apart
+    """
+    return _scan(text)[1]
+
+
+def _scan(text):
+    """the tokens of `text` and its normalized text"""
+    if len(text) > MAX_LENGTH:
+        raise ExpressionError('expression longer than {0} characters'
+                              .format(MAX_LENGTH))
+    tokens = []
+    # the tokens as written, for the normalized text; str() of a float
+    # is slow
+    spelled = []
+    position = 0
+    end = len(text.rstrip())
+    while position < end:
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise ExpressionError('unexpected {0!r} at position {1}'.format(
+                text[position:].lstrip()[:1], position))
+        number, op = match.group('number', 'op')
+        if number is not None:
+            if number.isdigit():
+                tokens.append(int(number))
+            else:
+                value = float(number)
+                if math.isinf(value):
+                    raise ExpressionError('number too large')
+                tokens.append(value)
+            spelled.append(number)
+        else:
+            op = '^' if op == '**' else op
+            tokens.append(op)
+            spelled.append(op)
+        position = match.end()
+    return tokens, ' '.join(spelled)
+
+
+class _Parser():
+    """precedence climbing over a list of tokens"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError('empty expression')
+        tree = self.expression(0, 0)
+        if self.position != len(self.tokens):
+            raise ExpressionError('unexpected {0!r}'.format(self.peek()))
+        return tree
+
+    def expression(self, min_precedence, depth):
+        if depth > MAX_DEPTH:
+            raise ExpressionError('expression nested too deeply')
+        left = self.operand(depth)
+        while True:
+            op = self.peek()
+            if not isinstance(op, str) or op not in _BINARY:
+                return left
+            precedence, right_associative = _BINARY[op]
+            if precedence < min_precedence:
+                return left
+            self.take()
+            next_precedence = (precedence if right_associative
+                               else precedence + 1)
+            right = self.expression(next_precedence, depth + 1)
+            left = (op, left, right)
+
+    def operand(self, depth):
+        token = self.take()
+        if token is None:
+            raise ExpressionError('expression ends too soon')
+        if not isinstance(token, str):
+            return token
+        if token == '(':
+            tree = self.expression(0, depth + 1)
+            if self.take() != ')':
+                raise ExpressionError('unbalanced parenthesis')
+            return tree
+        if token in '+-':
+            operand = self.expression(_UNARY_PRECEDENCE, depth + 1)
+            return operand if token == '+' else ('neg', operand)
+        raise ExpressionError('unexpected {0!r}'.format(token))
+
+
+def parse(text):
+    """returns the tree of `text`: a number, ('neg', tree) or
+    (operator, left tree, right tree)
+    """
+    return _Parser(tokenize(text)).parse()
+
+
+def power(base, exponent):
+    """base ^ exponent, refusing results too large to be worth computing
+    """
+    if isinstance(base, int) and isinstance(exponent, int):
+        if exponent < 0:
+            if base == 0:
+                raise ZeroDivisionError('0 cannot be raised to a negative '
+                                        'power')
+            return power(float(base), exponent)
+        if abs(base) > 1 and exponent * base.bit_length() > MAX_POWER_BITS:
+            raise ExpressionError('power too large')
+        return base ** exponent
+    if abs(exponent) > MAX_POWER_BITS:
+        raise ExpressionError('power too large')
+    try:
+        result = base ** exponent
+    except OverflowError:
+        raise ExpressionError('power too large')
+    if isinstance(result, complex):
+        raise ExpressionError('power of a negative number is not real')
+    return result
+
+
+_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '^': power,
+}
+
+
+def evaluate(tree):
+    """the value of a tree from `parse`"""
+    if not isinstance(tree, tuple):
+        return tree
+    if tree[0] == 'neg':
+        return -evaluate(tree[1])
+    op, left, right = tree
+    try:
+        result = _OPERATORS[op](evaluate(left), evaluate(right))
+    except OverflowError:
+        raise ExpressionError('result too large')
+    if isinstance(result, float) and not math.isfinite(result):
+        raise ExpressionError('result too large')
+    if isinstance(result, int) and result.bit_length() > MAX_POWER_BITS:
+        # products of powers that are each allowed can still be enormous
+        raise ExpressionError('result too large')
+    return result
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _result(normalized, tokens):
+    # the tokens come along so that a miss need not tokenize again; they
+    # are equal whenever the normalized texts are
+    return evaluate(_Parser(tokens).parse())
+
+
+# keyed on the text as given, so a repeated calculation is not even
+# tokenized; functools' caches cost so little to keep that a unique
+# expression is calculated as fast as without them
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def calculate(text):
+    """evaluate the expression `text`, using the caches"""
+    tokens, normalized = _scan(text)
+    return _result(normalized, tuple(tokens))
+
+
+def cache_clear():
+    """empty the caches"""
+    calculate.cache_clear()
+    _result.cache_clear()
@@ -0,0 +1,154 @@
+"""a URL router that finds the route for a path in one pass
+
+Trying each route's regular expression in turn costs time in proportion to
+the number of routes.  A `Router` instead files every route under the
+literal text its pattern starts with, in a trie, and joins the patterns
+filed at each node into one alternation compiled once.  Dispatching walks
+the trie along the path and runs only the expressions of the nodes it
+passes, so the routes that cannot match because their literal prefix
+differs are never looked at, however many there are.
+
+Routes are matched as `re.match` matches them, and the first route added
+wins when more than one matches.  Patterns must not use global inline
+flags, group names or numbered backreferences, since they are combined
+into one expression.
+"""
+import re
+
+
+# characters that end the literal prefix of a pattern
+_SPECIAL = set('.^$*+?{}[]|()')
+# characters that make the character before them optional or repeated
+_QUANTIFIERS = set('*+?{')
+
+
+def _has_alternation(pattern):
+    """True if `pattern` has a `|` that is not escaped"""
+    i = 0
+    while i < len(pattern):
+        if pattern[i] == '\\':
+            i += 2
+            continue
+        if pattern[i] == '|':
+            return True
+        i += 1
+    return False
+
+
+def literal_prefix(pattern):
+    """the text every path the pattern matches starts with"""
+    if _has_alternation(pattern):
+        # an alternation may start anywhere in the pattern
+        return ''
+    chars = []
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                # a class such as \d, or an anchor such as \Z
+                break
+            char, step = pattern[i + 1], 2
+        elif char in _SPECIAL:
+            break
+        else:
+            step = 1
+        if pattern[i + step:i + step + 1] in _QUANTIFIERS:
+            break
+        chars.append(char)
+        i += step
+    return ''.join(chars)
+
+
+class _Node():
+    __slots__ = ('children', 'routes', 'regex', 'table')
+
+    def __init__(self):
+        self.children = {}
+        # (order, pattern, func) of the routes filed here
+        self.routes = []
+        self.regex = None
+        # group number of each route's wrapping group -> (order, func,
+        # number of groups in the route's own pattern)
+        self.table = {}
+
+    def compile(self):
+        alternatives = []
+        group = 1
+        for order, pattern, func in self.routes:
+            groups = re.compile(pattern).groups
+            self.table[group] = (order, func, groups)
+            alternatives.append('(' + pattern + ')')
+            group += groups + 1
+        self.regex = re.compile('|'.join(alternatives))
+
+
+class Router():
+    """maps paths to (func, args) by regular expression"""
+
+    def __init__(self, routes=()):
+        self._routes = []
+        self._root = None
+        for pattern, func in routes:
+            self.add(pattern, func)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def add(self, pattern, func):
+        """route paths matching `pattern` to `func`, called with the
+        pattern's groups
+        """
+        compiled = re.compile(pattern)
+        if compiled.flags & ~re.UNICODE:
+            raise ValueError('route {0!r} sets global flags, which would '
+                             'apply to every route'.format(pattern))
+        if compiled.groupindex:
+            raise ValueError('route {0!r} names a group'.format(pattern))
+        self._routes.append((pattern, func))
+        self._root = None
+
+    def compile(self):
+        """build the trie; done by the first `match` after routes change"""
+        root = _Node()
+        for order, (pattern, func) in enumerate(self._routes):
+            node = root
+            for char in literal_prefix(pattern):
+                node = node.children.setdefault(char, _Node())
+            node.routes.append((order, pattern, func))
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            if node.routes:
+                node.compile()
+            nodes.extend(node.children.values())
+        self._root = root
+
+    def match(self, path):
+        """returns (func, args) for the first route matching `path`, or
+        None
+        """
+        if self._root is None:
+            self.compile()
+        node = self._root
+        found = None
+        depth = 0
+        while True:
+            if node.regex is not None:
+                m = node.regex.match(path)
+                if m is not None:
+                    group = m.lastindex
+                    order, func, groups = node.table[group]
+                    if found is None or order < found[0]:
+                        # the route's own groups follow its wrapping group
+                        found = (order, func,
+                                 m.groups()[group:group + groups])
+            if depth == len(path):
+                break
+            node = node.children.get(path[depth])
+            if node is None:
+                break
+            depth += 1
+        if found is None:
+            return None
+        return found[1], found[2]
@@ -0,0 +1,458 @@
+import unittest
+
+
+class LiteralPrefixTestCase(unittest.TestCase):
+    """tests for the literal_prefix function"""
+
+    def call_function_under_test(self, pattern):
+        from router import literal_prefix
+        return literal_prefix(pattern)
+
+    def test_plain_text(self):
+        self.assertEqual(self.call_function_under_test('^books/$'), 'books/')
+
+    def test_stops_at_group(self):
+        actual = self.call_function_under_test(r'^book/(id[\d]+)$')
+        self.assertEqual(actual, 'book/')
+
+    def test_escaped_characters_are_literal(self):
+        self.assertEqual(self.call_function_under_test(r'^a\.b\/c\d'),
+                         'a.b/c')
+
+    def test_quantified_character_excluded(self):
+        self.assertEqual(self.call_function_under_test('^colou?r'), 'colo')
+        self.assertEqual(self.call_function_under_test(r'^ab\.*'), 'ab')
+
+    def test_alternation_has_no_prefix(self):
+        self.assertEqual(self.call_function_under_test('^ab|cd'), '')
+        self.assertEqual(self.call_function_under_test(r'^a(\+|\-)'), '')
+        # an escaped backslash does not escape the | after it
+        self.assertEqual(self.call_function_under_test(r'a\\|b'), '')
+        self.assertEqual(self.call_function_under_test(r'^a\|b'), 'a|b')
+
+
+class RouterTestCase(unittest.TestCase):
+    """tests for the Router"""
+
+    def makeOne(self, routes):
+        from router import Router
+        return Router(routes)
+
+    def test_groups_of_the_matching_route(self):
+        router = self.makeOne([
+            (r'^a/(\d+)$', 'first'),
+            (r'^a/(x)(y)$', 'second'),
+            (r'^b/(\w+)/(\w+)$', 'third'),
+        ])
+        self.assertEqual(router.match('a/12'), ('first', ('12',)))
+        self.assertEqual(router.match('a/xy'), ('second', ('x', 'y')))
+        self.assertEqual(router.match('b/c/d'), ('third', ('c', 'd')))
+
+    def test_no_match(self):
+        router = self.makeOne([(r'^a/(\d+)$', 'first')])
+        self.assertIsNone(router.match('a/b'))
+        self.assertIsNone(router.match(''))
+
+    def test_first_added_route_wins(self):
+        router = self.makeOne([
+            (r'^(.*)$', 'anything'),
+            (r'^books/(\d+)$', 'book'),
+        ])
+        self.assertEqual(router.match('books/1'), ('anything', ('books/1',)))
+        router = self.makeOne([
+            (r'^books/(\d+)$', 'book'),
+            (r'^(.*)$', 'anything'),
+        ])
+        self.assertEqual(router.match('books/1'), ('book', ('1',)))
+        self.assertEqual(router.match('books/x'), ('anything', ('books/x',)))
+
+    def test_unmatched_optional_group(self):
+        router = self.makeOne([(r'^a(b)?$', 'first')])
+        self.assertEqual(router.match('a'), ('first', (None,)))
+
+    def test_added_route_used(self):
+        router = self.makeOne([(r'^a$', 'first')])
+        self.assertIsNone(router.match('b'))
+        router.add(r'^b$', 'second')
+        self.assertEqual(router.match('b'), ('second', ()))
+        self.assertEqual(len(router), 2)
+
+    def test_alternation_after_escaped_backslash(self):
+        import re
+        pattern = r'a\\|b'
+        router = self.makeOne([(pattern, 'first')])
+        for path in ('b', 'a\\', 'a|b'):
+            expected = re.match(pattern, path)
+            self.assertEqual(router.match(path) is not None,
+                             expected is not None, path)
+
+    def test_unsupported_patterns_refused(self):
+        router = self.makeOne([])
+        self.assertRaises(ValueError, router.add, r'(?i)^a$', 'flags')
+        self.assertRaises(ValueError, router.add, r'^(?P<x>a)$', 'named')
+        self.assertEqual(len(router), 0)
+
+    def test_many_routes(self):
+        routes = [(r'^route{0}/(\d+)$'.format(i), i) for i in range(1000)]
+        router = self.makeOne(routes)
+        for i in (0, 1, 10, 100, 999):
+            path = 'route{0}/{1}'.format(i, i * 2)
+            self.assertEqual(router.match(path), (i, (str(i * 2),)))
+        self.assertIsNone(router.match('route1000/1'))
+
+
+class ResolvePathTestCase(unittest.TestCase):
+    """tests for the calculator's resolve_path function"""
+
+    def call_function_under_test(self, path):
+        from calculator import resolve_path
+        return resolve_path(path)
+
+    def test_root_returns_calculator(self):
+        from calculator import calculator
+        self.assertEqual(self.call_function_under_test('/'),
+                         (calculator, ()))
+
+    def test_calculation_returns_calculate(self):
+        from calculator import calculate
+        self.assertEqual(self.call_function_under_test('/(12*3)^2'),
+                         (calculate, ('(12*3)^2',)))
+
+    def test_bad_path_raises_name_error(self):
+        with self.assertRaises(NameError):
+            self.call_function_under_test('/12%3')
+
+
+class ExpressionTestCase(unittest.TestCase):
+    """tests for the expression evaluator"""
+
+    def setUp(self):
+        from expression import cache_clear
+        cache_clear()
+
+    def call_function_under_test(self, text):
+        from expression import calculate
+        return calculate(text)
+
+    def assertResults(self, cases):
+        for text, expected in cases:
+            actual = self.call_function_under_test(text)
+            self.assertEqual(actual, expected, text)
+            self.assertIs(type(actual), type(expected), text)
+
+    def test_precedence_and_associativity(self):
+        self.assertResults([
+            ('1+2*3', 7),
+            ('(1+2)*3', 9),
+            ('10-4-3', 3),
+            ('64/4/2', 8.0),
+            ('2^3^2', 512),
+            ('2**10', 1024),
+            ('2*3^2', 18),
+        ])
+
+    def test_unary_operators(self):
+        self.assertResults([
+            ('-2^2', -4),
+            ('(-2)^2', 4),
+            ('2*-3+1', -5),
+            ('--3', 3),
+            ('+4', 4),
+            ('2^-1', 0.5),
+        ])
+
+    def test_numbers(self):
+        self.assertResults([
+            ('7/2', 3.5),
+            ('.5+1.', 1.5),
+            ('1.5e3/3', 500.0),
+            (' 1 +  2 ', 3),
+        ])
+
+    def test_malformed(self):
+        from expression import ExpressionError
+        for text in ('', '1 2', '(1', '1)', '1+', '*2', '3 & 4', '()',
+                     'import os'):
+            with self.assertRaises(ExpressionError, msg=text):
+                self.call_function_under_test(text)
+
+    def test_limits(self):
+        from expression import ExpressionError, MAX_DEPTH, MAX_LENGTH
+        for text in ('9^9^9', '2^99999', '2.0^99999', '1e308*10', '1e999',
+                     '(-8)^(1/3)', '(' * (MAX_DEPTH + 1) + '1' +
+                     ')' * (MAX_DEPTH + 1), '1+' * MAX_LENGTH + '1',
+                     '(2^4999)*(2^4999)*(2^4999)', '(3^4000)^2'):
+            with self.assertRaises(ExpressionError, msg=text[:20]):
+                self.call_function_under_test(text)
+        self.assertEqual(self.call_function_under_test('2^1000'), 2 ** 1000)
+
+    def test_division_by_zero(self):
+        for text in ('1/0', '0^-1'):
+            with self.assertRaises(ZeroDivisionError):
+                self.call_function_under_test(text)
+
+    def test_normalized_text_shares_cache_entry(self):
+        from expression import _result, calculate, normalize
+        self.assertEqual(normalize('1+2'), normalize(' 1 + 2'))
+        self.assertEqual(normalize('2**3'), normalize('2 ^ 3'))
+        self.assertNotEqual(normalize('1 2'), normalize('12'))
+        self.call_function_under_test('1+2')
+        self.call_function_under_test(' 1 + 2')
+        self.call_function_under_test('1+2')
+        info = _result.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+        info = calculate.cache_info()
+        self.assertEqual((info.hits, info.currsize), (1, 2))
+
+    def test_float_spelling_keeps_its_type(self):
+        self.assertResults([('1', 1), ('1.0', 1.0), ('1.', 1.0), ('1', 1)])
+
+    def test_parse_tree(self):
+        from expression import parse
+        self.assertEqual(parse('-1+2*3'), ('+', ('neg', 1), ('*', 2, 3)))
+
+
+class ApplicationTestCase(unittest.TestCase):
+    """tests for the calculator WSGI application"""
+
+    def call_function_under_test(self, path, query=''):
+        from calculator import application
+        responses = []
+
+        def start_response(status, headers):
+            responses.append((status, headers))
+
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query}
+        body = b''.join(application(environ, start_response))
+        return responses[0][0], body.decode('utf8')
+
+    def test_form(self):
+        status, body = self.call_function_under_test('/')
+        self.assertEqual(status, '200 OK')
+        self.assertIn('<form>', body)
+
+    def test_calculation_in_query_string(self):
+        status, body = self.call_function_under_test(
+            '/', 'calculation=%282%2B3%29+*+4')
+        self.assertEqual(status, '200 OK')
+        self.assertIn('(2+3)*4 equals 20', body)
+
+    def test_too_costly_calculation(self):
+        status, body = self.call_function_under_test('/9^9^9')
+        self.assertEqual(status, '400 Bad Request')
+        self.assertIn('power too large', body)
+
+    def test_too_large_product(self):
+        status, body = self.call_function_under_test(
+            '/(2^4999)*(2^4999)*(2^4999)')
+        self.assertEqual(status, '400 Bad Request')
+        self.assertIn('result too large', body)
+
+    def test_division_by_zero(self):
+        status, body = self.call_function_under_test('/1/0')
+        self.assertEqual(status, '400 Bad Request')
+        self.assertIn('divide by zero', body)
+
+    def test_content_length_counts_bytes(self):
+        from calculator import application, html_doc
+        doc = b''.join(html_doc('\u03c0 is not a number'))
+        self.assertIn('\u03c0'.encode('utf8'), doc)
+        responses = []
+        chunks = application(
+            {'PATH_INFO': '/6*7', 'QUERY_STRING': ''},
+            lambda status, headers: responses.append(dict(headers)))
+        self.assertEqual(int(responses[0]['Content-length']),
+                         len(b''.join(chunks)))
+
+    def test_large_page_not_copied(self):
+        from calculator import HEADER, JOIN_SIZE, html_doc
+        chunks = html_doc('x' * JOIN_SIZE)
+        self.assertEqual(len(chunks), 3)
+        self.assertIs(chunks[0], HEADER)
+        chunks = html_doc('x')
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith(HEADER))
+
+    def test_streamed_body(self):
+        import calculator
+        from router import Router
+
+        def count(n):
+            return ('<p>{0}</p>'.format(i) for i in range(int(n)))
+
+        responses = []
+        router, calculator.ROUTER = calculator.ROUTER, Router([
+            (r'^count/(\d+)$', count)])
+        try:
+            chunks = calculator.application(
+                {'PATH_INFO': '/count/3', 'QUERY_STRING': ''},
+                lambda status, headers: responses.append(dict(headers)))
+        finally:
+            calculator.ROUTER = router
+        self.assertNotIn('Content-length', responses[0])
+        self.assertEqual(list(chunks), [
+            calculator.HEADER, b'<p>0</p>', b'<p>1</p>', b'<p>2</p>',
+            calculator.FOOTER,
+        ])
+
+
+class BatchTestCase(unittest.TestCase):
+    """tests for POST /batch"""
+
+    def call_function_under_test(self, body, content_type='text/plain',
+                                 method='POST'):
+        import io
+        from calculator import application
+        responses = []
+
+        def start_response(status, headers):
+            responses.append((status, dict(headers)))
+
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': '/batch',
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        chunks = application(environ, start_response)
+        status, headers = responses[0]
+        return status, headers, chunks
+
+    def test_text_batch(self):
+        body = b'1+2\n\n(3-1)^8\n1/0\n7 / 2\nnonsense\n'
+        status, headers, chunks = self.call_function_under_test(body)
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(b''.join(chunks).decode('utf8').splitlines(), [
+            '3', '256', 'error: division by zero', '3.5',
+            "error: unexpected 'n' at position 0",
+        ])
+
+    def test_json_batch(self):
+        import json
+        body = json.dumps(['2*21', '2^', '10/4']).encode('utf8')
+        status, headers, chunks = self.call_function_under_test(
+            body, 'application/json; charset=utf-8')
+        self.assertEqual(headers['Content-type'], 'application/json')
+        self.assertEqual(json.loads(b''.join(chunks)), [
+            {'expression': '2*21', 'result': 42},
+            {'expression': '2^', 'error': 'expression ends too soon'},
+            {'expression': '10/4', 'result': 2.5},
+        ])
+
+    def test_oversized_result_is_one_error(self):
+        import json
+        body = b'1+2\n(2^4999)*(2^4999)*(2^4999)\n3*3\n'
+        status, headers, chunks = self.call_function_under_test(body)
+        self.assertEqual(b''.join(chunks).decode('utf8').splitlines(), [
+            '3', 'error: result too large', '9',
+        ])
+        status, headers, chunks = self.call_function_under_test(
+            json.dumps(['1+2', '(2^4999)*(2^4999)*(2^4999)']).encode(),
+            'application/json')
+        self.assertEqual(json.loads(b''.join(chunks))[1]['error'],
+                         'result too large')
+
+    def test_unprintable_result_is_an_error(self):
+        import json
+        from batch import _json_item, _text_line
+        self.assertEqual(_text_line(7, None), '7')
+        self.assertTrue(_text_line(10 ** 5000, None).startswith('error: '))
+        self.assertIn('error', json.loads(_json_item('x', 10 ** 5000, None)))
+
+    def test_long_operands_are_errors(self):
+        body = ('9' * 5000 + '+1\n1+2\n').encode('utf8')
+        status, headers, chunks = self.call_function_under_test(body)
+        self.assertEqual(b''.join(chunks).decode('utf8').splitlines(), [
+            'error: expression longer than 1000 characters', '3',
+        ])
+
+    def test_long_simple_calculations_refused(self):
+        import batch
+        from batch import NUMPY_THRESHOLD, evaluate_block
+        long = '9' * 600 + '*' + '9' * 600
+        texts = [long] + ['1+2'] * NUMPY_THRESHOLD
+        expected = (None, 'expression longer than 1000 characters')
+        numpy = batch.numpy
+        try:
+            for module in {None, numpy}:
+                batch.numpy = module
+                outcomes = evaluate_block(texts)
+                self.assertEqual(outcomes[0], expected)
+                self.assertEqual(outcomes[1], (3, None))
+        finally:
+            batch.numpy = numpy
+
+    def test_results_streamed_a_block_at_a_time(self):
+        from batch import BLOCK_SIZE
+        body = '\n'.join(['6*7'] * (BLOCK_SIZE * 3)).encode('utf8')
+        status, headers, chunks = self.call_function_under_test(body)
+        self.assertNotIn('Content-length', headers)
+        first = next(iter(chunks))
+        self.assertEqual(first.count(b'\n'), BLOCK_SIZE)
+        self.assertEqual(b''.join(chunks).count(b'42\n'), BLOCK_SIZE * 2)
+
+    def test_bad_requests(self):
+        status, _, _ = self.call_function_under_test(b'1+1', method='GET')
+        self.assertEqual(status, '405 Method Not Allowed')
+        status, _, _ = self.call_function_under_test(b'{', 'application/json')
+        self.assertEqual(status, '400 Bad Request')
+        status, _, _ = self.call_function_under_test(b'[1, 2]',
+                                                     'application/json')
+        self.assertEqual(status, '400 Bad Request')
+        status, _, _ = self.call_function_under_test(b'\xff')
+        self.assertEqual(status, '400 Bad Request')
+
+    def test_oversized_batch_refused(self):
+        from batch import MAX_BODY_SIZE
+        import io
+        from calculator import application
+        responses = []
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/batch',
+            'CONTENT_LENGTH': str(MAX_BODY_SIZE + 1),
+            'wsgi.input': io.BytesIO(),
+        }
+        application(environ, lambda status, headers: responses.append(status))
+        self.assertEqual(responses, ['413 Payload Too Large'])
+
+    def batch_matches_one_at_a_time(self):
+        import random
+        from batch import evaluate_batch
+        from expression import ExpressionError, calculate
+        rng = random.Random(0)
+        numbers = ['0', '0.0', '7', '12.5', '999999999', '1000000000',
+                   '123456789012345678901', '1' * 320, '1' * 320 + '.0']
+        texts = ['{0} {1} {2}'.format(rng.choice(numbers), rng.choice('+-*/'),
+                                      rng.choice(numbers))
+                 for _ in range(2000)]
+        for batch in (texts, texts[:500] + ['(1+2)^2', '1\n+2']):
+            outcomes = [outcome for _, block in evaluate_batch(batch, 256)
+                        for outcome in block]
+            for text, (result, error) in zip(batch, outcomes):
+                try:
+                    expected = calculate(text)
+                except (ExpressionError, ZeroDivisionError) as e:
+                    self.assertEqual((result, error), (None, str(e)), text)
+                else:
+                    self.assertEqual(result, expected, text)
+                    self.assertIs(type(result), type(expected), text)
+
+    def test_python_batch_matches_one_at_a_time(self):
+        import batch
+        numpy, batch.numpy = batch.numpy, None
+        try:
+            self.batch_matches_one_at_a_time()
+        finally:
+            batch.numpy = numpy
+
+    def test_numpy_batch_matches_one_at_a_time(self):
+        import batch
+        if batch.numpy is None:
+            self.skipTest('NumPy is not installed')
+        self.batch_matches_one_at_a_time()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+"""an incremental HTTP/1.x request parser
+
+Bytes are fed in as they arrive from a socket and complete requests are
+taken out as soon as they are available, so a request split across TCP
+segments and several requests in one segment (pipelining) are handled the
+same way.  Received bytes live in one bytearray that is consumed from the
+front through an offset and compacted only once half of it is spent, and
+the search for the end of the headers resumes where the previous one
+stopped, so the work done stays linear in the number of bytes received.
+"""
+import re
+
+
+# limits protecting the server from oversized requests
+MAX_HEADER_SIZE = 65536
+MAX_BODY_SIZE = 1024 * 1024
+MAX_CHUNK_LINE = 1024
+
+# the head is decoded as latin-1, which maps every byte to one character,
+# and validated a whole line or block at a time by these expressions
+_TOKEN = r"[!#$%&'*+\-.^_`|~0-9A-Za-z]+"
+_REQUEST_LINE = re.compile(
+    r"(" + _TOKEN + r") ([^\x00-\x20\x7f]+) (HTTP/(\d)\.\d)\Z"
+)
+_HEADER_BLOCK = re.compile(r"(?:" + _TOKEN + r":[^\r\n]*\r\n)*\Z")
+_HEADER_LINE = re.compile(
+    r"(" + _TOKEN + r"):[ \t]*((?:[^\r\n]*[^\r\n \t])?)[ \t]*\r\n"
+)
+_HEX = re.compile(rb"[0-9A-Fa-f]+\Z")
+_DIGITS = re.compile(r"[0-9]+\Z")
+
+
+class ParseError(ValueError):
+    """raised for a request that cannot be parsed
+
+    `status` is the status line the server should answer with before it
+    closes the connection.
+    """
+
+    def __init__(self, message, status='400 Bad Request'):
+        super().__init__(message)
+        self.status = status
+
+
+def persistent(version, connection):
+    """True if a connection stays open after a request
+
+    HTTP/1.1 connections are persistent unless the client asks to close,
+    HTTP/1.0 ones only if the client asks for keep-alive.
+    """
+    tokens = [token.strip().lower() for token in connection.split(',')]
+    if version == 'HTTP/1.1':
+        return 'close' not in tokens
+    return 'keep-alive' in tokens
+
+
+class Request():
+    """a parsed request; header names are lower-cased"""
+
+    def __init__(self, method, target, version, headers, body=b''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def __repr__(self):
+        return '<Request {0} {1} {2}>'.format(
+            self.method, self.target, self.version
+        )
+
+    def keep_alive(self):
+        """True if the connection should stay open after this request"""
+        return persistent(self.version, self.headers.get('connection', ''))
+
+
+class RequestParser():
+    """turns a stream of bytes into a sequence of `Request` objects
+
+    Call `feed` with each chunk received and then `next_request` until it
+    returns None, which means more data is needed.  Malformed or oversized
+    input raises `ParseError`; the stream cannot be trusted after that.
+    """
+
+    def __init__(self, max_header_size=MAX_HEADER_SIZE,
+                 max_body_size=MAX_BODY_SIZE):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.buffer = bytearray()
+        # offset of the first byte not yet consumed
+        self._start = 0
+        # offset before which the end of the headers is known to be absent
+        self._scanned = 0
+        # the request whose body is being read, and how it is framed
+        self._request = None
+        self._remaining = 0
+        self._chunk_state = None
+        self._body = None
+
+    def __len__(self):
+        """the number of bytes received but not yet consumed"""
+        return len(self.buffer) - self._start
+
+    def feed(self, data):
+        """add bytes received from the connection"""
+        if self._start and self._start * 2 >= len(self.buffer):
+            del self.buffer[:self._start]
+            self._scanned = max(self._scanned - self._start, 0)
+            self._start = 0
+        self.buffer += data
+
+    def next_request(self):
+        """returns the next complete request, or None if more data is needed
+        """
+        if self._request is None and not self._read_head():
+            return None
+        if self._chunk_state is not None:
+            done = self._read_chunked()
+        else:
+            done = self._read_body()
+        if not done:
+            return None
+        request, self._request = self._request, None
+        return request
+
+    def _read_head(self):
+        # a client may send empty lines before a request, notably after
+        # the body of the previous one
+        while self.buffer.startswith(b'\r\n', self._start):
+            self._start += 2
+        begin = max(self._scanned, self._start)
+        end = self.buffer.find(b'\r\n\r\n', begin)
+        if end == -1:
+            if len(self) > self.max_header_size:
+                raise ParseError('request headers too large',
+                                 '431 Request Header Fields Too Large')
+            # the terminator may straddle the data still to come
+            self._scanned = max(len(self.buffer) - 3, self._start)
+            return False
+        if end - self._start > self.max_header_size:
+            raise ParseError('request headers too large',
+                             '431 Request Header Fields Too Large')
+        head = bytes(self.buffer[self._start:end])
+        self._start = self._scanned = end + 4
+        self._request = self._parse_head(head)
+        return True
+
+    def _parse_head(self, head):
+        request_line, _, fields = head.decode('latin-1').partition('\r\n')
+        match = _REQUEST_LINE.match(request_line)
+        if match is None:
+            raise ParseError('malformed request line')
+        method, target, version, major = match.groups()
+        if major != '1':
+            raise ParseError('unsupported HTTP version',
+                             '505 HTTP Version Not Supported')
+        if not target.isascii():
+            try:
+                target = target.encode('latin-1').decode('utf8')
+            except UnicodeDecodeError:
+                raise ParseError('request target is not UTF-8')
+
+        headers = {}
+        if fields:
+            fields += '\r\n'
+            # also rejects obsolete line folding, as a line cannot start
+            # with whitespace
+            if _HEADER_BLOCK.match(fields) is None:
+                raise ParseError('malformed header line')
+            for name, value in _HEADER_LINE.findall(fields):
+                name = name.lower()
+                if name in headers:
+                    headers[name] += ', ' + value
+                else:
+                    headers[name] = value
+
+        request = Request(method, target, version, headers)
+        self._frame_body(headers)
+        return request
+
+    def _frame_body(self, headers):
+        """work out how the body of a request is delimited"""
+        self._remaining = 0
+        self._chunk_state = None
+        if 'transfer-encoding' in headers:
+            if 'content-length' in headers:
+                # ambiguous framing is how requests get smuggled
+                raise ParseError('both Transfer-Encoding and Content-Length')
+            codings = [coding.strip().lower()
+                       for coding in headers['transfer-encoding'].split(',')]
+            if codings != ['chunked']:
+                raise ParseError('unsupported transfer coding',
+                                 '501 Not Implemented')
+            self._chunk_state = 'size'
+            self._body = bytearray()
+        elif 'content-length' in headers:
+            values = {v.strip() for v in headers['content-length'].split(',')}
+            if len(values) != 1:
+                raise ParseError('conflicting Content-Length headers')
+            value = values.pop()
+            if not _DIGITS.match(value):
+                raise ParseError('malformed Content-Length')
+            self._remaining = int(value)
+            if self._remaining > self.max_body_size:
+                raise ParseError('request body too large',
+                                 '413 Payload Too Large')
+
+    def _read_body(self):
+        if len(self) < self._remaining:
+            return False
+        end = self._start + self._remaining
+        self._request.body = bytes(self.buffer[self._start:end])
+        self._start = self._scanned = end
+        return True
+
+    def _read_chunked(self):
+        while True:
+            if self._chunk_state == 'size':
+                end = self.buffer.find(b'\r\n', self._start)
+                if end == -1:
+                    if len(self) > MAX_CHUNK_LINE:
+                        raise ParseError('chunk size line too long')
+                    return False
+                line = bytes(self.buffer[self._start:end])
+                size = line.split(b';', 1)[0].strip(b' \t')
+                if not _HEX.match(size):
+                    raise ParseError('malformed chunk size')
+                self._remaining = int(size, 16)
+                if len(self._body) + self._remaining > self.max_body_size:
+                    raise ParseError('request body too large',
+                                     '413 Payload Too Large')
+                self._start = end + 2
+                self._chunk_state = 'data' if self._remaining else 'trailer'
+            elif self._chunk_state == 'data':
+                if len(self) < self._remaining + 2:
+                    return False
+                end = self._start + self._remaining
+                if self.buffer[end:end + 2] != b'\r\n':
+                    raise ParseError('chunk data not followed by CRLF')
+                self._body += self.buffer[self._start:end]
+                self._start = end + 2
+                self._chunk_state = 'size'
+            else:
+                # trailer fields are read past and ignored
+                if self.buffer.startswith(b'\r\n', self._start):
+                    end = self._start
+                else:
+                    end = self.buffer.find(b'\r\n\r\n', self._start)
+                    if end == -1:
+                        if len(self) > self.max_header_size:
+                            raise ParseError(
+                                'trailer fields too large',
+                                '431 Request Header Fields Too Large')
+                        return False
+                    end += 2
+                self._start = self._scanned = end + 2
+                self._request.body = bytes(self._body)
+                self._body = None
+                self._chunk_state = None
+                return True
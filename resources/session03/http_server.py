@@ -1,7 +1,21 @@
+import array
+import asyncio
+import collections
 import mimetypes
+import os
 import pathlib
+import select
+import selectors
+import signal
 import socket
+import stat
 import sys
+import threading
+import time
+import types
+import urllib.parse
+
+from http_parser import ParseError, RequestParser
 
 
 def response_ok(body=b"this is a pretty minimal response", mimetype=b"text/plain"):
@@ -30,6 +44,14 @@ def response_not_found():
     return "\r\n".join(resp).encode('utf8')
 
 
+def response_error(status):
+    """returns a response for `status`, e.g. '400 Bad Request', as bytes"""
+    resp = []
+    resp.append("HTTP/1.1 {0}".format(status))
+    resp.append("")
+    return "\r\n".join(resp).encode('utf8')
+
+
 def parse_request(request):
     first_line = request.split("\r\n", 1)[0]
     method, uri, protocol = first_line.split()
@@ -38,21 +60,140 @@ def parse_request(request):
     return uri
 
 
+# directory listings are served a page at a time; this is the largest page
+LISTING_PAGE_SIZE = 1000
+
+
+def parse_target(uri):
+    """split a request target into its path and listing page
+
+    Returns (path, offset, limit) from a target such as
+    '/images?offset=20&limit=10'.  The limit defaults to, and is capped
+    at, LISTING_PAGE_SIZE.  Raises ValueError for a malformed page.
+    """
+    path, _, query = uri.partition('?')
+    params = urllib.parse.parse_qs(query)
+    offset = int(params.get('offset', ['0'])[-1])
+    limit = int(params.get('limit', [str(LISTING_PAGE_SIZE)])[-1])
+    if offset < 0 or limit < 0:
+        raise ValueError('offset and limit must not be negative')
+    return path, offset, min(limit, LISTING_PAGE_SIZE)
+
+
+class ListingCache():
+    """a bounded, least-recently-used cache of rendered directory listings
+
+    A directory is listed and rendered to bytes once and kept with the
+    mtime it had at the time.  Creating, removing or renaming an entry
+    updates that mtime, so a stat per request is enough to notice a
+    change without watching the filesystem.  Entries are sorted, which
+    keeps pages taken with an offset and limit stable, and the offset of
+    every line is kept so a page is a single slice of the rendered bytes.
+    The cache may be shared between threads.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """returns the cache counters as a dict"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def listing(self, path, offset=0, limit=None):
+        """returns `limit` lines of the listing of directory `path` as bytes
+        """
+        key = str(path)
+        validator = os.stat(key).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == validator:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry is None:
+            entry = (validator,) + self.render(path)
+            self._store(key, entry)
+
+        _, body, starts = entry
+        count = len(starts) - 1
+        first = min(offset, count)
+        last = count if limit is None else min(first + limit, count)
+        if first == 0 and last == count:
+            return body
+        if first == last:
+            return b""
+        # leave out the newline that ends the page's last line
+        return body[starts[first]:starts[last] - 1]
+
+    @staticmethod
+    def render(path):
+        """list `path`, returning the listing and where each line starts"""
+        item_template = '* {}'
+        listing = []
+        for item_path in sorted(path.iterdir()):
+            listing.append(item_template.format(str(item_path)).encode('utf8'))
+        # one past the end, as if the last line had a newline too
+        starts = array.array('Q', [0])
+        for line in listing:
+            starts.append(starts[-1] + len(line) + 1)
+        return b"\n".join(listing), starts
+
+    @staticmethod
+    def _cost(entry):
+        _, body, starts = entry
+        return len(body) + starts.itemsize * len(starts)
+
+    def _store(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= self._cost(old)
+            if self._cost(entry) > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.size += self._cost(entry)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self._cost(evicted)
+                self.evictions += 1
+
+
+LISTING_CACHE = ListingCache()
+
+
 def resolve_uri(uri):
     """This method should return appropriate content and a mime type
 
     Both content and mime type should be expressed as bytes
     """
     root_path = pathlib.Path('./webroot')
-    resource_path = root_path / uri.lstrip('/')
+    path = uri.partition('?')[0]
+    resource_path = root_path / path.lstrip('/')
     if resource_path.is_dir():
-        # the resource is a directory, content type is text/html, produce a
-        # listing of the directory contents
-        item_template = '* {}'
-        listing = []
-        for item_path in resource_path.iterdir():
-            listing.append(item_template.format(str(item_path)))
-        content = "\n".join(listing).encode('utf8')
+        # the resource is a directory, content type is text/plain, produce a
+        # page of the (cached) listing of the directory contents; only a
+        # listing has pages, so only here is the query string read
+        _, offset, limit = parse_target(uri)
+        content = LISTING_CACHE.listing(resource_path, offset, limit)
         mime_type = 'text/plain'.encode('utf8')
     elif resource_path.is_file():
         # the resource is a file, figure out its mime type and read
@@ -63,9 +204,137 @@ def resolve_uri(uri):
     return content, mime_type
 
 
+class ContentCache():
+    """a bounded, least-recently-used cache of file responses
+
+    Complete 200 OK responses (headers and body) are kept keyed on the
+    webroot path they were built from, together with the size and mtime
+    the file had at the time.  Every lookup stats the file and rebuilds the
+    entry if either has changed, so edits on disk are picked up on the next
+    request.  Once the cached responses exceed `max_bytes` the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """returns the cache counters as a dict"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def response(self, uri):
+        """returns the cached 200 OK response for `uri`
+
+        Returns None if `uri` is not a regular file, leaving directories and
+        missing resources to `resolve_uri`.
+        """
+        path = uri.partition('?')[0]
+        key = str(pathlib.Path('./webroot') / path.lstrip('/'))
+        try:
+            st = os.stat(key)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        validator = (st.st_size, st.st_mtime_ns)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == validator:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
 
-def server(log_buffer=sys.stderr):
-    address = ('127.0.0.1', 10000)
+        self.misses += 1
+        response = response_ok(*resolve_uri(uri))
+        self._store(key, validator, response)
+        return response
+
+    def _store(self, key, validator, response):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1])
+        if len(response) > self.max_bytes:
+            return
+        self._entries[key] = (validator, response)
+        self.size += len(response)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+
+def handle_request(request, cache=None):
+    """build the response bytes for a parsed request
+
+    With a `ContentCache`, file responses are served from it.
+    """
+    if request.method != "GET":
+        return response_method_not_allowed()
+    uri = request.target
+    try:
+        if cache is not None:
+            response = cache.response(uri)
+            if response is not None:
+                return response
+        content, mime_type = resolve_uri(uri)
+    except NameError:
+        return response_not_found()
+    except ValueError:
+        return response_error('400 Bad Request')
+    return response_ok(content, mime_type)
+
+
+def read_request(conn):
+    """read from `conn` until one complete request has arrived
+
+    Returns None if the client closes the connection first.
+    """
+    parser = RequestParser()
+    while True:
+        data = conn.recv(4096)
+        if not data:
+            return None
+        parser.feed(data)
+        request = parser.next_request()
+        if request is not None:
+            return request
+
+
+def serve_connection(conn, addr, log_buffer=sys.stderr, cache=None):
+    """read one request from `conn`, answer it and close the connection"""
+    try:
+        print('connection - {0}:{1}'.format(*addr), file=log_buffer)
+        try:
+            request = read_request(conn)
+        except ParseError as e:
+            response = response_error(e.status)
+        else:
+            if request is None:
+                return
+            response = handle_request(request, cache)
+
+        print('sending response', file=log_buffer)
+        conn.sendall(response)
+    finally:
+        conn.close()
+
+
+def server(log_buffer=sys.stderr, address=('127.0.0.1', 10000), cache=None):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     print("making a server on {0}:{1}".format(*address), file=log_buffer)
@@ -76,37 +345,511 @@ def server(log_buffer=sys.stderr):
         while True:
             print('waiting for a connection', file=log_buffer)
             conn, addr = sock.accept()  # blocking
+            serve_connection(conn, addr, log_buffer, cache)
+
+    except KeyboardInterrupt:
+        sock.close()
+        return
+
+
+# how long a worker told to stop may spend on the connection in hand before
+# it is killed, and the shortest life a worker may have before its exit
+# counts as a crash whose replacement is held back
+GRACEFUL_TIMEOUT = 10
+MIN_WORKER_LIFETIME = 1
+MAX_RESPAWN_DELAY = 30
+
+
+def _listening_socket(address, backlog, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+def _signal_pipe(signums, handler):
+    """route `signums` to `handler` and wake up readers of the returned fd
+
+    Python runs signal handlers between bytecodes of the main thread, so a
+    loop blocked in select() learns about a signal through the byte
+    written to the pipe by `signal.set_wakeup_fd`.  Returns the pipe's
+    read and write fds, and what `_restore_signals` needs to put the
+    previous wakeup fd and handlers back.
+    """
+    rfd, wfd = os.pipe()
+    os.set_blocking(rfd, False)
+    os.set_blocking(wfd, False)
+    previous_fd = signal.set_wakeup_fd(wfd)
+    handlers = {}
+    for signum in signums:
+        handlers[signum] = signal.signal(signum, handler)
+    return rfd, wfd, (previous_fd, handlers)
+
+
+def _restore_signals(previous):
+    previous_fd, handlers = previous
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+    signal.set_wakeup_fd(previous_fd)
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _worker(sock, address, backlog, log_buffer, cache):
+    """the accept loop run by every pre-forked worker process
+
+    SIGTERM asks the worker to stop: the connection in hand is finished
+    and the worker exits instead of accepting another one.  It also exits
+    once the master is gone.
+    """
+    stopping = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    rfd, _, _ = _signal_pipe([signal.SIGTERM],
+                             lambda *args: stopping.append(1))
+    if sock is None:
+        sock = _listening_socket(address, backlog, reuse_port=True)
+    # every worker waits on the same socket, so a connection another
+    # worker took first leaves accept() with nothing to return
+    sock.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+    sel.register(rfd, selectors.EVENT_READ)
+    master = os.getppid()
+    print('worker {0} started'.format(os.getpid()), file=log_buffer)
+    while not stopping:
+        # a worker whose master died is adopted by another process; it
+        # leaves rather than serve on unsupervised
+        if os.getppid() != master:
+            break
+        for key, mask in sel.select(timeout=1.0):
+            if key.fileobj == rfd:
+                _drain(rfd)
+                continue
             try:
-                print('connection - {0}:{1}'.format(*addr), file=log_buffer)
-                request = ''
-                while True:
-                    data = conn.recv(1024)
-                    request += data.decode('utf8')
-                    if len(data) < 1024:
-                        break
+                conn, addr = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                continue
+            conn.setblocking(True)
+            try:
+                serve_connection(conn, addr, log_buffer, cache)
+            except OSError as e:
+                print('connection failed: {0}'.format(e), file=log_buffer)
+    print('worker {0} stopped'.format(os.getpid()), file=log_buffer)
 
-                try:
-                    uri = parse_request(request)
-                except NotImplementedError:
-                    response = response_method_not_allowed()
-                else:
-                    try:
-                        content, mime_type = resolve_uri(uri)
-                    except NameError:
-                        response = response_not_found()
+
+def _spawn_worker(sock, address, backlog, log_buffer, cache, close_fds):
+    """fork a worker process and return its pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        for fd in close_fds:
+            os.close(fd)
+        _worker(sock, address, backlog, log_buffer, cache)
+        status = 0
+    finally:
+        try:
+            log_buffer.flush()
+        finally:
+            # never fall back into the master's code
+            os._exit(status)
+
+
+def prefork_server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+                   workers=None, reuse_port=False, backlog=1024, cache=None):
+    """serve from `workers` forked processes, each running an accept loop
+
+    By default the master binds the listening socket and the workers
+    inherit it, so the kernel hands each new connection to one of the
+    workers waiting in accept().  With `reuse_port` every worker binds a
+    socket of its own with SO_REUSEPORT (Linux, BSD) and the kernel
+    spreads connections across them instead; connections still queued on a
+    worker's socket when it exits are reset.  Every worker gets its own
+    copy of `cache`.
+
+    The master supervises the workers.  A worker that exits is replaced;
+    one that exits within MIN_WORKER_LIFETIME of starting is replaced only
+    after a delay that doubles with every such crash.  SIGHUP is a
+    graceful restart: a new set of workers is started and the old ones are
+    sent SIGTERM, finishing the request in hand before they exit.  SIGINT
+    or SIGTERM stops the workers the same way and returns; workers still
+    busy after GRACEFUL_TIMEOUT seconds are killed.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError('SO_REUSEPORT is not supported on this platform')
+    print("making a pre-fork server on {0}:{1} with {2} workers".format(
+        address[0], address[1], workers), file=log_buffer)
+    sock = None
+    if not reuse_port:
+        sock = _listening_socket(address, backlog)
+
+    received = []
+    rfd, wfd, previous = _signal_pipe(
+        [signal.SIGCHLD, signal.SIGHUP, signal.SIGINT, signal.SIGTERM],
+        lambda signum, frame: received.append(signum)
+    )
+    # pid -> time the worker was started
+    current = {}
+    retiring = {}
+    crashes = 0
+    respawn_at = 0.0
+
+    def spawn(count):
+        for _ in range(count):
+            pid = _spawn_worker(sock, address, backlog, log_buffer, cache,
+                                (rfd, wfd))
+            current[pid] = time.monotonic()
+
+    def retire():
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        for pid in current:
+            _signal_worker(pid, signal.SIGTERM)
+            retiring[pid] = deadline
+        current.clear()
+
+    try:
+        spawn(workers)
+        stopping = False
+        while current or retiring:
+            timeout = 1.0
+            if len(current) < workers and not stopping:
+                timeout = max(respawn_at - time.monotonic(), 0)
+            select.select([rfd], [], [], timeout)
+            _drain(rfd)
+            signums, received[:] = set(received), []
+
+            if not stopping and signums & {signal.SIGINT, signal.SIGTERM}:
+                print('stopping workers', file=log_buffer)
+                stopping = True
+                retire()
+            elif not stopping and signal.SIGHUP in signums:
+                print('restarting workers', file=log_buffer)
+                retire()
+                crashes = 0
+                spawn(workers)
+
+            now = time.monotonic()
+            for pid, status in _reap(list(current) + list(retiring)):
+                if pid in retiring:
+                    del retiring[pid]
+                elif pid in current:
+                    started = current.pop(pid)
+                    print('worker {0} exited with status {1}'.format(
+                        pid, status), file=log_buffer)
+                    if now - started < MIN_WORKER_LIFETIME:
+                        crashes += 1
+                        delay = min(2 ** crashes, MAX_RESPAWN_DELAY)
+                        respawn_at = max(respawn_at, now + delay)
                     else:
-                        response = response_ok(content, mime_type)
+                        crashes = 0
+            for pid, deadline in list(retiring.items()):
+                if now > deadline:
+                    _signal_worker(pid, signal.SIGKILL)
+                    retiring[pid] = now + GRACEFUL_TIMEOUT
+            if not stopping and len(current) < workers and now >= respawn_at:
+                spawn(workers - len(current))
+    finally:
+        remaining = list(current) + list(retiring)
+        for pid in remaining:
+            _signal_worker(pid, signal.SIGKILL)
+        _reap(remaining, block=True)
+        _restore_signals(previous)
+        os.close(rfd)
+        os.close(wfd)
+        if sock is not None:
+            sock.close()
+
+
+def _signal_worker(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
 
-                print('sending response', file=log_buffer)
-                conn.sendall(response)
-            finally:
-                conn.close()
+def _reap(pids, block=False):
+    """collect the workers in `pids` that have exited
 
+    Returns (pid, exit status) pairs; with `block`, waits for all of them.
+    """
+    reaped = []
+    for pid in pids:
+        try:
+            done, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            continue
+        if done:
+            reaped.append((pid, os.waitstatus_to_exitcode(status)))
+    return reaped
+
+
+def event_server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+                 backlog=1024, cache=None):
+    """serve many connections at once from a single selectors event loop
+
+    Every socket is non-blocking and registered with the platform's best
+    selector (epoll on Linux, kqueue on BSD/macOS).  A connection is read
+    until its `RequestParser` holds a complete request, answered with the
+    same `handle_request` used by `server` and then closed, so a slow
+    client only ever holds up itself.
+    """
+    sel = selectors.DefaultSelector()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    print("making an event server on {0}:{1}".format(*address),
+          file=log_buffer)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    sel.register(sock, selectors.EVENT_READ, data=None)
+
+    try:
+        while True:
+            for key, mask in sel.select():
+                if key.data is None:
+                    _accept_connection(sel, key.fileobj, log_buffer)
+                else:
+                    _service_connection(sel, key, mask, log_buffer, cache)
+    except KeyboardInterrupt:
+        return
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+
+
+def _accept_connection(sel, sock, log_buffer):
+    """accept every pending connection and register it for reading"""
+    while True:
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return
+        print('connection - {0}:{1}'.format(*addr), file=log_buffer)
+        conn.setblocking(False)
+        state = types.SimpleNamespace(addr=addr, parser=RequestParser(),
+                                      outb=b'')
+        sel.register(conn, selectors.EVENT_READ, data=state)
+
+
+def _close_connection(sel, conn):
+    sel.unregister(conn)
+    conn.close()
+
+
+def _service_connection(sel, key, mask, log_buffer, cache):
+    """read what is available from a connection, or write what fits"""
+    conn, state = key.fileobj, key.data
+    if mask & selectors.EVENT_READ:
+        try:
+            data = conn.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            _close_connection(sel, conn)
+            return
+        state.parser.feed(data)
+        try:
+            request = state.parser.next_request()
+        except ParseError as e:
+            state.outb = response_error(e.status)
+        else:
+            if request is None:
+                if not data:
+                    _close_connection(sel, conn)
+                return
+            state.outb = handle_request(request, cache)
+        print('sending response', file=log_buffer)
+        state.outb = memoryview(state.outb)
+        sel.modify(conn, selectors.EVENT_WRITE, data=state)
+    elif mask & selectors.EVENT_WRITE:
+        try:
+            sent = conn.send(state.outb)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            _close_connection(sel, conn)
+            return
+        state.outb = state.outb[sent:]
+        if not state.outb:
+            _close_connection(sel, conn)
+
+
+# how long async_server keeps an idle persistent connection open
+KEEPALIVE_TIMEOUT = 60
+
+
+def with_content_length(response):
+    """add a Content-Length header to a response built by this module
+
+    The blocking servers mark the end of a body by closing the connection;
+    a persistent connection needs the length instead.
+    """
+    head, sep, body = response.partition(b"\r\n\r\n")
+    if not sep:
+        head, body = response.rstrip(b"\r\n"), b""
+    length = "Content-Length: {0}".format(len(body)).encode('utf8')
+    return b"\r\n".join([head, length, b"", body])
+
+
+def open_resource(uri):
+    """open the webroot file for `uri`, returning it with its stat
+
+    Returns (None, stat) for a directory and (None, None) if there is no
+    such resource.  This is the filesystem work `async_server` does in a
+    thread.
+    """
+    path = pathlib.Path('./webroot') / uri.partition('?')[0].lstrip('/')
+    try:
+        st = path.stat()
+        if not stat.S_ISREG(st.st_mode):
+            return None, st
+        f = path.open('rb')
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None, None
+    return f, os.fstat(f.fileno())
+
+
+async def _send_response(writer, request):
+    """write the response to `request`, streaming files with sendfile"""
+    if request.method != "GET":
+        writer.write(with_content_length(response_method_not_allowed()))
+        return
+    f, st = await asyncio.to_thread(open_resource, request.target)
+    if f is None:
+        try:
+            content, mime_type = await asyncio.to_thread(
+                resolve_uri, request.target
+            )
+        except NameError:
+            response = response_not_found()
+        except ValueError:
+            response = response_error('400 Bad Request')
+        else:
+            response = response_ok(content, mime_type)
+        writer.write(with_content_length(response))
+        return
+    with f:
+        path = request.target.partition('?')[0]
+        mime_type = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+        head = [
+            "HTTP/1.1 200 OK",
+            "Content-Type: {0}".format(mime_type),
+            "Content-Length: {0}".format(st.st_size),
+            "",
+            "",
+        ]
+        writer.write("\r\n".join(head).encode('utf8'))
+        await writer.drain()
+        # falls back to reading the file in the loop where the transport
+        # cannot use os.sendfile, e.g. over TLS
+        await asyncio.get_running_loop().sendfile(
+            writer.transport, f, 0, st.st_size
+        )
+
+
+async def _serve_client(reader, writer, log_buffer, keepalive_timeout):
+    """answer requests on one connection until it closes or goes idle"""
+    addr = writer.get_extra_info('peername')
+    print('connection - {0}:{1}'.format(*addr[:2]), file=log_buffer)
+    loop = asyncio.get_running_loop()
+    parser = RequestParser()
+    try:
+        while True:
+            try:
+                request = parser.next_request()
+            except ParseError as e:
+                writer.write(with_content_length(response_error(e.status)))
+                await writer.drain()
+                return
+            if request is None:
+                # a timer handle is much lighter than the task wait_for()
+                # wraps every read in; closing the connection ends the read
+                timer = loop.call_later(keepalive_timeout, writer.close)
+                try:
+                    data = await reader.read(4096)
+                finally:
+                    timer.cancel()
+                if not data:
+                    return
+                parser.feed(data)
+                continue
+
+            print('sending response', file=log_buffer)
+            await _send_response(writer, request)
+            await writer.drain()
+            if not request.keep_alive():
+                return
+    except (ConnectionError, asyncio.CancelledError):
+        # the client went away, or the server is shutting down
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve_forever(log_buffer, address, backlog, keepalive_timeout):
+    srv = await asyncio.start_server(
+        lambda reader, writer: _serve_client(reader, writer, log_buffer,
+                                             keepalive_timeout),
+        *address, backlog=backlog, reuse_address=True
+    )
+    print("making an asyncio server on {0}:{1}".format(*address),
+          file=log_buffer)
+    async with srv:
+        await srv.serve_forever()
+
+
+def async_server(log_buffer=sys.stderr, address=('127.0.0.1', 10000),
+                 backlog=4096, keepalive_timeout=KEEPALIVE_TIMEOUT):
+    """serve from a single asyncio event loop with persistent connections
+
+    Unlike `server`, connections stay open between requests until the
+    client closes them or they sit idle for `keepalive_timeout` seconds,
+    so every response carries a Content-Length.  The stat and open of a
+    requested file run in a worker thread with `asyncio.to_thread`, as do
+    the directory listings `resolve_uri` builds, so a slow disk does not
+    stall the loop; file bodies go out with `loop.sendfile`.  An idle
+    connection costs a socket, a small parser and a suspended coroutine,
+    which is what lets a single process hold many thousands of them.
+    """
+    try:
+        asyncio.run(
+            _serve_forever(log_buffer, address, backlog, keepalive_timeout)
+        )
     except KeyboardInterrupt:
-        sock.close()
         return
 
 
 if __name__ == '__main__':
-    server()
+    args = sys.argv[1:]
+    cache = ContentCache() if '--cache' in args else None
+    if '--selectors' in args:
+        event_server(cache=cache)
+    elif '--asyncio' in args:
+        async_server()
+    elif '--prefork' in args:
+        workers = None
+        for arg in args:
+            if arg.startswith('--workers='):
+                workers = int(arg.split('=', 1)[1])
+        prefork_server(workers=workers, reuse_port='--reuseport' in args,
+                       cache=cache)
+    else:
+        server(cache=cache)
     sys.exit(0)
@@ -0,0 +1,450 @@
+import multiprocessing
+import os
+import pathlib
+import signal
+import socket
+import tempfile
+import time
+import unittest
+
+
+class WebrootTestCase(unittest.TestCase):
+    """shared functionality: run each test inside a throwaway webroot"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.base = tempfile.TemporaryDirectory()
+        os.chdir(self.base.name)
+        self.webroot = pathlib.Path('webroot')
+        self.webroot.mkdir()
+        (self.webroot / 'sample.txt').write_bytes(b'a sample file')
+        (self.webroot / 'images').mkdir()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.base.cleanup()
+
+
+class ContentCacheTestCase(WebrootTestCase):
+    """unit tests for the ContentCache class"""
+
+    def makeOne(self, max_bytes=1024 * 1024):
+        from http_server import ContentCache
+        return ContentCache(max_bytes=max_bytes)
+
+    def test_response_matches_uncached(self):
+        from http_server import resolve_uri, response_ok
+        cache = self.makeOne()
+        expected = response_ok(*resolve_uri('/sample.txt'))
+        self.assertEqual(expected, cache.response('/sample.txt'))
+        self.assertEqual(expected, cache.response('/sample.txt'))
+
+    def test_hits_and_misses_counted(self):
+        cache = self.makeOne()
+        for _ in range(3):
+            cache.response('/sample.txt')
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(2, cache.hits)
+
+    def test_directories_and_missing_not_cached(self):
+        cache = self.makeOne()
+        self.assertIsNone(cache.response('/images'))
+        self.assertIsNone(cache.response('/missing.html'))
+        self.assertIsNone(cache.response('/sample.txt/child'))
+        self.assertEqual(0, len(cache))
+
+    def test_changed_file_revalidated(self):
+        cache = self.makeOne()
+        path = self.webroot / 'sample.txt'
+        cache.response('/sample.txt')
+        path.write_bytes(b'a longer, changed sample file')
+        # make the change visible even on filesystems with coarse mtimes
+        os.utime(str(path), ns=(0, 0))
+        self.assertTrue(
+            cache.response('/sample.txt').endswith(b'changed sample file')
+        )
+        self.assertEqual(2, cache.misses)
+
+    def test_least_recently_used_evicted(self):
+        for name in ('a.txt', 'b.txt', 'c.txt'):
+            (self.webroot / name).write_bytes(b'x' * 100)
+        one = len(self.makeOne().response('/a.txt'))
+        cache = self.makeOne(max_bytes=one * 2)
+        cache.response('/a.txt')
+        cache.response('/b.txt')
+        cache.response('/a.txt')
+        cache.response('/c.txt')
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(one * 2, cache.size)
+        cache.response('/a.txt')
+        self.assertEqual(2, cache.hits)
+
+    def test_oversized_response_not_stored(self):
+        cache = self.makeOne(max_bytes=10)
+        self.assertIsNotNone(cache.response('/sample.txt'))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.size)
+
+
+class ParseTargetTestCase(unittest.TestCase):
+    """unit tests for the parse_target function"""
+
+    def call_function_under_test(self, uri):
+        from http_server import parse_target
+        return parse_target(uri)
+
+    def test_plain_path(self):
+        from http_server import LISTING_PAGE_SIZE
+        self.assertEqual(('/images', 0, LISTING_PAGE_SIZE),
+                         self.call_function_under_test('/images'))
+
+    def test_page(self):
+        self.assertEqual(('/images', 20, 10),
+                         self.call_function_under_test(
+                             '/images?offset=20&limit=10'))
+
+    def test_limit_capped(self):
+        from http_server import LISTING_PAGE_SIZE
+        _, _, limit = self.call_function_under_test('/?limit=100000000')
+        self.assertEqual(LISTING_PAGE_SIZE, limit)
+
+    def test_malformed_page(self):
+        for uri in ('/?offset=x', '/?limit=-1', '/?offset=-5'):
+            with self.assertRaises(ValueError):
+                self.call_function_under_test(uri)
+
+
+class ListingCacheTestCase(WebrootTestCase):
+    """unit tests for the ListingCache class"""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.webroot / 'many'
+        self.directory.mkdir()
+        for i in range(25):
+            (self.directory / 'file-{0:02d}.txt'.format(i)).touch()
+
+    def makeOne(self, max_bytes=1024 * 1024):
+        from http_server import ListingCache
+        return ListingCache(max_bytes=max_bytes)
+
+    def expected_lines(self):
+        return ['* webroot/many/file-{0:02d}.txt'.format(i).encode('utf8')
+                for i in range(25)]
+
+    def test_full_listing_sorted(self):
+        listing = self.makeOne().listing(self.directory)
+        self.assertEqual(b'\n'.join(self.expected_lines()), listing)
+
+    def test_pages(self):
+        cache = self.makeOne()
+        lines = self.expected_lines()
+        for offset, limit in ((0, 10), (10, 10), (20, 10), (24, 1), (5, 0),
+                              (25, 10), (100, 10)):
+            self.assertEqual(
+                b'\n'.join(lines[offset:offset + limit]),
+                cache.listing(self.directory, offset, limit)
+            )
+        self.assertEqual(1, cache.misses)
+
+    def test_change_detected(self):
+        cache = self.makeOne()
+        cache.listing(self.directory)
+        (self.directory / 'file-99.txt').touch()
+        # make the change visible even on filesystems with coarse mtimes
+        os.utime(str(self.directory), ns=(0, 0))
+        self.assertTrue(
+            cache.listing(self.directory).endswith(b'file-99.txt')
+        )
+        self.assertEqual(2, cache.misses)
+        cache.listing(self.directory)
+        self.assertEqual(1, cache.hits)
+
+    def test_least_recently_used_evicted(self):
+        one = self.makeOne()
+        one.listing(self.directory)
+        cache = self.makeOne(max_bytes=one.size + 1)
+        cache.listing(self.directory)
+        cache.listing(self.webroot)
+        cache.listing(self.webroot / 'images')
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(2, len(cache))
+
+    def test_paginated_request(self):
+        from http_server import handle_request
+        from http_parser import Request
+        request = Request('GET', '/many?offset=3&limit=2', 'HTTP/1.1', {})
+        response = handle_request(request)
+        self.assertTrue(response.endswith(
+            b'\r\n\r\n* webroot/many/file-03.txt\n'
+            b'* webroot/many/file-04.txt'
+        ))
+        request = Request('GET', '/many?offset=x', 'HTTP/1.1', {})
+        self.assertTrue(
+            handle_request(request).startswith(b'HTTP/1.1 400 Bad Request')
+        )
+
+
+class HandleRequestTestCase(WebrootTestCase):
+    """unit tests for the handle_request function"""
+
+    def call_function_under_test(self, method, uri, cache=None):
+        from http_server import handle_request
+        from http_parser import Request
+        request = Request(method, uri, 'HTTP/1.1', {})
+        return handle_request(request, cache)
+
+    def test_cached_and_uncached_agree(self):
+        from http_server import ContentCache
+        cache = ContentCache()
+        for uri in ('/sample.txt', '/images', '/missing.html'):
+            self.assertEqual(
+                self.call_function_under_test('GET', uri),
+                self.call_function_under_test('GET', uri, cache)
+            )
+
+    def test_query_string_ignored_for_files(self):
+        from http_server import ContentCache
+        expected = self.call_function_under_test('GET', '/sample.txt')
+        for uri in ('/sample.txt?limit=abc', '/sample.txt?offset=-3'):
+            for cache in (None, ContentCache()):
+                self.assertEqual(
+                    expected, self.call_function_under_test('GET', uri, cache)
+                )
+        response = self.call_function_under_test('GET', '/images?limit=abc')
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request'))
+
+    def test_method_not_allowed(self):
+        response = self.call_function_under_test('POST', '/sample.txt')
+        self.assertTrue(
+            response.startswith(b'HTTP/1.1 405 Method Not Allowed')
+        )
+
+
+class ReadRequestTestCase(unittest.TestCase):
+    """unit tests for the read_request function"""
+
+    def call_function_under_test(self, pieces):
+        from http_server import read_request
+        client, conn = socket.socketpair()
+        with client, conn:
+            for piece in pieces:
+                client.sendall(piece)
+            client.shutdown(socket.SHUT_WR)
+            return read_request(conn)
+
+    def test_request_split_across_segments(self):
+        request = self.call_function_under_test(
+            [b'GET /sample', b'.txt HTTP/1.1\r\nHo', b'st: x\r\n\r', b'\n']
+        )
+        self.assertEqual('/sample.txt', request.target)
+        self.assertEqual({'host': 'x'}, request.headers)
+
+    def test_closed_before_complete(self):
+        self.assertIsNone(self.call_function_under_test([b'GET / HTTP/1.1']))
+
+
+def _run_prefork(address, log_path, workers):
+    from http_server import prefork_server
+    with open(log_path, 'w', buffering=1) as log_buffer:
+        prefork_server(log_buffer=log_buffer, address=address,
+                       workers=workers)
+        print('returned with SIGINT handled by {0}'.format(
+            signal.getsignal(signal.SIGINT).__name__), file=log_buffer)
+
+
+class PreforkServerTestCase(WebrootTestCase):
+    """functional tests for prefork_server, run in a child process"""
+
+    def setUp(self):
+        super().setUp()
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.address = probe.getsockname()
+        self.log_path = os.path.abspath('server.log')
+        open(self.log_path, 'w').close()
+        self.master = multiprocessing.Process(
+            target=_run_prefork, args=(self.address, self.log_path, 2)
+        )
+        self.master.start()
+        self.wait_for(lambda: len(self.started()) == 2)
+
+    def tearDown(self):
+        if self.master.is_alive():
+            os.kill(self.master.pid, signal.SIGINT)
+        self.master.join(10)
+        if self.master.is_alive():
+            self.master.kill()
+        super().tearDown()
+
+    def log_lines(self):
+        with open(self.log_path) as f:
+            return f.read().splitlines()
+
+    def started(self):
+        return [int(line.split()[1]) for line in self.log_lines()
+                if line.startswith('worker ') and line.endswith(' started')]
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('timed out; log:\n' + '\n'.join(self.log_lines()))
+            time.sleep(0.05)
+
+    def fetch(self):
+        with socket.create_connection(self.address, timeout=5) as sock:
+            sock.sendall(b'GET /sample.txt HTTP/1.1\r\nHost: x\r\n\r\n')
+            chunks = []
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+
+    def assertServing(self):
+        for _ in range(4):
+            self.assertTrue(self.fetch().endswith(b'a sample file'))
+
+    def test_serves_from_workers(self):
+        self.assertServing()
+
+    def test_dead_worker_replaced(self):
+        victim = self.started()[0]
+        os.kill(victim, signal.SIGKILL)
+        self.wait_for(lambda: len(self.started()) == 3)
+        self.assertNotIn(victim, self.started()[2:])
+        self.assertServing()
+
+    def test_graceful_restart(self):
+        old = self.started()
+        os.kill(self.master.pid, signal.SIGHUP)
+        self.wait_for(lambda: len(self.started()) == 4)
+        stopped = ['worker {0} stopped'.format(pid) for pid in old]
+        self.wait_for(lambda: all(line in self.log_lines()
+                                  for line in stopped))
+        self.assertServing()
+
+    def test_interrupt_stops_workers(self):
+        os.kill(self.master.pid, signal.SIGINT)
+        self.master.join(10)
+        self.assertEqual(0, self.master.exitcode)
+        with self.assertRaises(OSError):
+            self.fetch()
+
+    def test_signal_handlers_restored(self):
+        os.kill(self.master.pid, signal.SIGINT)
+        self.master.join(10)
+        self.assertIn('returned with SIGINT handled by default_int_handler',
+                      self.log_lines())
+
+
+class WithContentLengthTestCase(unittest.TestCase):
+    """unit tests for the with_content_length function"""
+
+    def call_function_under_test(self, response):
+        from http_server import with_content_length
+        return with_content_length(response)
+
+    def test_body_length_added(self):
+        from http_server import response_ok
+        response = self.call_function_under_test(response_ok(b'12345'))
+        self.assertIn(b'\r\nContent-Length: 5\r\n\r\n12345', response)
+
+    def test_bodyless_response_framed(self):
+        from http_server import response_not_found
+        response = self.call_function_under_test(response_not_found())
+        self.assertEqual(
+            b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n', response
+        )
+
+
+def _run_async(address, log_path, keepalive_timeout):
+    from http_server import async_server
+    with open(log_path, 'w') as log_buffer:
+        async_server(log_buffer=log_buffer, address=address,
+                     keepalive_timeout=keepalive_timeout)
+
+
+class AsyncServerTestCase(WebrootTestCase):
+    """functional tests for async_server, run in a child process"""
+
+    def setUp(self):
+        super().setUp()
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.address = probe.getsockname()
+        self.server = multiprocessing.Process(
+            target=_run_async,
+            args=(self.address, os.path.abspath('server.log'), 0.5)
+        )
+        self.server.start()
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(self.address).close()
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+            else:
+                break
+
+    def tearDown(self):
+        os.kill(self.server.pid, signal.SIGINT)
+        self.server.join(10)
+        if self.server.is_alive():
+            self.server.kill()
+        super().tearDown()
+
+    def read_all(self, sock):
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def test_persistent_connection(self):
+        request = 'GET {0} HTTP/1.1\r\nHost: x\r\n\r\n'
+        big = os.urandom(300000)
+        (self.webroot / 'big.bin').write_bytes(big)
+        with socket.create_connection(self.address, timeout=5) as sock:
+            for uri in ('/sample.txt', '/big.bin', '/missing', '/images'):
+                sock.sendall(request.format(uri).encode('utf8'))
+            sock.sendall(b'GET /sample.txt HTTP/1.1\r\n'
+                         b'Connection: close\r\n\r\n')
+            response = self.read_all(sock)
+        self.assertEqual(5, response.count(b'HTTP/1.1 '))
+        self.assertEqual(2, response.count(b'\r\n\r\na sample file'))
+        self.assertIn(b'Content-Length: 300000\r\n\r\n' + big, response)
+        self.assertIn(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0',
+                      response)
+
+    def test_query_string_ignored_for_files(self):
+        with socket.create_connection(self.address, timeout=5) as sock:
+            sock.sendall(b'GET /sample.txt?x=1 HTTP/1.0\r\n\r\n')
+            response = self.read_all(sock)
+        self.assertIn(b'Content-Type: text/plain\r\n', response)
+        self.assertTrue(response.endswith(b'a sample file'))
+
+    def test_http_10_closes(self):
+        with socket.create_connection(self.address, timeout=5) as sock:
+            sock.sendall(b'GET /sample.txt HTTP/1.0\r\n\r\n')
+            response = self.read_all(sock)
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(response.endswith(b'a sample file'))
+
+    def test_idle_connection_closed(self):
+        with socket.create_connection(self.address, timeout=5) as sock:
+            self.assertEqual(b'', self.read_all(sock))
+
+    def test_malformed_request_answered(self):
+        with socket.create_connection(self.address, timeout=5) as sock:
+            sock.sendall(b'GET / HTTP/2.0\r\n\r\n')
+            response = self.read_all(sock)
+        self.assertTrue(response.startswith(b'HTTP/1.1 505'))
+
+
+if __name__ == '__main__':
+    unittest.main()
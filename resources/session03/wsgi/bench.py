@@ -0,0 +1,170 @@
+"""benchmarks for the book catalog
+
+Each benchmark is a sub-command and runs against a generated catalog,
+comparing `BookDB` with the dict of dicts it replaced.  Run it from this
+directory:
+
+    $ python bench.py memory --books 1000000
+    $ python bench.py query --books 1000000
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from bookdb import BookDB
+from bookdb import split_authors
+
+
+WORDS = ('python web network programming design essentials cookbook '
+         'pragmatic software master journeyman application development '
+         'foundations rapid edition guide practical advanced data systems '
+         'fluent effective modern concurrency testing patterns').split()
+NAMES = ('Alex Anna Allen Andrew David John Sylvain Brett Luciano Raymond '
+         'Guido Barry Nick Tim Carol Grace Ada Linus').split()
+SURNAMES = ('Martelli Ravenscroft Ascher Downey Goerzen Hunt Thomas '
+            'Hellegouarch Slatkin Ramalho Hettinger Rossum Warsaw Coghlan '
+            'Peters Willing Hopper Lovelace Torvalds').split()
+PUBLISHERS = ["O'Reilly Media", 'Apress', 'Packt Publishing',
+              'Cambridge University Press', 'Addison-Wesley Professional',
+              'No Starch Press', 'Manning Publications']
+
+
+def make_catalog(count, seed=0):
+    """a dict of `count` made-up books in the shape of bookdb.database"""
+    rng = random.Random(seed)
+    books = {}
+    for i in range(count):
+        authors = ', '.join(
+            '{0} {1}'.format(rng.choice(NAMES), rng.choice(SURNAMES))
+            for _ in range(rng.randint(1, 3)))
+        books['id{0}'.format(i)] = {
+            'title': ' '.join(rng.choice(WORDS)
+                              for _ in range(rng.randint(3, 8))).title()
+            + ' {0}'.format(i),
+            'isbn': '978-{0:010d}'.format(i),
+            'publisher': rng.choice(PUBLISHERS),
+            'author': authors,
+        }
+    return books
+
+
+def dict_titles(books):
+    """titles as BookDB.titles used to make them, anew each time"""
+    return [dict(id=id, title=books[id]['title']) for id in books.keys()]
+
+
+def dict_search(books, field, text):
+    """ids of books whose `field` contains `text`, looking at every book
+    """
+    text = text.casefold()
+    return [id for id, book in books.items()
+            if text in book[field].casefold()]
+
+
+def dict_by_isbn(books, isbn):
+    for id, book in books.items():
+        if book['isbn'].replace('-', '') == isbn.replace('-', ''):
+            return id
+    return None
+
+
+def _allocated(make):
+    gc.collect()
+    tracemalloc.start()
+    value = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def bench_memory(args):
+    """memory held by the catalog as a dict of dicts and as a BookDB"""
+    print('{0:<20} {1:>10}'.format('catalog', 'MiB'))
+    books, size = _allocated(lambda: make_catalog(args.books))
+    print('{0:<20} {1:>10.1f}'.format('dict of dicts', size / 2 ** 20))
+    del books
+    db, size = _allocated(lambda: BookDB(make_catalog(args.books)))
+    print('{0:<20} {1:>10.1f}'.format('BookDB', size / 2 ** 20))
+    _, size = _allocated(lambda: (db.search('x'), db.search('x', 'author')))
+    print('{0:<20} {1:>10.1f}'.format('+ search indexes', size / 2 ** 20))
+    _, size = _allocated(db.titles)
+    print('{0:<20} {1:>10.1f}'.format('+ titles list', size / 2 ** 20))
+
+
+def _time(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_query(args):
+    """ms per query, dict of dicts vs BookDB"""
+    books = make_catalog(args.books)
+    start = time.perf_counter()
+    db = BookDB(books)
+    print('BookDB built in {0:.0f} ms'.format(
+        (time.perf_counter() - start) * 1000))
+    start = time.perf_counter()
+    db.search('x')
+    db.search('x', 'author')
+    print('indexes built in {0:.0f} ms'.format(
+        (time.perf_counter() - start) * 1000))
+    middle = 'id{0}'.format(args.books // 2)
+    isbn = books[middle]['isbn']
+    queries = [
+        ('titles()', lambda: dict_titles(books), db.titles),
+        ('title_info', lambda: books.get(middle),
+         lambda: db.title_info(middle)),
+        ('by isbn', lambda: dict_by_isbn(books, isbn),
+         lambda: db.by_isbn(isbn)),
+        ('author exact',
+         lambda: [id for id, book in books.items() if 'ada torvalds' in
+                  map(str.casefold, split_authors(book['author']))],
+         lambda: db.search('ada torvalds', 'author', exact=True)),
+        ('title prefix',
+         lambda: [id for id, book in books.items() if book['title']
+                  .casefold().startswith('fluent python rapid')],
+         lambda: db.search('fluent python rapid', prefix=True)),
+        ('title substring',
+         lambda: dict_search(books, 'title', 'guide fluent testing'),
+         lambda: db.search('guide fluent testing')),
+        ('title substring, rare',
+         lambda: dict_search(books, 'title', str(args.books - 1)),
+         lambda: db.search(str(args.books - 1))),
+    ]
+    print('{0:<24} {1:>12} {2:>12}'.format('query', 'dicts ms', 'BookDB ms'))
+    for name, old, new in queries:
+        # BookDB answers from caches after the first time
+        expected, actual = old(), new()
+        if name != 'titles()' and isinstance(expected, list):
+            expected, actual = sorted(expected), sorted(actual)
+        assert expected == actual, name
+        print('{0:<24} {1:>12.4f} {2:>12.4f}'.format(
+            name, _time(old, args.repeat), _time(new, args.repeat)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    memory = commands.add_parser('memory', help='memory held per catalog')
+    memory.add_argument('--books', type=int, default=1000000)
+    memory.set_defaults(func=bench_memory)
+
+    query = commands.add_parser('query', help='query latency')
+    query.add_argument('--books', type=int, default=1000000)
+    query.add_argument('--repeat', type=int, default=5)
+    query.set_defaults(func=bench_query)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
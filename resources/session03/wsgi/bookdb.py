@@ -1,13 +1,294 @@
+"""the book catalog behind bookapp
+
+`BookDB` keeps its books in columns rather than a dict per book: each
+field of every book is stored end to end as UTF-8 in one buffer, so a
+value costs its bytes and an offset instead of a str object and a slot in
+a dict.  Books are found by id and ISBN through dicts kept up to date as
+books are added and removed.  Titles and authors are searched, ignoring
+case, through sorted indexes that are built on first use and again only
+after a change:
+
+    >>> db = BookDB()
+    >>> db.search('python', 'title', prefix=True)
+    ['id4', 'id2']
+    >>> db.search('ravenscroft', 'author')
+    ['id4']
+
+The list `titles` returns is kept the same way, so asking for it again
+costs a copy of the list rather than a dict per book.
+"""
+import bisect
+import itertools
+from array import array
+
+
+FIELDS = ('title', 'isbn', 'publisher', 'author')
+# above any character that can follow a prefix
+_LAST = '\U0010ffff'
+
+
+def normalize_isbn(isbn):
+    """the digits of an ISBN, and a final X, without dashes or spaces"""
+    return isbn.replace('-', '').replace(' ', '').upper()
+
+
+def _isbn_key(isbn):
+    """an ISBN as the ISBN index holds it: as a number, which takes less
+    room than the text, unless it is not one
+    """
+    isbn = normalize_isbn(isbn)
+    if isbn.isdigit() and len(isbn) in (10, 13):
+        return int(isbn)
+    return isbn
+
+
+def split_authors(author):
+    """the names in an author field, such as 'Andrew Hunt, David Thomas'"""
+    return [name for name in map(str.strip, author.split(',')) if name]
+
+
+def _bisect(text, hi, key_at):
+    """the first position below `hi` whose key, read through `key_at`, is
+    not below `text`, of keys in sorted order
+    """
+    lo = 0
+    while lo < hi:
+        middle = (lo + hi) // 2
+        if key_at(middle) < text:
+            lo = middle + 1
+        else:
+            hi = middle
+    return lo
+
+
+class _TextIndex():
+    """rows found by their text, ignoring case, exactly, by prefix or by
+    substring
+
+    The folded texts are kept once, in sorted order, in a single string
+    with a newline after each, and their starting offsets in an array, so
+    a substring search is a run of `str.find` over the whole index.
+    """
+
+    def __init__(self, texts, rows):
+        texts = [text.casefold().replace('\n', ' ') for text in texts]
+        order = sorted(range(len(texts)), key=texts.__getitem__)
+        texts = [texts[i] for i in order]
+        self.rows = array('q', [rows[i] for i in order])
+        self.starts = array('q', itertools.accumulate(
+            [len(text) + 1 for text in texts], initial=0))
+        self.blob = '\n'.join(texts) + '\n'
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _key(self, i):
+        return self.blob[self.starts[i]:self.starts[i + 1] - 1]
+
+    def _range(self, low, high):
+        return (_bisect(low, len(self), self._key),
+                _bisect(high, len(self), self._key))
+
+    def exact(self, text):
+        text = text.casefold()
+        lo, hi = self._range(text, text + '\0')
+        return self.rows[lo:hi]
+
+    def prefix(self, text):
+        text = text.casefold()
+        lo, hi = self._range(text, text + _LAST)
+        return self.rows[lo:hi]
+
+    def substring(self, text):
+        text = text.casefold()
+        if not text or '\n' in text:
+            return array('q')
+        rows = array('q')
+        position = self.blob.find(text)
+        while position != -1:
+            i = bisect.bisect_right(self.starts, position) - 1
+            rows.append(self.rows[i])
+            # one match per text is enough
+            position = self.blob.find(text, self.starts[i + 1])
+        return rows
+
+
+class _Column():
+    """strings stored end to end as UTF-8, read back by position"""
+
+    def __init__(self, values=()):
+        self.data = bytearray()
+        # where each value ends in `data`
+        self.ends = array('q')
+        self.extend(values)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        start = self.ends[i - 1] if i else 0
+        return self.data[start:self.ends[i]].decode('utf8')
+
+    def __iter__(self):
+        start = 0
+        for end in self.ends:
+            yield self.data[start:end].decode('utf8')
+            start = end
+
+    def extend(self, values):
+        encoded = [value.encode('utf8') for value in values]
+        ends = itertools.accumulate(map(len, encoded), initial=len(self.data))
+        self.ends.extend(itertools.islice(ends, 1, None))
+        self.data += b''.join(encoded)
+
+    def take(self, rows):
+        """a column of the values at `rows`"""
+        return _Column([self[row] for row in rows])
+
 
 class BookDB():
+    """a catalog of books, each a dict of FIELDS under an id
+
+    Starts out holding `books`, a mapping of id to book, which defaults to
+    `database`.
+    """
+
+    def __init__(self, books=None):
+        self._ids = []
+        self._columns = {field: _Column() for field in FIELDS}
+        # id -> row, and ISBN key -> row, of the books held
+        self._rows = {}
+        self._isbns = {}
+        self._removed = 0
+        self._clear_caches()
+        self.update(database if books is None else books)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, id):
+        return id in self._rows
+
+    def _clear_caches(self):
+        self._titles = None
+        self._indexes = {}
+
+    def add(self, id, book):
+        """hold `book`, a dict of FIELDS, under `id`, replacing any book
+        already there
+        """
+        self.update({id: book})
+
+    def update(self, books):
+        """hold each book of `books`, a mapping of id to book, as `add`
+        would, a column at a time
+        """
+        for id in books:
+            if id in self._rows:
+                self.remove(id)
+        start = len(self._ids)
+        self._ids.extend(books)
+        for field in FIELDS:
+            self._columns[field].extend(
+                [book[field] for book in books.values()])
+        # one int object per row, shared by both indexes
+        rows = list(range(start, len(self._ids)))
+        self._rows.update(zip(books, rows))
+        isbns = [book['isbn'] for book in books.values()]
+        self._isbns.update(zip(map(_isbn_key, isbns), rows))
+        self._clear_caches()
+
+    def remove(self, id):
+        """drop the book with `id`; raises KeyError if there is none"""
+        row = self._rows.pop(id)
+        isbn = _isbn_key(self._columns['isbn'][row])
+        if self._isbns.get(isbn) == row:
+            del self._isbns[isbn]
+        # the row is left as it is until there are enough to compact
+        self._ids[row] = None
+        self._removed += 1
+        if self._removed > len(self._rows):
+            self._compact()
+        self._clear_caches()
+
+    def _compact(self):
+        """drop the rows of removed books"""
+        live = [row for row, id in enumerate(self._ids) if id is not None]
+        self._ids = [self._ids[row] for row in live]
+        for field in FIELDS:
+            self._columns[field] = self._columns[field].take(live)
+        rows = list(range(len(self._ids)))
+        self._rows = dict(zip(self._ids, rows))
+        isbns = self._columns['isbn']
+        self._isbns = {_isbn_key(isbns[row]): row for row in rows}
+        self._removed = 0
+
     def titles(self):
-        titles = [
-            dict(id=id, title=database[id]['title']) for id in database.keys()
-        ]
-        return titles
+        """a list of {'id': id, 'title': title}, one per book"""
+        if self._titles is None:
+            self._titles = [
+                dict(id=id, title=title)
+                for id, title in zip(self._ids, self._columns['title'])
+                if id is not None
+            ]
+        return list(self._titles)
+
+    def _book(self, row):
+        return {field: self._columns[field][row] for field in FIELDS}
 
     def title_info(self, id):
-        return database.get(id, None)
+        """the book with `id`, or None"""
+        row = self._rows.get(id)
+        if row is None:
+            return None
+        return self._book(row)
+
+    def by_isbn(self, isbn):
+        """the id of the book with `isbn`, written with or without dashes,
+        or None
+        """
+        row = self._isbns.get(_isbn_key(isbn))
+        return None if row is None else self._ids[row]
+
+    def _index(self, field):
+        index = self._indexes.get(field)
+        if index is None:
+            column = self._columns[field]
+            live = [row for row, id in enumerate(self._ids) if id is not None]
+            if field == 'author':
+                texts, rows = [], []
+                for row in live:
+                    names = split_authors(column[row])
+                    texts += names
+                    rows += [row] * len(names)
+            elif field == 'title':
+                texts, rows = [column[row] for row in live], live
+            else:
+                raise ValueError('{0!r} cannot be searched'.format(field))
+            index = self._indexes[field] = _TextIndex(texts, rows)
+        return index
+
+    def search(self, text, field='title', prefix=False, exact=False):
+        """the ids of books whose title or author, ignoring case, contains
+        `text`, or starts with or is it if `prefix` or `exact`
+
+        Ids come in order of the matching text.  An author field naming
+        several authors is searched name by name.
+        """
+        index = self._index(field)
+        if exact:
+            rows = index.exact(text)
+        elif prefix:
+            rows = index.prefix(text)
+        else:
+            rows = index.substring(text)
+        ids = []
+        seen = set()
+        for row in rows:
+            if row not in seen:
+                seen.add(row)
+                ids.append(self._ids[row])
+        return ids
 
 
 # let's pretend we're getting this information from a database somewhere
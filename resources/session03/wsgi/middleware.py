@@ -0,0 +1,295 @@
+"""WSGI middleware for seeing where the time goes
+
+Each middleware wraps any `application(environ, start_response)` callable
+and is itself one, so they stack without changes to the application:
+
+    application = Timing(SlowRequestLog(SamplingProfiler(application)))
+
+`Timing` adds a Server-Timing header with the wall and CPU time spent on
+each request.  `SamplingProfiler` runs one request in `every` under
+cProfile and adds the profiles up, to be dumped as pstats.
+`SlowRequestLog` writes each request slower than a threshold to
+wsgi.errors, with the stack of the thread serving it as it was once the
+request became slow.
+
+Serve an application with all three from the command line:
+
+    $ python middleware.py bookapp:application
+    $ python middleware.py --path ../calculator calculator:application \\
+          --profile-every 10 --profile-path calculator.pstats --slow 0.5
+"""
+import argparse
+import cProfile
+import importlib
+import itertools
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+
+class _Body():
+    """the chunks of a response body, calling `on_close` once it is done
+
+    Servers call `close` when they are finished with a body, sent or not,
+    so that is when a request is over.  The wrapped body's own `close` is
+    called first, as the server would have.
+    """
+
+    def __init__(self, chunks, body, on_close):
+        self.chunks = chunks
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.on_close()
+
+
+class Timing():
+    """adds a Server-Timing header with the wall and CPU milliseconds
+    spent on a request
+
+    Headers go out before the body, so what is timed is the application
+    call and producing the first chunk of the body; for a body returned as
+    a list that is all of it.  Starting the response is put off until
+    then.  CPU time is that of the thread serving the request.
+    """
+
+    def __init__(self, application, clock=time.perf_counter,
+                 cpu_clock=time.thread_time):
+        self.application = application
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+
+    def __call__(self, environ, start_response):
+        started, cpu_started = self.clock(), self.cpu_clock()
+        response = []
+
+        def start(status, headers, exc_info=None):
+            if exc_info is not None and writes:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers, exc_info]
+            return write
+
+        def send_headers():
+            status, headers, exc_info = response
+            headers = headers + [('Server-Timing', self.header(
+                self.clock() - started, self.cpu_clock() - cpu_started))]
+            writes.append(start_response(status, headers, exc_info))
+
+        writes = []
+
+        def write(data):
+            # an application using write has to start the response first
+            if not writes:
+                send_headers()
+            writes[0](data)
+
+        body = self.application(environ, start)
+        chunks = iter(body)
+        try:
+            first = [next(chunks)] if not writes else []
+        except StopIteration:
+            first = []
+        except BaseException:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+            raise
+        if not writes:
+            send_headers()
+        return _Body(itertools.chain(first, chunks), body, lambda: None)
+
+    @staticmethod
+    def header(wall, cpu):
+        return 'app;dur={0:.3f}, cpu;dur={1:.3f}'.format(wall * 1000,
+                                                         cpu * 1000)
+
+
+class SamplingProfiler():
+    """profiles one request in `every`, adding the profiles up in `stats`
+
+    A sampled request is profiled from the application call until its body
+    is produced, so its body is produced in full before it is sent.  Only
+    one request is profiled at a time; a request due to be sampled while
+    another is being profiled is run as usual.  With a `path`, the stats
+    so far are dumped there after each sampled request, for pstats or any
+    tool that reads it.
+    """
+
+    def __init__(self, application, every=100, path=None):
+        self.application = application
+        self.every = every
+        self.path = path
+        self.stats = None
+        self.sampled = 0
+        self._count = itertools.count()
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if next(self._count) % self.every or not self._lock.acquire(False):
+            return self.application(environ, start_response)
+        try:
+            profile = cProfile.Profile()
+            chunks = profile.runcall(self._run, environ, start_response)
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.sampled += 1
+            if self.path is not None:
+                self.stats.dump_stats(self.path)
+        finally:
+            self._lock.release()
+        return chunks
+
+    def _run(self, environ, start_response):
+        body = self.application(environ, start_response)
+        try:
+            return list(body)
+        finally:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+
+    def dump(self, path):
+        """write the stats so far to `path`"""
+        with self._lock:
+            if self.stats is not None:
+                self.stats.dump_stats(path)
+
+
+class SlowRequestLog():
+    """writes requests that take longer than `threshold` seconds to
+    wsgi.errors, with where they were once they became slow
+
+    A watcher thread looks over the requests in progress every `interval`
+    seconds, a tenth of `threshold` unless given, and takes the stack of
+    the thread serving any that has run past the threshold.  A request is
+    over when the server closes its body.
+    """
+
+    def __init__(self, application, threshold=1.0, interval=None,
+                 clock=time.monotonic):
+        self.application = application
+        self.threshold = threshold
+        self.interval = threshold / 10 if interval is None else interval
+        self.clock = clock
+        self.slow = 0
+        # id of a request in progress -> [thread id, started, stack]
+        self._active = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def __call__(self, environ, start_response):
+        self._watch()
+        request = next(self._ids)
+        started = self.clock()
+        with self._lock:
+            self._active[request] = [threading.get_ident(), started, None]
+
+        def finish():
+            with self._lock:
+                stack = self._active.pop(request)[2]
+            elapsed = self.clock() - started
+            if elapsed >= self.threshold:
+                self.slow += 1
+                self.log(environ, elapsed, stack)
+
+        try:
+            body = self.application(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+        return _Body(body, body, finish)
+
+    def log(self, environ, elapsed, stack):
+        message = 'slow request: {0} {1} took {2:.3f}s\n'.format(
+            environ.get('REQUEST_METHOD', 'GET'),
+            environ.get('PATH_INFO', ''), elapsed)
+        if stack is not None:
+            message += ''.join(stack)
+        environ.get('wsgi.errors', sys.stderr).write(message)
+
+    def _watch(self):
+        if self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._run,
+                                                 daemon=True)
+                self._watcher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.capture()
+
+    def capture(self):
+        """take the stacks of requests that have just become slow"""
+        now = self.clock()
+        frames = sys._current_frames()
+        with self._lock:
+            for entry in self._active.values():
+                thread, started, stack = entry
+                frame = frames.get(thread)
+                if (stack is None and frame is not None
+                        and now - started >= self.threshold):
+                    entry[2] = traceback.format_stack(frame)
+
+
+def instrument(application, profile_every=None, profile_path=None,
+               slow=None):
+    """`application` with Timing, and a SlowRequestLog and a
+    SamplingProfiler if asked for
+    """
+    if profile_every:
+        application = SamplingProfiler(application, profile_every,
+                                       profile_path)
+    if slow:
+        application = SlowRequestLog(application, slow)
+    return Timing(application)
+
+
+def load(name, path=None):
+    """the application named 'module:attribute', importing the module
+    from `path` if given
+    """
+    module, _, attribute = name.partition(':')
+    if path is not None:
+        sys.path.insert(0, path)
+    return getattr(importlib.import_module(module),
+                   attribute or 'application')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('application', help='module:attribute to serve')
+    parser.add_argument('--path', help='directory to import it from')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--profile-every', type=int,
+                        help='profile one request in this many')
+    parser.add_argument('--profile-path', default='wsgi.pstats')
+    parser.add_argument('--slow', type=float,
+                        help='log requests slower than this many seconds')
+    args = parser.parse_args(argv)
+
+    from wsgiref.simple_server import make_server
+    application = instrument(load(args.application, args.path),
+                             args.profile_every, args.profile_path, args.slow)
+    srv = make_server('localhost', args.port, application)
+    srv.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
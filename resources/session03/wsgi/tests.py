@@ -44,6 +44,91 @@ class BookDBTestCase(BookAppTestCase):
             self.assertEqual(actual, expected)
 
 
+class BookDBSearchTestCase(BookAppTestCase):
+    """tests for adding, removing and finding books in a BookDB"""
+
+    def makeOne(self):
+        from bookdb import BookDB
+        return BookDB()
+
+    def book(self, title='Fluent Python', author='Luciano Ramalho',
+             isbn='978-1491946008'):
+        return {'title': title, 'isbn': isbn, 'publisher': "O'Reilly Media",
+                'author': author}
+
+    def test_titles_cached_until_changed(self):
+        db = self.makeOne()
+        titles = db.titles()
+        titles.clear()
+        self.assertEqual(len(db.titles()), len(self.db))
+        self.assertIs(db.titles()[0], db.titles()[0])
+        db.add('id6', self.book())
+        self.assertIn({'id': 'id6', 'title': 'Fluent Python'}, db.titles())
+        db.remove('id1')
+        self.assertNotIn('id1', [title['id'] for title in db.titles()])
+
+    def test_add_replaces(self):
+        db = self.makeOne()
+        db.add('id1', self.book())
+        self.assertEqual(len(db), len(self.db))
+        self.assertEqual(db.title_info('id1'), self.book())
+        self.assertEqual(db.by_isbn('978-1904811848'), None)
+        self.assertEqual(db.search('cherrypy'), [])
+        self.assertEqual(db.search('fluent'), ['id1'])
+
+    def test_remove(self):
+        db = self.makeOne()
+        db.remove('id4')
+        self.assertNotIn('id4', db)
+        self.assertIsNone(db.title_info('id4'))
+        self.assertIsNone(db.by_isbn('978-0-596-00797-3'))
+        self.assertEqual(db.search('python', prefix=True), ['id2'])
+        self.assertRaises(KeyError, db.remove, 'id4')
+
+    def test_removed_rows_compacted(self):
+        db = self.makeOne()
+        for book_id in ('id1', 'id2', 'id3'):
+            db.remove(book_id)
+        self.assertEqual(len(db._ids), 2)
+        self.assertEqual(db.title_info('id5'), self.db['id5'])
+        self.assertEqual(db.by_isbn('9780201616224'), 'id5')
+        db.add('id1', self.db['id1'])
+        self.assertEqual(sorted(db.search('p')), ['id1', 'id4', 'id5'])
+
+    def test_by_isbn(self):
+        db = self.makeOne()
+        self.assertEqual(db.by_isbn('978-1430230038'), 'id3')
+        self.assertEqual(db.by_isbn('9780596007973'), 'id4')
+        self.assertEqual(db.by_isbn('978 0 596 00797 3'), 'id4')
+        self.assertIsNone(db.by_isbn('978-0000000000'))
+
+    def test_search_titles(self):
+        db = self.makeOne()
+        self.assertEqual(db.search('PYTHON', prefix=True), ['id4', 'id2'])
+        self.assertEqual(db.search('python cookbook, second edition',
+                                   exact=True), ['id4'])
+        self.assertEqual(db.search('python cookbook', exact=True), [])
+        self.assertEqual(sorted(db.search('python')),
+                         ['id1', 'id2', 'id3', 'id4'])
+        self.assertEqual(db.search('programm'), ['id3', 'id5'])
+        self.assertEqual(db.search('nowhere'), [])
+        self.assertEqual(db.search('python\n'), [])
+
+    def test_search_authors(self):
+        db = self.makeOne()
+        self.assertEqual(db.search('anna ravenscroft', 'author',
+                                   exact=True), ['id4'])
+        self.assertEqual(db.search('David', 'author', prefix=True),
+                         ['id4', 'id5'])
+        self.assertEqual(db.search('downey', 'author'), ['id2'])
+        # one id for a book matching more than one of its authors
+        self.assertEqual(db.search('a', 'author', prefix=True),
+                         ['id4', 'id2', 'id5'])
+
+    def test_other_fields_not_searched(self):
+        self.assertRaises(ValueError, self.makeOne().search, 'x', 'isbn')
+
+
 class ResolvePathTestCase(BookAppTestCase):
     """tests for the resolve_path function"""
 
@@ -124,5 +209,157 @@ class BookTestCase(BookAppTestCase):
         self.assertRaises(NameError, self.call_function_under_test, bad_id)
 
 
+def hello(environ, start_response):
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return [b'hello ', environ.get('PATH_INFO', '/').encode('utf8')]
+
+
+class MiddlewareTestCase(unittest.TestCase):
+    """shared functionality for the middleware tests"""
+
+    def call_function_under_test(self, application, path='/'):
+        import io
+        responses = []
+
+        def start_response(status, headers, exc_info=None):
+            responses.append((status, dict(headers)))
+            return writes.append
+
+        writes = []
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                   'wsgi.errors': io.StringIO()}
+        body = application(environ, start_response)
+        try:
+            chunks = writes + list(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        status, headers = responses[0]
+        return status, headers, b''.join(chunks), environ['wsgi.errors']
+
+
+class TimingTestCase(MiddlewareTestCase):
+    """tests for the Timing middleware"""
+
+    def makeOne(self, application):
+        import itertools
+        from middleware import Timing
+        # each clock moves on 2ms a reading, the CPU clock 1ms
+        clock = itertools.count(0, 0.002)
+        cpu_clock = itertools.count(0, 0.001)
+        return Timing(application, lambda: next(clock),
+                      lambda: next(cpu_clock))
+
+    def test_timing_header_added(self):
+        status, headers, body, _ = self.call_function_under_test(
+            self.makeOne(hello), '/there')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, b'hello /there')
+        self.assertEqual(headers['Content-type'], 'text/plain')
+        self.assertEqual(headers['Server-Timing'],
+                         'app;dur=2.000, cpu;dur=1.000')
+
+    def test_response_started_from_body(self):
+        closed = []
+
+        def application(environ, start_response):
+            try:
+                start_response('201 Created', [])
+                yield b'made'
+            finally:
+                closed.append(True)
+
+        status, headers, body, _ = self.call_function_under_test(
+            self.makeOne(application))
+        self.assertEqual(status, '201 Created')
+        self.assertIn('Server-Timing', headers)
+        self.assertEqual(body, b'made')
+        self.assertEqual(closed, [True])
+
+    def test_write_callable(self):
+        def application(environ, start_response):
+            write = start_response('200 OK', [])
+            write(b'written ')
+            return [b'returned']
+
+        status, headers, body, _ = self.call_function_under_test(
+            self.makeOne(application))
+        self.assertIn('Server-Timing', headers)
+        self.assertEqual(body, b'written returned')
+
+
+class SamplingProfilerTestCase(MiddlewareTestCase):
+    """tests for the SamplingProfiler middleware"""
+
+    def test_one_request_in_every_profiled(self):
+        import os
+        import pstats
+        import tempfile
+        from middleware import SamplingProfiler
+        with tempfile.TemporaryDirectory() as base:
+            path = os.path.join(base, 'hello.pstats')
+            profiler = SamplingProfiler(hello, every=3, path=path)
+            for i in range(7):
+                _, _, body, _ = self.call_function_under_test(profiler)
+                self.assertEqual(body, b'hello /')
+            self.assertEqual(profiler.sampled, 3)
+            functions = [name for _, _, name in pstats.Stats(path).stats]
+        self.assertIn('hello', functions)
+
+
+class SlowRequestLogTestCase(MiddlewareTestCase):
+    """tests for the SlowRequestLog middleware"""
+
+    def makeOne(self, application):
+        from middleware import SlowRequestLog
+        return SlowRequestLog(application, threshold=0.05, interval=0.01)
+
+    def test_slow_request_logged_with_stack(self):
+        import time
+
+        def dawdle(environ, start_response):
+            time.sleep(0.2)
+            return hello(environ, start_response)
+
+        log = self.makeOne(dawdle)
+        _, _, body, errors = self.call_function_under_test(log, '/sleepy')
+        self.assertEqual(body, b'hello /sleepy')
+        self.assertEqual(log.slow, 1)
+        message = errors.getvalue()
+        self.assertIn('slow request: GET /sleepy took', message)
+        self.assertIn('in dawdle', message)
+
+    def test_slow_body_counts(self):
+        import time
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            yield b'slow'
+            time.sleep(0.1)
+
+        log = self.makeOne(application)
+        self.call_function_under_test(log)
+        self.assertEqual(log.slow, 1)
+
+    def test_fast_request_not_logged(self):
+        log = self.makeOne(hello)
+        _, _, _, errors = self.call_function_under_test(log)
+        self.assertEqual(log.slow, 0)
+        self.assertEqual(errors.getvalue(), '')
+
+
+class InstrumentTestCase(MiddlewareTestCase):
+    """tests for the instrument function"""
+
+    def test_stack(self):
+        from middleware import instrument
+        application = instrument(hello, profile_every=1, slow=10)
+        status, headers, body, _ = self.call_function_under_test(
+            application)
+        self.assertEqual(body, b'hello /')
+        self.assertIn('Server-Timing', headers)
+        self.assertEqual(application.application.application.sampled, 1)
+
+
 if __name__ == '__main__':
     unittest.main()